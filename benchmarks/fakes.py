@@ -0,0 +1,247 @@
+"""Local stand-ins for the Telegram Bot API, Gemini and SerpApi with configurable latency."""
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+LOREM = (
+    "The **key idea** is to keep the event loop free. Here is an example:\n\n"
+    "```python\nasync def handler(update):\n    await reply(update)\n```\n\n"
+    "- First point with `inline code`\n- Second point with a [link](https://example.com)\n\n"
+    "Note: results vary with load. "
+)
+
+@dataclass
+class Latency:
+    """Simulated service time of each backend, in seconds"""
+    bot_api: float = 0.02
+    gemini: float = 0.3
+    serpapi: float = 0.2
+    jitter: float = 0.1  # +/- fraction applied to every delay
+
+    def sample(self, base: float) -> float:
+        if not base:
+            return 0.0
+        return max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter)))
+
+def fake_quiz_questions(topic: str, count: int) -> List[Dict[str, Any]]:
+    salt = random.getrandbits(32)
+    return [
+        {
+            'question': f"Question {salt}-{i} about {topic}?",
+            'options': [f"Option {salt}-{i}-{j}" for j in range(4)],
+            'answer': random.randrange(4)
+        }
+        for i in range(count)
+    ]
+
+class FakeBackend:
+    """One local HTTP/1.1 server answering Bot API, Gemini and SerpApi requests.
+
+    Routes:
+      ``/bot<token>/<method>``                    Telegram Bot API
+      ``/v1*/models/<model>:generateContent``     Gemini (JSON mode returns quiz questions)
+      ``/v1*/models/<model>:streamGenerateContent``  Gemini server-sent events
+      ``/search``                                 SerpApi
+
+    Every request is counted per route so benchmarks can report calls per
+    update. The last inline keyboard sent to each chat is kept, which lets
+    a driver press buttons like a user would.
+    """
+
+    def __init__(self, latency: Optional[Latency] = None, reply_chars: int = 600, stream_chunks: int = 8):
+        self.latency = latency or Latency()
+        self.reply_chars = reply_chars
+        self.stream_chunks = stream_chunks
+        self.calls: Counter = Counter()
+        self.keyboards: Dict[int, List[str]] = {}
+        self._message_ids: Dict[int, int] = defaultdict(int)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.url = ''
+
+    async def start(self, host: str = '127.0.0.1') -> str:
+        self._server = await asyncio.start_server(self._handle, host, 0)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def reset(self):
+        self.calls.clear()
+
+    # -- HTTP plumbing ---------------------------------------------------
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = b''
+                if 'content-length' in headers:
+                    body = await reader.readexactly(int(headers['content-length']))
+                await self._route(writer, method, target, headers, body)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logger.error(f"Fake backend error: {e}")
+        finally:
+            writer.close()
+
+    async def _send(self, writer, status: int, payload: Any):
+        body = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    async def _send_events(self, writer, events: List[Any], interval: float):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        for event in events:
+            await asyncio.sleep(interval)
+            data = f"data: {json.dumps(event)}\r\n\r\n".encode()
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _route(self, writer, method: str, target: str, headers: Dict[str, str], body: bytes):
+        url = urlsplit(target)
+        path = url.path
+        if path.startswith('/bot'):
+            _, _, api_method = path.rpartition('/')
+            self.calls[f"bot_api.{api_method}"] += 1
+            await asyncio.sleep(self.latency.sample(self.latency.bot_api))
+            params = self._form(headers, body)
+            await self._send(writer, 200, {'ok': True, 'result': self._bot_api(api_method, params)})
+        elif ':streamGenerateContent' in path:
+            self.calls['gemini.stream'] += 1
+            text = self.reply_text()
+            size = -(-len(text) // self.stream_chunks)
+            events = [
+                {'candidates': [{'content': {'parts': [{'text': text[i:i + size]}]}}]}
+                for i in range(0, len(text), size)
+            ]
+            await self._send_events(writer, events, self.latency.sample(self.latency.gemini) / len(events))
+        elif ':generateContent' in path:
+            request = json.loads(body or b'{}')
+            await asyncio.sleep(self.latency.sample(self.latency.gemini))
+            if request.get('generationConfig', {}).get('responseMimeType') == 'application/json':
+                self.calls['gemini.quiz'] += 1
+                prompt = request['contents'][0]['parts'][0]['text']
+                topic = prompt.split('"')[1] if '"' in prompt else 'general'
+                words = prompt.split()
+                count = int(words[1]) if len(words) > 1 and words[1].isdigit() else 10
+                text = json.dumps(fake_quiz_questions(topic, count))
+            else:
+                self.calls['gemini.generate'] += 1
+                text = self.reply_text()
+            await self._send(writer, 200, {'candidates': [{'content': {'parts': [{'text': text}]}}]})
+        elif path == '/search':
+            self.calls['serpapi.search'] += 1
+            await asyncio.sleep(self.latency.sample(self.latency.serpapi))
+            query = parse_qs(url.query).get('q', [''])[0]
+            num = int(parse_qs(url.query).get('num', ['5'])[0])
+            await self._send(writer, 200, {'organic_results': [
+                {'title': f"{query} result {i}", 'link': f"https://example.com/{i}",
+                 'snippet': f"Snippet {i} about {query}. " * 3}
+                for i in range(num)
+            ]})
+        else:
+            self.calls['not_found'] += 1
+            await self._send(writer, 404, {'error': 'not found'})
+
+    @staticmethod
+    def _form(headers: Dict[str, str], body: bytes) -> Dict[str, str]:
+        if headers.get('content-type', '').startswith('application/x-www-form-urlencoded'):
+            return {key: values[-1] for key, values in parse_qs(body.decode()).items()}
+        return {}
+
+    def reply_text(self) -> str:
+        """Markdown reply of ``reply_chars`` characters, like a typical model answer"""
+        return (LOREM * (self.reply_chars // len(LOREM) + 1))[:self.reply_chars]
+
+    # -- Bot API -----------------------------------------------------------
+
+    def _message(self, chat_id: int, text: str = '', message_id: Optional[int] = None) -> Dict[str, Any]:
+        if message_id is None:
+            self._message_ids[chat_id] += 1
+            message_id = self._message_ids[chat_id]
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'Bench'},
+            'text': text
+        }
+
+    def _bot_api(self, method: str, params: Dict[str, str]) -> Any:
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        chat_id = int(params.get('chat_id', 0) or 0)
+        if method in ('sendMessage', 'editMessageText'):
+            markup = params.get('reply_markup')
+            if markup:
+                keyboard = json.loads(markup).get('inline_keyboard', [])
+                self.keyboards[chat_id] = [button['callback_data'] for row in keyboard for button in row]
+            message_id = int(params['message_id']) if 'message_id' in params else None
+            return self._message(chat_id, params.get('text', ''), message_id)
+        return True
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+        self.parts = [text]
+
+class FakeStream:
+    def __init__(self, text: str, chunks: int, delay: float):
+        size = max(1, -(-len(text) // chunks))
+        self._pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        self._delay = delay / max(len(self._pieces), 1)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for piece in self._pieces:
+            await asyncio.sleep(self._delay)
+            yield FakeResponse(piece)
+
+class FakeGenerativeModel:
+    """Replaces ``genai.GenerativeModel`` so SDK calls see the same simulated latency"""
+
+    def __init__(self, backend: FakeBackend):
+        self.backend = backend
+
+    async def generate_content_async(self, contents, stream: bool = False):
+        latency = self.backend.latency
+        text = self.backend.reply_text()
+        if stream:
+            self.backend.calls['gemini.sdk_stream'] += 1
+            return FakeStream(text, self.backend.stream_chunks, latency.sample(latency.gemini))
+        self.backend.calls['gemini.sdk'] += 1
+        await asyncio.sleep(latency.sample(latency.gemini))
+        return FakeResponse(text)
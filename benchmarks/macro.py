@@ -0,0 +1,247 @@
+"""Macro-benchmarks: drive the bot's handlers end to end against local fake backends."""
+import asyncio
+import itertools
+import logging
+import random
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from benchmarks.fakes import FakeBackend, FakeGenerativeModel, Latency
+from benchmarks.results import percentiles
+
+logger = logging.getLogger(__name__)
+
+TOPICS = ('python', 'asyncio', 'databases')
+
+@dataclass
+class MacroOptions:
+    users: int = 20
+    messages: int = 5  # per user and scenario
+    distinct_queries: int = 5  # web search queries shared by all users
+    db_latency: float = 0.002
+    seed: int = 1  # users pick queries, topics and answers reproducibly
+    latency: Latency = field(default_factory=Latency)
+    scenarios: List[str] = field(default_factory=lambda: list(SCENARIOS))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+class UpdateFactory:
+    """Builds the updates Telegram would deliver for a private chat"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def _user(user_id: int) -> Dict[str, Any]:
+        return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+
+    @staticmethod
+    def _chat(user_id: int) -> Dict[str, Any]:
+        return {'id': user_id, 'type': 'private', 'first_name': f"User{user_id}"}
+
+    def message(self, user_id: int, text: str):
+        from telegram import Update
+
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': self._chat(user_id),
+            'from': self._user(user_id),
+            'text': text
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        return Update.de_json({'update_id': next(self._update_ids), 'message': message}, self.bot)
+
+    def callback(self, user_id: int, data: str):
+        from telegram import Update
+
+        update_id = next(self._update_ids)
+        return Update.de_json({
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self._user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': next(self._message_ids),
+                    'date': int(time.time()),
+                    'chat': self._chat(user_id),
+                    'from': {'id': 1, 'is_bot': True, 'first_name': 'Bench'},
+                    'text': 'Question'
+                }
+            }
+        }, self.bot)
+
+Process = Callable[[Any], Awaitable[None]]
+
+async def text_session(user_id: int, factory: UpdateFactory, process: Process,
+                       backend: FakeBackend, options: MacroOptions):
+    for i in range(options.messages):
+        await process(factory.message(user_id, f"Question {i} from user {user_id}: how do I keep a bot responsive?"))
+
+async def websearch_session(user_id: int, factory: UpdateFactory, process: Process,
+                            backend: FakeBackend, options: MacroOptions):
+    # Users draw from a small set of queries, like real traffic around the same news
+    rng = random.Random(f"{options.seed}:{user_id}")
+    for _ in range(options.messages):
+        query = f"python asyncio tips {rng.randrange(options.distinct_queries)}"
+        await process(factory.message(user_id, f"/websearch {query}"))
+
+async def quiz_session(user_id: int, factory: UpdateFactory, process: Process,
+                       backend: FakeBackend, options: MacroOptions):
+    rng = random.Random(f"{options.seed}:{user_id}")
+    backend.keyboards.pop(user_id, None)
+    await process(factory.message(user_id, f"/quiz {rng.choice(TOPICS)}"))
+    # Answer each question as it arrives; the final score is sent without buttons
+    while True:
+        buttons = backend.keyboards.pop(user_id, None)
+        if not buttons:
+            break
+        await process(factory.callback(user_id, rng.choice(buttons)))
+
+SCENARIOS: Dict[str, Callable[..., Awaitable[None]]] = {
+    'text': text_session,
+    # The same traffic with every write sent to the database as it happens
+    'text_write_through': text_session,
+    'websearch': websearch_session,
+    'quiz': quiz_session,
+}
+
+WRITE_THROUGH = {'text_write_through'}
+
+class LoopLagProbe:
+    """Samples how late the event loop wakes a task sleeping ``interval`` seconds"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._done = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while not self._done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    async def __aenter__(self) -> 'LoopLagProbe':
+        self._task = asyncio.create_task(self._run())
+        await asyncio.sleep(0)  # the first sleep must already be running
+        return self
+
+    async def __aexit__(self, *exc_info):
+        # Let the last sample finish, so a block right before exit is still seen
+        self._done.set()
+        await self._task
+
+    def summary(self) -> Dict[str, float]:
+        return {f"loop_lag_{name}": value for name, value in percentiles(self.samples, (0.99,)).items()}
+
+DB_WRITE_METHODS = ('insert_one', 'insert_many', 'update_one', 'bulk_update')
+
+def _dependency_calls() -> Dict[str, int]:
+    """Calls per service, plus database writes under ``db_writes``"""
+    from services.metrics import DEPENDENCY_SECONDS
+
+    calls: Dict[str, int] = {}
+    for labels, count, _ in DEPENDENCY_SECONDS.series():
+        calls[labels['service']] = calls.get(labels['service'], 0) + count
+        if labels['service'] == 'db' and labels['operation'].endswith(DB_WRITE_METHODS):
+            calls['db_writes'] = calls.get('db_writes', 0) + count
+    return calls
+
+async def run_scenario(name: str, backend: FakeBackend, options: MacroOptions) -> Dict[str, Any]:
+    """Run one scenario on a freshly built bot and summarize it"""
+    import main
+    from database.db_operations import DatabaseOperations
+    from database.drivers import MemoryDriver
+    from services.container import ServiceContainer
+
+    # A fresh container per scenario, so caches and sessions start cold
+    main.container = container = ServiceContainer()
+    container.db_ops = DatabaseOperations(MemoryDriver(latency=options.db_latency),
+                                          write_behind=False if name in WRITE_THROUGH else None)
+    gemini = container.gemini_service
+    gemini.chat_model = gemini.vision_model = FakeGenerativeModel(backend)
+
+    bot = main.TelegramBot()
+    app = bot.app
+    await app.initialize()
+    await bot.post_init(app)
+
+    factory = UpdateFactory(app.bot)
+    latencies: List[float] = []
+    updates = 0
+
+    async def process(update):
+        nonlocal updates
+        start = time.perf_counter()
+        await app.update_processor.process_update(update, app.process_update(update))
+        latencies.append(time.perf_counter() - start)
+        updates += 1
+
+    backend.reset()
+    before = _dependency_calls()
+    session = SCENARIOS[name]
+    start = time.perf_counter()
+    async with LoopLagProbe() as probe:
+        await asyncio.gather(*(
+            session(user_id, factory, process, backend, options) for user_id in range(1, options.users + 1)
+        ))
+    duration = time.perf_counter() - start
+    search = container.web_search_service.stats() if container.built('web_search_service') else None
+
+    # Shutting down flushes buffered writes, so they are counted too
+    await bot.post_stop(app)
+    await app.shutdown()
+    await bot.post_shutdown(app)
+    after = _dependency_calls()
+
+    result: Dict[str, Any] = {
+        'updates': updates,
+        'duration_s': round(duration, 3),
+        'throughput_per_sec': round(updates / duration, 2) if duration else 0.0,
+    }
+    result.update(percentiles(latencies))
+    result.update(probe.summary())
+    for route, count in sorted(backend.calls.items()):
+        result[f"{route.replace('.', '_')}_calls"] = count
+    bot_api_calls = sum(count for route, count in backend.calls.items() if route.startswith('bot_api.'))
+    db_ops = after.get('db', 0) - before.get('db', 0)
+    db_writes = after.get('db_writes', 0) - before.get('db_writes', 0)
+    result['bot_api_calls_per_update'] = round(bot_api_calls / updates, 3) if updates else 0.0
+    result['db_ops'] = db_ops
+    result['db_ops_per_update'] = round(db_ops / updates, 3) if updates else 0.0
+    result['db_write_ops'] = db_writes
+    result['db_write_ops_per_update'] = round(db_writes / updates, 3) if updates else 0.0
+    # Write round trips per second the database has to absorb; shown, never flagged
+    result['db_write_ops_rate'] = round(db_writes / duration, 2) if duration else 0.0
+    if search is not None:
+        result['search_hit_ratio'] = round(search['hit_ratio'], 3)
+    return result
+
+async def run_macro(options: Optional[MacroOptions] = None) -> Dict[str, Dict[str, Any]]:
+    """Run the selected scenarios against one fake backend shared by all of them"""
+    from config.config import Config
+
+    options = options or MacroOptions()
+    backend = FakeBackend(options.latency)
+    url = await backend.start()
+    Config.TELEGRAM_BASE_URL = f"{url}/bot"
+    Config.TELEGRAM_BASE_FILE_URL = f"{url}/file/bot"
+    Config.GEMINI_API_BASE = url
+    Config.SERPAPI_URL = f"{url}/search"
+    results = {}
+    try:
+        for name in options.scenarios:
+            logger.info(f"Running macro scenario: {name}")
+            results[name] = await run_scenario(name, backend, options)
+    finally:
+        await backend.close()
+    return results
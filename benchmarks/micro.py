@@ -0,0 +1,240 @@
+"""Micro-benchmarks of hot paths: rendering, quiz parsing, PDF and image handling, HTTP clients."""
+import asyncio
+import io
+import json
+import logging
+import statistics
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+from benchmarks.fakes import FakeBackend, Latency
+from benchmarks.results import percentiles
+
+logger = logging.getLogger(__name__)
+
+MARKDOWN_BLOCK = """## Overview
+
+The **event loop** must never block. *Everything* slow runs elsewhere:
+
+- Network calls use `httpx` with pooled connections
+- CPU work goes to a [process pool](https://docs.python.org/3/library/concurrent.futures.html)
+- ~~Synchronous clients~~ are gone
+
+```python
+async def handle(update):
+    reply = await gemini.generate(update.text)
+    await send(reply)
+```
+
+Note: messages over 4096 characters are split. Escaping matters for <tags> & entities.
+
+"""
+
+def measure(fn: Callable[[], Any], min_time: float = 0.5, repeat: int = 5) -> Dict[str, float]:
+    """Time ``fn`` like ``timeit``: calibrate a loop count, then keep the best of ``repeat`` runs"""
+    fn()  # warm caches, pools and lazy imports
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / repeat or loops >= 1_000_000:
+            break
+        loops = max(loops * 2, int(loops * (min_time / repeat) / max(elapsed, 1e-9)))
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        runs.append((time.perf_counter() - start) / loops)
+    best = min(runs)
+    return {
+        'ops_per_sec': round(1 / best, 2),
+        'best_us': round(best * 1e6, 3),
+        'median_us': round(statistics.median(runs) * 1e6, 3),
+        'loops': loops
+    }
+
+def quiz_reply(count: int = 10) -> str:
+    items = [
+        {'question': f"What does feature {i} of asyncio do?",
+         'options': [f"Answer {i}-{j}" for j in range(4)],
+         'answer': i % 4}
+        for i in range(count)
+    ]
+    # Typical model quirks: a code fence, one duplicate and one invalid item
+    items.append(dict(items[0]))
+    items.append({'question': 'Broken', 'options': ['a', 'b'], 'answer': 5})
+    return f"```json\n{json.dumps(items, indent=2)}\n```"
+
+def markdown_text(size: int) -> str:
+    return (MARKDOWN_BLOCK * (size // len(MARKDOWN_BLOCK) + 1))[:size]
+
+def make_pdf(pages: int, chars_per_page: int = 3000, line_chars: int = 100) -> bytes:
+    """A PDF with ``chars_per_page`` characters of extractable text on every page"""
+    import fitz
+    from services.file_handler import extract_pdf_text
+
+    text = markdown_text(chars_per_page).replace('\n', ' ')
+    lines = [text[i:i + line_chars] for i in range(0, len(text), line_chars)]
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        # insert_text reports the lines it placed; an overflowing textbox silently places nothing
+        placed = page.insert_text(fitz.Point(36, 48), '\n'.join(lines), fontsize=7)
+        if placed != len(lines):
+            raise RuntimeError(f"Only {placed} of {len(lines)} lines fit on a PDF page")
+    data = doc.tobytes()
+    doc.close()
+
+    # Extraction adds a newline per line; anything far off means the fixture is broken
+    extracted = len(extract_pdf_text(data))
+    if abs(extracted - pages * chars_per_page) > 0.1 * pages * chars_per_page:
+        raise RuntimeError(f"PDF fixture holds {extracted} characters, expected about {pages * chars_per_page}")
+    return data
+
+def make_image(width: int = 2048, height: int = 1536) -> bytes:
+    from PIL import Image
+
+    image = Image.effect_noise((width, height), 40).convert('RGB')
+    out = io.BytesIO()
+    image.save(out, format='JPEG', quality=90)
+    return out.getvalue()
+
+class _InstantGemini:
+    """Answers immediately so only the PDF handling itself is measured"""
+
+    async def get_chat_response(self, message: str, user_id=None, use_cache: bool = True) -> str:
+        return "Summary of the section."
+
+def bench_render() -> Dict[str, Dict[str, float]]:
+    from services.renderer import render_html, render_message, split_html
+
+    results = {}
+    for kb in (1, 10, 50, 100):
+        text = markdown_text(kb * 1024)
+        html = render_html(text)
+        results[f"render_message_{kb}kb"] = measure(lambda: render_message(text))
+        results[f"split_html_{kb}kb"] = measure(lambda: split_html(html))
+        results[f"split_html_{kb}kb"]['chunks'] = len(split_html(html))
+    return results
+
+def bench_quiz_parsing() -> Dict[str, Dict[str, float]]:
+    from services.quiz_bank import parse_quiz_json
+
+    reply = quiz_reply()
+    return {'parse_quiz_json': measure(lambda: parse_quiz_json(reply))}
+
+def bench_pdf() -> Dict[str, Dict[str, float]]:
+    from services.file_handler import FileHandler
+
+    handler = FileHandler(_InstantGemini())
+    loop = asyncio.new_event_loop()
+    results = {}
+    try:
+        for pages in (10, 100, 1000):
+            data = make_pdf(pages)
+            for mode in ('truncate', 'map_reduce'):
+                name = f"process_pdf_{mode}_{pages}p"
+                results[name] = measure(
+                    lambda: loop.run_until_complete(handler.process_pdf(data, mode=mode)),
+                    min_time=2.0 if mode == 'map_reduce' else 0.5
+                )
+                results[name]['pdf_bytes'] = len(data)
+    finally:
+        handler.close()
+        loop.close()
+    return results
+
+def bench_image() -> Dict[str, Dict[str, float]]:
+    """Bytes sent to the vision model and time to prepare them, per resolution tier.
+
+    Telegram offers each photo in several sizes; every tier downloads the
+    smallest one covering its max edge and shrinks it to that edge.
+    """
+    from services.image_preprocessor import detect_mime_type, preprocess_image, select_photo_size
+
+    variants = {(width, height): make_image(width, height)
+                for width, height in ((320, 240), (800, 600), (1280, 960), (2560, 1920))}
+    photos = [SimpleNamespace(width=width, height=height) for width, height in variants]
+    original = variants[(2560, 1920)]
+    # Before preprocessing the full-size photo was sent as is
+    results = {'image_unprocessed': {'input_bytes': len(original), 'output_bytes': len(original)}}
+    for max_edge in (512, 1024, 1536, 2048):
+        photo = select_photo_size(photos, max_edge)
+        data = variants[(photo.width, photo.height)]
+        name = f"preprocess_image_{max_edge}px"
+        results[name] = measure(lambda: preprocess_image(data, max_edge=max_edge), min_time=1.0)
+        results[name]['input_bytes'] = len(data)
+        results[name]['output_bytes'] = len(preprocess_image(data, max_edge=max_edge)[0])
+    results['detect_mime_type'] = measure(lambda: detect_mime_type(original))
+    return results
+
+async def _request_latencies(get: Callable[[], Any], requests: int, concurrency: int) -> List[float]:
+    latencies: List[float] = []
+
+    async def worker(count: int):
+        for _ in range(count):
+            start = time.perf_counter()
+            response = await get()
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(worker(requests // concurrency) for _ in range(concurrency)))
+    return latencies
+
+async def _bench_http_client(requests: int, concurrency: int) -> Dict[str, Dict[str, float]]:
+    import httpx
+    from services.http_client import HttpClient
+
+    backend = FakeBackend(Latency(serpapi=0.005, jitter=0))
+    url = f"{await backend.start()}/search"
+    results = {}
+    try:
+        async def per_call():
+            # What every service did before the shared client: a new client, pool and handshake per call
+            async with httpx.AsyncClient() as client:
+                return await client.get(url)
+
+        client = HttpClient()
+        try:
+            await client.get(url)  # open the pool before timing
+            for name, get in (('per_call', per_call), ('pooled', lambda: client.get(url))):
+                start = time.perf_counter()
+                latencies = await _request_latencies(get, requests, concurrency)
+                results[f"http_client_{name}"] = {
+                    'requests_per_sec': round(len(latencies) / (time.perf_counter() - start), 2),
+                    **percentiles(latencies)
+                }
+        finally:
+            await client.aclose()
+    finally:
+        await backend.close()
+    return results
+
+def bench_http_client(requests: int = 400, concurrency: int = 10) -> Dict[str, Dict[str, float]]:
+    """p50/p99 of GETs against a local server: shared pooled client vs a client per call"""
+    return asyncio.run(_bench_http_client(requests, concurrency))
+
+BENCHMARKS = {
+    'render': bench_render,
+    'quiz_json': bench_quiz_parsing,
+    'pdf': bench_pdf,
+    'image': bench_image,
+    'http_client': bench_http_client,
+}
+
+def run_micro(only=None) -> Dict[str, Dict[str, Any]]:
+    """Run the selected groups; a group whose dependencies are missing is recorded as skipped"""
+    results: Dict[str, Dict[str, Any]] = {}
+    for group, bench in BENCHMARKS.items():
+        if only and group not in only:
+            continue
+        logger.info(f"Running micro benchmarks: {group}")
+        try:
+            results.update(bench())
+        except Exception as e:
+            logger.warning(f"Skipping {group} benchmarks: {e}")
+            results[group] = {'skipped': f"{type(e).__name__}: {e}"}
+    return results
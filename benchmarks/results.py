@@ -0,0 +1,99 @@
+"""Benchmark result files: saving, loading and comparing runs."""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Metric name suffixes and whether a larger value is better
+_DIRECTIONS = (
+    ('_per_sec', True),
+    ('_ms', False),
+    ('_us', False),
+    ('_per_update', False),
+    ('_calls', False),
+    ('hit_ratio', True),
+)
+
+def percentiles(samples: Sequence[float], points: Tuple[float, ...] = (0.5, 0.95, 0.99)) -> Dict[str, float]:
+    """Exact percentiles, mean and max of ``samples`` (seconds) in milliseconds"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    result = {}
+    for point in points:
+        index = min(len(ordered) - 1, max(0, round(point * len(ordered)) - 1))
+        result[f"p{int(point * 100)}_ms"] = round(ordered[index] * 1000, 3)
+    result['mean_ms'] = round(sum(ordered) / len(ordered) * 1000, 3)
+    result['max_ms'] = round(ordered[-1] * 1000, 3)
+    return result
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def new_run(options: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'commit': _git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'options': options
+        },
+        'micro': {},
+        'macro': {}
+    }
+
+def save(run: Dict[str, Any], path: str):
+    with open(path, 'w') as f:
+        json.dump(run, f, indent=2, sort_keys=True)
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+def _direction(metric: str) -> Optional[bool]:
+    for suffix, higher_is_better in _DIRECTIONS:
+        if metric.endswith(suffix):
+            return higher_is_better
+    return None
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any],
+            threshold: float = 0.1) -> Tuple[List[str], List[str]]:
+    """Compare two runs metric by metric.
+
+    Returns the report lines and the regressions: metrics that got worse
+    by more than ``threshold`` (a fraction) in their bad direction.
+    Metrics without a known direction are shown but never flagged.
+    """
+    lines: List[str] = []
+    regressions: List[str] = []
+    for level in ('micro', 'macro'):
+        for name, metrics in sorted(current.get(level, {}).items()):
+            old_metrics = baseline.get(level, {}).get(name)
+            if not old_metrics or 'skipped' in metrics or 'skipped' in old_metrics:
+                continue
+            for metric, value in sorted(metrics.items()):
+                old = old_metrics.get(metric)
+                if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                    continue
+                change = (value - old) / abs(old)
+                higher_is_better = _direction(metric)
+                flag = ''
+                if higher_is_better is not None:
+                    worse = -change if higher_is_better else change
+                    if worse > threshold:
+                        flag = '  REGRESSION'
+                        regressions.append(f"{level}.{name}.{metric}")
+                    elif worse < -threshold:
+                        flag = '  improved'
+                lines.append(f"{f'{level}.{name}.{metric}':<56} {old:>12.3f} -> {value:>12.3f}  {change:+7.1%}{flag}")
+    return lines, regressions
@@ -0,0 +1,109 @@
+"""Run the benchmark suite and compare results against a baseline.
+
+    python -m benchmarks.run                      # micro and macro, print the results
+    python -m benchmarks.run micro --only render,quiz_json
+    python -m benchmarks.run macro --users 50 --gemini-latency 1.0 --output new.json
+    python -m benchmarks.run all --output new.json --baseline old.json
+    python -m benchmarks.run compare old.json new.json
+
+Exits with status 1 when a metric regressed by more than ``--threshold``.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+
+# Never talk to real services; set before any project module reads its config
+BENCH_ENVIRONMENT = {
+    'TELEGRAM_TOKEN': '123456:bench',
+    'GEMINI_API_KEY': 'bench',
+    'SERPAPI_KEY': 'bench',
+    'DB_DRIVER': 'memory',
+    'RESPONSE_CACHE_SHARED': 'false',
+    'METRICS_PORT': '0',
+    'ADMISSION_CONTROL': 'false',
+    # The bot's own capacity is measured, not Telegram's flood limits
+    'OUTBOUND_GLOBAL_RATE': '100000',
+    'OUTBOUND_CHAT_RATE': '1000',
+    'OUTBOUND_GROUP_RATE': '1000',
+    'OUTBOUND_CHAT_BURST': '1000',
+}
+for _key, _value in BENCH_ENVIRONMENT.items():
+    os.environ.setdefault(_key, _value)
+
+from benchmarks import results as result_files  # noqa: E402
+from benchmarks.fakes import Latency  # noqa: E402
+from benchmarks.macro import SCENARIOS, MacroOptions, run_macro  # noqa: E402
+from benchmarks.micro import BENCHMARKS, run_micro  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('suite', nargs='?', default='all', choices=['micro', 'macro', 'all', 'compare'])
+    parser.add_argument('files', nargs='*', help='baseline and current result files for "compare"')
+    parser.add_argument('--only', help=f"comma-separated micro groups ({', '.join(BENCHMARKS)}) "
+                                       f"and macro scenarios ({', '.join(SCENARIOS)})")
+    parser.add_argument('--users', type=int, default=20, help='concurrent users per macro scenario')
+    parser.add_argument('--messages', type=int, default=5, help='messages per user and macro scenario')
+    parser.add_argument('--bot-api-latency', type=float, default=0.02)
+    parser.add_argument('--gemini-latency', type=float, default=0.3)
+    parser.add_argument('--serpapi-latency', type=float, default=0.2)
+    parser.add_argument('--db-latency', type=float, default=0.002)
+    parser.add_argument('--seed', type=int, default=1, help='seed for the simulated users\' choices')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare against this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change that counts as a regression (default 0.1)')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+def report(baseline: dict, current: dict, threshold: float) -> int:
+    lines, regressions = result_files.compare(baseline, current, threshold)
+    print('\n'.join(lines))
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print(f"\nNo regressions over {threshold:.0%}")
+    return 0
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logging.getLogger('httpx').setLevel(logging.WARNING)  # one line per request drowns the progress
+
+    if args.suite == 'compare':
+        if len(args.files) != 2:
+            print("compare needs two result files: BASELINE CURRENT", file=sys.stderr)
+            return 2
+        baseline, current = (result_files.load(path) for path in args.files)
+        return report(baseline, current, args.threshold)
+
+    only = set(args.only.split(',')) if args.only else None
+    options = MacroOptions(
+        users=args.users,
+        messages=args.messages,
+        db_latency=args.db_latency,
+        seed=args.seed,
+        latency=Latency(bot_api=args.bot_api_latency, gemini=args.gemini_latency, serpapi=args.serpapi_latency),
+        scenarios=[name for name in SCENARIOS if not only or name in only]
+    )
+    run = result_files.new_run({'suite': args.suite, 'only': args.only, 'macro': options.as_dict()})
+    if args.suite in ('micro', 'all'):
+        run['micro'] = run_micro(only)
+    if args.suite in ('macro', 'all') and options.scenarios:
+        run['macro'] = asyncio.run(run_macro(options))
+
+    if args.output:
+        result_files.save(run, args.output)
+    else:
+        print(json.dumps({'micro': run['micro'], 'macro': run['macro']}, indent=2, sort_keys=True))
+    if args.baseline:
+        return report(result_files.load(args.baseline), run, args.threshold)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
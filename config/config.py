@@ -6,13 +6,149 @@ load_dotenv()
 class Config:
     # Bot Configuration
     TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
+    # Bot API endpoints; override for a self-hosted Bot API server or a local fake
+    TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL', 'https://api.telegram.org/bot')
+    TELEGRAM_BASE_FILE_URL = os.getenv('TELEGRAM_BASE_FILE_URL', 'https://api.telegram.org/file/bot')
     
     # MongoDB Configuration
     MONGODB_URI = os.getenv('MONGODB_URI')
     DB_NAME = 'telegram_bot'
+    DB_DRIVER = os.getenv('DB_DRIVER', 'motor')  # 'motor' or 'memory'
     
     # Gemini Configuration
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+    GEMINI_API_BASE = os.getenv('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com')  # REST calls
+    GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', '32'))
+    GEMINI_MODEL_MAX_CONCURRENCY = int(os.getenv('GEMINI_MODEL_MAX_CONCURRENCY', '16'))
+
+    # Update processing: maximum updates handled at once (1 = sequential)
+    CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '32'))
+
+    # Serving mode: 'polling' or 'webhook'
+    BOT_MODE = os.getenv('BOT_MODE', 'polling')
+    DROP_PENDING_UPDATES = os.getenv('DROP_PENDING_UPDATES', 'false').lower() == 'true'
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # public base URL, e.g. https://bot.example.com
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+    WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+    WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '1'))
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+    WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', '30'))
+
+    # Prometheus metrics endpoint (port 0 disables it); webhook workers take
+    # consecutive ports starting at METRICS_PORT
+    METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
+
+    # Event loop stall watchdog (opt-in): reports callbacks that block the
+    # loop for longer than the threshold, with the stack that blocked it
+    LOOP_WATCHDOG = os.getenv('LOOP_WATCHDOG', 'false').lower() == 'true'
+    LOOP_WATCHDOG_THRESHOLD = float(os.getenv('LOOP_WATCHDOG_THRESHOLD', '0.1'))  # seconds
+    LOOP_WATCHDOG_INTERVAL = float(os.getenv('LOOP_WATCHDOG_INTERVAL', '0.05'))
+    LOOP_WATCHDOG_REPORT_INTERVAL = float(os.getenv('LOOP_WATCHDOG_REPORT_INTERVAL', '300'))
+
+    # Gemini response cache
+    RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '5000'))
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+    RESPONSE_CACHE_SHARED = os.getenv('RESPONSE_CACHE_SHARED', 'false').lower() == 'true'
+
+    # PDF processing
+    PDF_SUMMARY_MODE = os.getenv('PDF_SUMMARY_MODE', 'truncate')  # 'truncate' or 'map_reduce'
+    PDF_CHAR_BUDGET = int(os.getenv('PDF_CHAR_BUDGET', '4000'))
+    PDF_CHUNK_CHARS = int(os.getenv('PDF_CHUNK_CHARS', '12000'))
+    PDF_MAX_CHUNKS = int(os.getenv('PDF_MAX_CHUNKS', '32'))
+    PDF_PROCESS_POOL_MIN_PAGES = int(os.getenv('PDF_PROCESS_POOL_MIN_PAGES', '50'))
+    PDF_PROCESS_WORKERS = int(os.getenv('PDF_PROCESS_WORKERS', str(os.cpu_count() or 2)))
+
+    # File downloads: larger files spill to a temp file, smaller ones stay in memory
+    DOWNLOAD_SPILL_THRESHOLD = int(os.getenv('DOWNLOAD_SPILL_THRESHOLD', str(10 * 1024 * 1024)))
+    DOWNLOAD_MEMORY_LIMIT = int(os.getenv('DOWNLOAD_MEMORY_LIMIT', str(256 * 1024 * 1024)))
+    DOWNLOAD_QUEUE_TIMEOUT = float(os.getenv('DOWNLOAD_QUEUE_TIMEOUT', '30'))
+
+    # Image preprocessing before vision analysis
+    IMAGE_PREPROCESS = os.getenv('IMAGE_PREPROCESS', 'true').lower() == 'true'
+    IMAGE_MAX_EDGE = int(os.getenv('IMAGE_MAX_EDGE', '1024'))
+    IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'JPEG')  # 'JPEG' or 'WEBP'
+    IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '85'))
+
+    # Streamed replies: progressively edit the reply as Gemini generates it
+    STREAM_REPLIES = os.getenv('STREAM_REPLIES', 'true').lower() == 'true'
+    STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+
+    # Outbound Telegram sends (messages per second)
+    OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '30'))
+    OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))
+    OUTBOUND_GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', str(20 / 60)))
+    OUTBOUND_CHAT_BURST = float(os.getenv('OUTBOUND_CHAT_BURST', '3'))
+    OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))
+
+    # Quiz bank
+    QUIZ_LENGTH = int(os.getenv('QUIZ_LENGTH', '5'))
+    QUIZ_BANK_TARGET = int(os.getenv('QUIZ_BANK_TARGET', '30'))  # questions kept per topic
+    QUIZ_BATCH_SIZE = int(os.getenv('QUIZ_BATCH_SIZE', '10'))  # questions per generation
+    QUIZ_BANK_READ_LIMIT = int(os.getenv('QUIZ_BANK_READ_LIMIT', '100'))
+    QUIZ_TOPUP_COOLDOWN = float(os.getenv('QUIZ_TOPUP_COOLDOWN', '300'))
+    QUIZ_MAX_TOPIC_CHARS = int(os.getenv('QUIZ_MAX_TOPIC_CHARS', '100'))  # keeps quiz sessions small
+
+    # Session state for multi-step flows such as quizzes
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'database')  # 'database' or 'memory'
+    SESSION_TTL = float(os.getenv('SESSION_TTL', '3600'))
+    SESSION_MAX_ENTRIES = int(os.getenv('SESSION_MAX_ENTRIES', '10000'))
+    SESSION_MAX_BYTES = int(os.getenv('SESSION_MAX_BYTES', '2048'))
+
+    # Admission control: token buckets as '<class>=<count>/<seconds>' and a budget for heavy jobs
+    ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', 'true').lower() == 'true'
+    ADMISSION_BACKEND = os.getenv('ADMISSION_BACKEND', 'memory')  # 'memory' (per worker) or 'database' (shared)
+    ADMISSION_USER_LIMITS = os.getenv(
+        'ADMISSION_USER_LIMITS', 'chat=20/60,quiz=5/60,answer=60/60,search=5/60,image=5/60,pdf=3/60,voice=5/60'
+    )
+    ADMISSION_GLOBAL_LIMITS = os.getenv('ADMISSION_GLOBAL_LIMITS', '')  # e.g. 'search=100/60' caps SerpApi spend
+    ADMISSION_HEAVY_CLASSES = os.getenv('ADMISSION_HEAVY_CLASSES', 'search,image,pdf,voice')
+    ADMISSION_HEAVY_CONCURRENCY = int(os.getenv('ADMISSION_HEAVY_CONCURRENCY', '8'))  # per worker
+    ADMISSION_HEAVY_WAIT = float(os.getenv('ADMISSION_HEAVY_WAIT', '2'))  # seconds before a heavy job is shed
+    ADMISSION_MAX_ENTRIES = int(os.getenv('ADMISSION_MAX_ENTRIES', '50000'))
+
+    # Voice messages
+    VOICE_BACKEND = os.getenv('VOICE_BACKEND', 'google')  # 'google' or 'vosk' (offline)
+    VOICE_LANGUAGE = os.getenv('VOICE_LANGUAGE', 'en-US')
+    VOSK_MODEL_PATH = os.getenv('VOSK_MODEL_PATH', '')
+    VOICE_MAX_CONCURRENCY = int(os.getenv('VOICE_MAX_CONCURRENCY', '2'))
+    VOICE_PROCESS_WORKERS = int(os.getenv('VOICE_PROCESS_WORKERS', '2'))
+    VOICE_MAX_DURATION = int(os.getenv('VOICE_MAX_DURATION', '120'))  # seconds
+    VOICE_DECODE_TIMEOUT = float(os.getenv('VOICE_DECODE_TIMEOUT', '30'))
+    FFMPEG_PATH = os.getenv('FFMPEG_PATH', 'ffmpeg')
+
+    # Conversation memory
+    MEMORY_TOKEN_BUDGET = int(os.getenv('MEMORY_TOKEN_BUDGET', '2000'))
+    MEMORY_MAX_USERS = int(os.getenv('MEMORY_MAX_USERS', '10000'))
+    MEMORY_HISTORY_LIMIT = int(os.getenv('MEMORY_HISTORY_LIMIT', '20'))
+    MEMORY_SUMMARY_WORDS = int(os.getenv('MEMORY_SUMMARY_WORDS', '150'))
+
+    # Write-behind batching of history/metadata inserts
+    WRITE_BEHIND = os.getenv('WRITE_BEHIND', 'true').lower() == 'true'
+    WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '100'))
+    WRITE_FLUSH_INTERVAL = float(os.getenv('WRITE_FLUSH_INTERVAL', '1.0'))
+    WRITE_MAX_PENDING = int(os.getenv('WRITE_MAX_PENDING', '10000'))
 
     # SerpApi Configuration
     SERPAPI_KEY = os.getenv('SERPAPI_KEY')
+    SERPAPI_URL = os.getenv('SERPAPI_URL', 'https://serpapi.com/search')
+    SEARCH_GL = os.getenv('SEARCH_GL', 'us')  # Google country
+    SEARCH_HL = os.getenv('SEARCH_HL', 'en')  # Language
+    SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', '600'))
+    SEARCH_CACHE_STALE_TTL = float(os.getenv('SEARCH_CACHE_STALE_TTL', '3600'))  # served while revalidating
+    SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', '1000'))
+    SEARCH_CACHE_MAX_BYTES = int(os.getenv('SEARCH_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+
+    # HTTP client configuration (shared by Gemini and SerpApi traffic)
+    HTTP2 = os.getenv('HTTP2', 'true').lower() == 'true'
+    HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '30'))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+    HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '100'))
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', '20'))
+    HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv('HTTP_MAX_CONNECTIONS_PER_HOST', '20'))
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '30'))
+    HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '2'))
+    HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', '0.5'))
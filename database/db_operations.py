@@ -1,56 +1,93 @@
-from pymongo import MongoClient
-from datetime import datetime, UTC
+from datetime import datetime, timedelta, UTC
 import logging
+from typing import Any, Dict, List, Optional, Tuple
 from config.config import Config
+from database.drivers import InstrumentedDriver, StorageDriver, create_driver
+from database.indexes import ensure_indexes
 from database.models import ChatHistory
+from database.write_buffer import WriteBehindBuffer
 
 logger = logging.getLogger(__name__)
 
 class DatabaseOperations:
-    def __init__(self):
-        try:
-            self.client = MongoClient(Config.MONGODB_URI)
-            self.db = self.client[Config.DB_NAME]
-            # Collections
-            self.users = self.db['users']
-            self.chat_history = self.db['chat_history']
-            self.file_metadata = self.db['file_metadata']
-            self.search_history = self.db['search_history']
-            logger.info("Database connection established")
+    """Async storage backend used by every handler.
+
+    All persistence goes through a pluggable ``StorageDriver`` (Motor in
+    production, ``MemoryDriver`` in tests), so no call blocks the event loop.
+    History and metadata inserts go through a write-behind buffer when
+    ``Config.WRITE_BEHIND`` is set, so they may reach the database up to
+    ``WRITE_FLUSH_INTERVAL`` seconds after the call returns.
+    """
+
+    def __init__(self, driver: Optional[StorageDriver] = None, write_behind: Optional[bool] = None):
+        try:
+            self.driver = InstrumentedDriver(driver or create_driver())
+            write_behind = Config.WRITE_BEHIND if write_behind is None else write_behind
+            self.write_buffer = WriteBehindBuffer(self.driver) if write_behind else None
+            logger.info(f"Database driver ready: {type(self.driver.driver).__name__} (write_behind={write_behind})")
         except Exception as e:
             logger.error(f"Database connection failed: {e}")
             raise
 
+    async def _insert(self, collection: str, document: Dict[str, Any]):
+        if self.write_buffer is not None:
+            await self.write_buffer.insert(collection, document)
+        else:
+            await self.driver.insert_one(collection, document)
+
+    async def ping(self) -> bool:
+        """Check that the database is reachable"""
+        try:
+            await self.driver.ping()
+            logger.info("Database connection established")
+            return True
+        except Exception as e:
+            logger.error(f"Database ping failed: {e}")
+            return False
+
+    async def ensure_indexes(self) -> bool:
+        """Create the indexes every query relies on (idempotent)"""
+        try:
+            return not await ensure_indexes(self.driver)
+        except Exception as e:
+            logger.error(f"Error creating indexes: {e}")
+            return False
+
     async def save_user(self, user_data: dict) -> bool:
         """Save or update user information"""
+        return await self.register_user(user_data) is not None
+
+    async def register_user(self, user_data: dict) -> Optional[bool]:
+        """Upsert a user in a single round trip.
+
+        Returns True if the user was newly created, False if they already
+        existed and None if the write failed.
+        """
         try:
-            user_id = user_data['user_id']
-            existing_user = self.users.find_one({'user_id': user_id})
-            
-            if existing_user:
-                self.users.update_one(
-                    {'user_id': user_id},
-                    {
-                        '$set': {
-                            'username': user_data.get('username'),
-                            'last_interaction': datetime.now(UTC)
-                        }
-                    }
-                )
-            else:
-                user_data['created_at'] = datetime.now(UTC)
-                user_data['last_interaction'] = datetime.now(UTC)
-                self.users.insert_one(user_data)
-            
-            return True
+            now = datetime.now(UTC)
+            user_data = dict(user_data)
+            user_id = user_data.pop('user_id')
+            user_data.pop('created_at', None)
+            user_data['last_interaction'] = now
+            result = await self.driver.update_one(
+                'users',
+                {'user_id': user_id},
+                {
+                    '$set': user_data,
+                    '$setOnInsert': {'created_at': now}
+                },
+                upsert=True
+            )
+            return result.upserted_id is not None
         except Exception as e:
             logger.error(f"Error saving user: {e}")
-            return False
+            return None
 
     async def update_user_contact(self, user_id: int, phone_number: str) -> bool:
         """Update user's phone number"""
         try:
-            self.users.update_one(
+            await self.driver.update_one(
+                'users',
                 {'user_id': user_id},
                 {
                     '$set': {
@@ -64,21 +101,27 @@ class DatabaseOperations:
             logger.error(f"Error updating user contact: {e}")
             return False
 
-    async def save_chat_history(self, user_id: int, message: str, response: str) -> bool:
+    async def save_chat_history(self, user_id: int, message: str, response: str,
+                                timestamp: Optional[datetime] = None) -> bool:
         """Save chat interaction"""
         try:
             chat = ChatHistory(
                 user_id=user_id,
                 message=message,
-                response=response
-            )
-            self.chat_history.insert_one(chat.to_dict())
-            
-            # Update last interaction
-            self.users.update_one(
-                {'user_id': user_id},
-                {'$set': {'last_interaction': datetime.now(UTC)}}
+                response=response,
+                timestamp=timestamp or datetime.now(UTC)
             )
+            await self._insert('chat_history', chat.to_dict())
+
+            # Update last interaction (debounced per user when buffered)
+            if self.write_buffer is not None:
+                await self.write_buffer.touch_user(user_id, datetime.now(UTC))
+            else:
+                await self.driver.update_one(
+                    'users',
+                    {'user_id': user_id},
+                    {'$set': {'last_interaction': datetime.now(UTC)}}
+                )
             return True
         except Exception as e:
             logger.error(f"Error saving chat history: {e}")
@@ -88,65 +131,232 @@ class DatabaseOperations:
         """Save file analysis metadata"""
         try:
             metadata['timestamp'] = datetime.now(UTC)
-            self.file_metadata.insert_one(metadata)
+            await self._insert('file_metadata', metadata)
             return True
         except Exception as e:
             logger.error(f"Error saving file metadata: {e}")
             return False
 
+    async def find_cached_analysis(self, prompt_version: str, file_unique_id: Optional[str] = None,
+                                   content_hash: Optional[str] = None) -> Optional[str]:
+        """Find a stored analysis of the same file content.
+
+        Telegram's ``file_unique_id`` is checked first since it is known
+        before downloading; the content hash catches re-uploads of the same
+        bytes under a new file id.
+        """
+        try:
+            for field, value in (('file_unique_id', file_unique_id), ('content_hash', content_hash)):
+                if value is None:
+                    continue
+                entry = await self.driver.find_one(
+                    'file_metadata',
+                    {field: value, 'prompt_version': prompt_version}
+                )
+                if entry:
+                    return entry['analysis']
+            return None
+        except Exception as e:
+            logger.error(f"Error looking up cached analysis: {e}")
+            return None
+
     async def save_search_history(self, search_data: dict) -> bool:
         """Save search history"""
         try:
             search_data['timestamp'] = datetime.now(UTC)
-            self.search_history.insert_one(search_data)
+            await self._insert('search_history', search_data)
             return True
         except Exception as e:
             logger.error(f"Error saving search history: {e}")
             return False
 
+    async def save_quiz_results(self, user_id: int, topic: str, questions: list,
+                                user_answers: list, score: int) -> bool:
+        """Save the outcome of a finished quiz"""
+        try:
+            await self.driver.insert_one('quiz_results', {
+                'user_id': user_id,
+                'topic': topic,
+                'questions': questions,
+                'user_answers': user_answers,
+                'score': score,
+                'timestamp': datetime.now(UTC)
+            })
+            return True
+        except Exception as e:
+            logger.error(f"Error saving quiz results: {e}")
+            return False
+
+    async def save_quiz_questions(self, topic: str, questions: List[Dict[str, Any]]) -> int:
+        """Add validated questions to a topic's bank; returns how many were new"""
+        try:
+            now = datetime.now(UTC)
+            matched = await self.driver.bulk_update(
+                'quiz_questions',
+                [
+                    ({'topic': topic, 'qid': question['qid']}, {'$setOnInsert': {
+                        'question': question['question'],
+                        'options': question['options'],
+                        'answer': question['answer'],
+                        'created_at': now
+                    }})
+                    for question in questions
+                ],
+                upsert=True
+            )
+            return len(questions) - matched
+        except Exception as e:
+            logger.error(f"Error saving quiz questions: {e}")
+            return 0
+
+    async def get_quiz_questions(self, topic: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """Get banked questions for a topic"""
+        try:
+            return await self.driver.find('quiz_questions', {'topic': topic}, limit=limit)
+        except Exception as e:
+            logger.error(f"Error getting quiz questions: {e}")
+            return []
+
+    async def get_quiz_questions_by_id(self, topic: str, qids: List[str]) -> List[Dict[str, Any]]:
+        """Get specific banked questions, in the order of ``qids``"""
+        try:
+            found = await self.driver.find('quiz_questions', {'topic': topic, 'qid': {'$in': qids}})
+            by_id = {question['qid']: question for question in found}
+            return [by_id[qid] for qid in qids if qid in by_id]
+        except Exception as e:
+            logger.error(f"Error getting quiz questions: {e}")
+            return []
+
+    async def claim_update(self, update_id: int) -> bool:
+        """Record a Telegram update as accepted.
+
+        Returns False if another worker already claimed it. If the database is
+        unreachable the update is processed anyway.
+        """
+        try:
+            result = await self.driver.update_one(
+                'processed_updates',
+                {'update_id': update_id},
+                {'$setOnInsert': {'received_at': datetime.now(UTC)}},
+                upsert=True
+            )
+            return result.upserted_id is not None
+        except Exception as e:
+            logger.error(f"Error claiming update {update_id}: {e}")
+            return True
+
+    async def get_cached_response(self, key: str) -> Optional[str]:
+        """Look up a shared cached Gemini response"""
+        try:
+            entry = await self.driver.find_one(
+                'response_cache',
+                {'key': key, 'expires_at': {'$gt': datetime.now(UTC)}}
+            )
+            return entry['response'] if entry else None
+        except Exception as e:
+            logger.error(f"Error reading response cache: {e}")
+            return None
+
+    async def save_cached_response(self, key: str, response: str, ttl: float) -> bool:
+        """Store a Gemini response in the shared cache"""
+        try:
+            await self.driver.update_one(
+                'response_cache',
+                {'key': key},
+                {'$set': {
+                    'response': response,
+                    'expires_at': datetime.now(UTC) + timedelta(seconds=ttl)
+                }},
+                upsert=True
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error writing response cache: {e}")
+            return False
+
     async def get_user_stats(self, user_id: int) -> dict:
         """Get user statistics"""
         try:
             stats = {
-                'total_messages': self.chat_history.count_documents({'user_id': user_id}),
-                'total_files': self.file_metadata.count_documents({'user_id': user_id}),
-                'total_searches': self.search_history.count_documents({'user_id': user_id}),
+                'total_messages': await self.driver.count_documents('chat_history', {'user_id': user_id}),
+                'total_files': await self.driver.count_documents('file_metadata', {'user_id': user_id}),
+                'total_searches': await self.driver.count_documents('search_history', {'user_id': user_id}),
                 'join_date': None
             }
-            
-            user = self.users.find_one({'user_id': user_id})
+
+            user = await self.driver.find_one('users', {'user_id': user_id})
             if user:
                 stats['join_date'] = user.get('created_at')
-            
+
             return stats
         except Exception as e:
             logger.error(f"Error getting user stats: {e}")
             return {}
 
-    async def get_chat_history(self, user_id: int, limit: int = 10) -> list:
-        """Get recent chat history for a user"""
+    async def get_chat_history(self, user_id: int, limit: int = 10,
+                               since: Optional[datetime] = None) -> list:
+        """Get recent chat history for a user, newest first"""
         try:
-            history = self.chat_history.find(
-                {'user_id': user_id}
-            ).sort('timestamp', -1).limit(limit)
-            return list(history)
+            query = {'user_id': user_id}
+            if since is not None:
+                query['timestamp'] = {'$gt': since}
+            return await self.driver.find(
+                'chat_history',
+                query,
+                sort=[('timestamp', -1)],
+                limit=limit
+            )
         except Exception as e:
             logger.error(f"Error getting chat history: {e}")
             return []
 
+    async def get_conversation_summary(self, user_id: int) -> Tuple[str, Optional[datetime]]:
+        """Get the running conversation summary and the time it covers up to"""
+        try:
+            user = await self.driver.find_one('users', {'user_id': user_id})
+            if not user:
+                return "", None
+            return user.get('conversation_summary', ""), user.get('summary_until')
+        except Exception as e:
+            logger.error(f"Error getting conversation summary: {e}")
+            return "", None
+
+    async def save_conversation_summary(self, user_id: int, summary: str, until: datetime) -> bool:
+        """Persist the running conversation summary"""
+        try:
+            await self.driver.update_one(
+                'users',
+                {'user_id': user_id},
+                {'$set': {'conversation_summary': summary, 'summary_until': until}},
+                upsert=True
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Error saving conversation summary: {e}")
+            return False
+
     async def get_user_data(self, user_id: int) -> dict:
         """Get user data from database"""
         try:
-            user = self.users.find_one({'user_id': user_id})
+            user = await self.driver.find_one('users', {'user_id': user_id})
             return user if user else {}
         except Exception as e:
             logger.error(f"Error getting user data: {e}")
             return {}
 
+    async def flush(self):
+        """Write out everything held in the write-behind buffer"""
+        if self.write_buffer is None:
+            return
+        try:
+            await self.write_buffer.close()
+        except Exception as e:
+            logger.error(f"Error flushing write buffer: {e}")
+
     def close(self):
         """Close database connection"""
         try:
-            self.client.close()
+            self.driver.close()
             logger.info("Database connection closed")
         except Exception as e:
             logger.error(f"Error closing database connection: {e}")
@@ -0,0 +1,326 @@
+import asyncio
+import copy
+import itertools
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Any, Tuple
+from config.config import Config
+from services.metrics import track_call
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class WriteResult:
+    matched_count: int = 0
+    upserted_id: Optional[Any] = None
+
+class StorageDriver:
+    """Minimal async collection API the storage layer is written against.
+
+    Every method takes the collection name as its first argument so that
+    drivers never hand out driver-specific collection objects.
+    """
+
+    async def ping(self) -> None:
+        raise NotImplementedError
+
+    async def insert_one(self, collection: str, document: Dict[str, Any]) -> Any:
+        raise NotImplementedError
+
+    async def insert_many(self, collection: str, documents: List[Dict[str, Any]]) -> List[Any]:
+        raise NotImplementedError
+
+    async def update_one(self, collection: str, filter: Dict[str, Any],
+                         update: Dict[str, Any], upsert: bool = False) -> WriteResult:
+        raise NotImplementedError
+
+    async def bulk_update(self, collection: str, operations: List[Tuple[Dict[str, Any], Dict[str, Any]]],
+                          upsert: bool = False) -> int:
+        """Apply several ``(filter, update)`` pairs in one round trip; returns matches"""
+        raise NotImplementedError
+
+    async def find_one(self, collection: str, filter: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def find(self, collection: str, filter: Dict[str, Any],
+                   sort: Optional[List[Tuple[str, int]]] = None, limit: int = 0) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def count_documents(self, collection: str, filter: Dict[str, Any]) -> int:
+        raise NotImplementedError
+
+    async def create_index(self, collection: str, keys: List[Tuple[str, int]], unique: bool = False,
+                           expire_after_seconds: Optional[int] = None) -> str:
+        raise NotImplementedError
+
+    async def explain(self, collection: str, filter: Dict[str, Any],
+                      sort: Optional[List[Tuple[str, int]]] = None, count: bool = False) -> Dict[str, Any]:
+        """Return the query planner output for a find (or count) query"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+class MotorDriver(StorageDriver):
+    """MongoDB driver backed by Motor, so no call blocks the event loop"""
+
+    def __init__(self, uri: str, db_name: str):
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        self.client = AsyncIOMotorClient(uri, serverSelectionTimeoutMS=5000)
+        self.db = self.client[db_name]
+
+    async def ping(self) -> None:
+        await self.client.admin.command('ping')
+
+    async def insert_one(self, collection, document):
+        result = await self.db[collection].insert_one(document)
+        return result.inserted_id
+
+    async def insert_many(self, collection, documents):
+        if not documents:
+            return []
+        result = await self.db[collection].insert_many(documents, ordered=False)
+        return result.inserted_ids
+
+    async def update_one(self, collection, filter, update, upsert=False):
+        result = await self.db[collection].update_one(filter, update, upsert=upsert)
+        return WriteResult(result.matched_count, result.upserted_id)
+
+    async def bulk_update(self, collection, operations, upsert=False):
+        from pymongo import UpdateOne
+
+        if not operations:
+            return 0
+        result = await self.db[collection].bulk_write(
+            [UpdateOne(filter, update, upsert=upsert) for filter, update in operations], ordered=False
+        )
+        return result.matched_count
+
+    async def find_one(self, collection, filter):
+        return await self.db[collection].find_one(filter)
+
+    async def find(self, collection, filter, sort=None, limit=0):
+        cursor = self.db[collection].find(filter)
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list(length=limit or None)
+
+    async def count_documents(self, collection, filter):
+        return await self.db[collection].count_documents(filter)
+
+    async def create_index(self, collection, keys, unique=False, expire_after_seconds=None):
+        options = {'unique': unique}
+        if expire_after_seconds is not None:
+            options['expireAfterSeconds'] = expire_after_seconds
+        return await self.db[collection].create_index(keys, **options)
+
+    async def explain(self, collection, filter, sort=None, count=False):
+        if count:
+            command = {'count': collection, 'query': filter}
+        else:
+            command = {'find': collection, 'filter': filter}
+            if sort:
+                command['sort'] = dict(sort)
+        return await self.db.command({'explain': command, 'verbosity': 'queryPlanner'})
+
+    def close(self):
+        self.client.close()
+
+def _get_field(document: Dict[str, Any], key: str) -> Any:
+    value = document
+    for part in key.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def _sort_key(value: Any) -> Tuple[bool, Any]:
+    # Missing fields sort first, like they do in MongoDB
+    return (value is not None, value)
+
+def _matches(document: Dict[str, Any], filter: Dict[str, Any]) -> bool:
+    for key, expected in filter.items():
+        value = _get_field(document, key)
+        if isinstance(expected, dict) and any(k.startswith('$') for k in expected):
+            for op, operand in expected.items():
+                if op == '$in' and value not in operand:
+                    return False
+                if op == '$gte' and (value is None or value < operand):
+                    return False
+                if op == '$gt' and (value is None or value <= operand):
+                    return False
+                if op == '$lte' and (value is None or value > operand):
+                    return False
+                if op == '$lt' and (value is None or value >= operand):
+                    return False
+                if op == '$ne' and value == operand:
+                    return False
+        elif value != expected:
+            return False
+    return True
+
+def _apply_update(document: Dict[str, Any], update: Dict[str, Any], inserting: bool) -> None:
+    for key, value in update.get('$set', {}).items():
+        document[key] = copy.deepcopy(value)
+    for key, value in update.get('$inc', {}).items():
+        document[key] = document.get(key, 0) + value
+    if inserting:
+        for key, value in update.get('$setOnInsert', {}).items():
+            document[key] = copy.deepcopy(value)
+
+class MemoryDriver(StorageDriver):
+    """In-process stand-in for MongoDB, used for tests and local runs.
+
+    ``latency`` adds an artificial delay to every call, which makes it easy to
+    simulate a slow database without blocking the event loop.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.collections: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self.indexes: Dict[str, Dict[str, List[Tuple[str, int]]]] = defaultdict(dict)
+        self._ids = itertools.count(1)
+
+    async def _delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def ping(self):
+        await self._delay()
+
+    def _insert(self, collection, document):
+        document.setdefault('_id', next(self._ids))
+        self.collections[collection].append(copy.deepcopy(document))
+        return document['_id']
+
+    async def insert_one(self, collection, document):
+        await self._delay()
+        return self._insert(collection, document)
+
+    async def insert_many(self, collection, documents):
+        await self._delay()
+        return [self._insert(collection, document) for document in documents]
+
+    async def update_one(self, collection, filter, update, upsert=False):
+        await self._delay()
+        return self._update_one(collection, filter, update, upsert)
+
+    def _update_one(self, collection, filter, update, upsert):
+        for document in self.collections[collection]:
+            if _matches(document, filter):
+                _apply_update(document, update, inserting=False)
+                return WriteResult(matched_count=1)
+        if not upsert:
+            return WriteResult()
+        document = {k: v for k, v in filter.items() if not isinstance(v, dict)}
+        _apply_update(document, update, inserting=True)
+        return WriteResult(upserted_id=self._insert(collection, document))
+
+    async def bulk_update(self, collection, operations, upsert=False):
+        await self._delay()
+        results = [self._update_one(collection, filter, update, upsert) for filter, update in operations]
+        return sum(result.matched_count for result in results)
+
+    async def find_one(self, collection, filter):
+        await self._delay()
+        for document in self.collections[collection]:
+            if _matches(document, filter):
+                return copy.deepcopy(document)
+        return None
+
+    async def find(self, collection, filter, sort=None, limit=0):
+        await self._delay()
+        documents = [d for d in self.collections[collection] if _matches(d, filter)]
+        for key, direction in reversed(sort or []):
+            documents.sort(key=lambda d: _sort_key(_get_field(d, key)), reverse=direction < 0)
+        if limit:
+            documents = documents[:limit]
+        return copy.deepcopy(documents)
+
+    async def count_documents(self, collection, filter):
+        await self._delay()
+        return sum(1 for d in self.collections[collection] if _matches(d, filter))
+
+    async def create_index(self, collection, keys, unique=False, expire_after_seconds=None):
+        name = '_'.join(f"{key}_{direction}" for key, direction in keys)
+        self.indexes[collection][name] = list(keys)
+        return name
+
+    async def explain(self, collection, filter, sort=None, count=False):
+        # Mimic MongoDB's planner closely enough for index checks: an index is
+        # usable when the query constrains its leading field.
+        for name, keys in self.indexes[collection].items():
+            if keys[0][0] in filter:
+                plan = {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': name}}
+                break
+        else:
+            plan = {'stage': 'COLLSCAN'}
+        return {'queryPlanner': {'winningPlan': plan}}
+
+class InstrumentedDriver(StorageDriver):
+    """Wraps a driver and records the latency and failures of every call.
+
+    Calls show up as ``bot_dependency_seconds{service="db"}`` with the
+    collection and method as the operation, e.g. ``chat_history.insert_many``.
+    Attributes other than the driver API are passed through to the wrapped
+    driver.
+    """
+
+    def __init__(self, driver: StorageDriver):
+        self.driver = driver
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+    async def _call(self, method: str, collection: Optional[str], *args, **kwargs):
+        operation = f"{collection}.{method}" if collection else method
+        with track_call('db', operation):
+            return await getattr(self.driver, method)(*args, **kwargs)
+
+    async def ping(self):
+        return await self._call('ping', None)
+
+    async def insert_one(self, collection, document):
+        return await self._call('insert_one', collection, collection, document)
+
+    async def insert_many(self, collection, documents):
+        return await self._call('insert_many', collection, collection, documents)
+
+    async def update_one(self, collection, filter, update, upsert=False):
+        return await self._call('update_one', collection, collection, filter, update, upsert=upsert)
+
+    async def bulk_update(self, collection, operations, upsert=False):
+        return await self._call('bulk_update', collection, collection, operations, upsert=upsert)
+
+    async def find_one(self, collection, filter):
+        return await self._call('find_one', collection, collection, filter)
+
+    async def find(self, collection, filter, sort=None, limit=0):
+        return await self._call('find', collection, collection, filter, sort=sort, limit=limit)
+
+    async def count_documents(self, collection, filter):
+        return await self._call('count_documents', collection, collection, filter)
+
+    async def create_index(self, collection, keys, unique=False, expire_after_seconds=None):
+        return await self._call('create_index', collection, collection, keys, unique=unique,
+                                expire_after_seconds=expire_after_seconds)
+
+    async def explain(self, collection, filter, sort=None, count=False):
+        return await self._call('explain', collection, collection, filter, sort=sort, count=count)
+
+    def close(self):
+        self.driver.close()
+
+def create_driver(name: Optional[str] = None) -> StorageDriver:
+    """Build the storage driver selected by ``Config.DB_DRIVER``"""
+    name = (name or Config.DB_DRIVER).lower()
+    if name == 'motor':
+        return MotorDriver(Config.MONGODB_URI, Config.DB_NAME)
+    if name == 'memory':
+        logger.warning("Using in-memory storage driver; data will not persist")
+        return MemoryDriver()
+    raise ValueError(f"Unknown database driver: {name}")
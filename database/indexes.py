@@ -0,0 +1,128 @@
+"""Index bootstrap and query-plan verification.
+
+Run ``python -m database.indexes`` to create the indexes and check that
+every query the bot issues is served by an index (exit code 1 otherwise).
+"""
+import asyncio
+import logging
+import sys
+from dataclasses import dataclass
+from datetime import datetime, UTC
+from typing import Any, Dict, List, Optional, Tuple
+from database.drivers import StorageDriver, create_driver
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class IndexSpec:
+    collection: str
+    keys: List[Tuple[str, int]]
+    unique: bool = False
+    expire_after_seconds: Optional[int] = None
+
+@dataclass
+class QuerySpec:
+    name: str
+    collection: str
+    filter: Dict[str, Any]
+    sort: Optional[List[Tuple[str, int]]] = None
+    count: bool = False
+
+INDEXES = [
+    IndexSpec('users', [('user_id', 1)], unique=True),
+    IndexSpec('chat_history', [('user_id', 1), ('timestamp', -1)]),
+    IndexSpec('file_metadata', [('user_id', 1), ('timestamp', -1)]),
+    IndexSpec('file_metadata', [('file_unique_id', 1), ('prompt_version', 1)]),
+    IndexSpec('file_metadata', [('content_hash', 1), ('prompt_version', 1)]),
+    IndexSpec('search_history', [('user_id', 1), ('timestamp', -1)]),
+    IndexSpec('quiz_results', [('user_id', 1), ('timestamp', -1)]),
+    IndexSpec('quiz_questions', [('topic', 1), ('qid', 1)], unique=True),
+    IndexSpec('sessions', [('key', 1)], unique=True),
+    IndexSpec('sessions', [('expires_at', 1)], expire_after_seconds=0),
+    IndexSpec('processed_updates', [('update_id', 1)], unique=True),
+    IndexSpec('processed_updates', [('received_at', 1)], expire_after_seconds=24 * 3600),
+    IndexSpec('response_cache', [('key', 1)], unique=True),
+    IndexSpec('response_cache', [('expires_at', 1)], expire_after_seconds=0),
+    IndexSpec('rate_limits', [('key', 1)], unique=True),
+    IndexSpec('rate_limits', [('expires_at', 1)], expire_after_seconds=0),
+]
+
+_SAMPLE_USER = 0
+_NOW = datetime.now(UTC)
+
+# One entry per query shape issued by DatabaseOperations
+QUERIES = [
+    QuerySpec('users by user_id', 'users', {'user_id': _SAMPLE_USER}),
+    QuerySpec('recent chat history', 'chat_history', {'user_id': _SAMPLE_USER}, sort=[('timestamp', -1)]),
+    QuerySpec('chat history since summary', 'chat_history',
+              {'user_id': _SAMPLE_USER, 'timestamp': {'$gt': _NOW}}, sort=[('timestamp', -1)]),
+    QuerySpec('message count', 'chat_history', {'user_id': _SAMPLE_USER}, count=True),
+    QuerySpec('file count', 'file_metadata', {'user_id': _SAMPLE_USER}, count=True),
+    QuerySpec('search count', 'search_history', {'user_id': _SAMPLE_USER}, count=True),
+    QuerySpec('analysis by file_unique_id', 'file_metadata', {'file_unique_id': '', 'prompt_version': ''}),
+    QuerySpec('analysis by content hash', 'file_metadata', {'content_hash': '', 'prompt_version': ''}),
+    QuerySpec('quiz bank by topic', 'quiz_questions', {'topic': ''}),
+    QuerySpec('quiz question upsert', 'quiz_questions', {'topic': '', 'qid': ''}),
+    QuerySpec('quiz questions by id', 'quiz_questions', {'topic': '', 'qid': {'$in': []}}),
+    QuerySpec('session lookup', 'sessions', {'key': '', 'expires_at': {'$gt': _NOW}}),
+    QuerySpec('processed update claim', 'processed_updates', {'update_id': 0}),
+    QuerySpec('response cache lookup', 'response_cache', {'key': '', 'expires_at': {'$gt': _NOW}}),
+    QuerySpec('rate limit bucket', 'rate_limits', {'key': '', 'v': 0}),
+]
+
+async def ensure_indexes(driver: StorageDriver, indexes: List[IndexSpec] = INDEXES) -> List[IndexSpec]:
+    """Create all indexes; existing ones are left untouched.
+
+    A failing index (e.g. a unique index over legacy duplicates) is logged
+    and skipped so the others are still created. Returns the failures.
+    """
+    failed = []
+    for spec in indexes:
+        try:
+            name = await driver.create_index(
+                spec.collection, spec.keys,
+                unique=spec.unique, expire_after_seconds=spec.expire_after_seconds
+            )
+            logger.debug(f"Index ready: {spec.collection}.{name}")
+        except Exception as e:
+            failed.append(spec)
+            logger.error(f"Error creating index {spec.collection} {spec.keys}: {e}")
+    logger.info(f"Ensured {len(indexes) - len(failed)} of {len(indexes)} indexes")
+    return failed
+
+def _plan_stages(plan: Dict[str, Any]) -> List[str]:
+    stages = [plan['stage']] if 'stage' in plan else []
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            stages += _plan_stages(plan[key])
+    for child in plan.get('inputStages', []):
+        stages += _plan_stages(child)
+    return stages
+
+async def verify_query_plans(driver: StorageDriver, queries: List[QuerySpec] = QUERIES) -> List[str]:
+    """Explain every query and return the names of those that scan a whole collection"""
+    offenders = []
+    for query in queries:
+        explain = await driver.explain(query.collection, query.filter, sort=query.sort, count=query.count)
+        stages = _plan_stages(explain['queryPlanner']['winningPlan'])
+        if 'COLLSCAN' in stages:
+            offenders.append(query.name)
+            logger.error(f"COLLSCAN: {query.name} on {query.collection} ({' <- '.join(stages)})")
+        else:
+            logger.info(f"OK: {query.name} ({' <- '.join(stages)})")
+    return offenders
+
+async def _main() -> int:
+    driver = create_driver()
+    try:
+        failed = await ensure_indexes(driver)
+        offenders = await verify_query_plans(driver)
+        return 1 if failed or offenders else 0
+    finally:
+        driver.close()
+
+if __name__ == '__main__':
+    from config.logging_config import setup_logging
+
+    setup_logging()
+    sys.exit(asyncio.run(_main()))
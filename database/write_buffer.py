@@ -0,0 +1,117 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from config.config import Config
+from database.drivers import StorageDriver
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindBuffer:
+    """Coalesces small history/metadata writes into batched database calls.
+
+    Inserts are grouped per collection into ``insert_many`` calls and
+    ``last_interaction`` updates are debounced to one per user per flush.
+    A flush happens every ``flush_interval`` seconds, as soon as a batch
+    reaches ``max_batch`` documents, and on shutdown. Once ``max_pending``
+    writes are buffered, callers wait for a flush (backpressure) instead of
+    growing the buffer without bound.
+    """
+
+    def __init__(self, driver: StorageDriver, max_batch: Optional[int] = None,
+                 flush_interval: Optional[float] = None, max_pending: Optional[int] = None):
+        self.driver = driver
+        self.max_batch = max_batch or Config.WRITE_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.WRITE_FLUSH_INTERVAL
+        self.max_pending = max_pending or Config.WRITE_MAX_PENDING
+        self._inserts: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._touches: Dict[int, datetime] = {}
+        self._flush_lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        self._flushes = set()
+        self.documents_written = 0
+        self.database_ops = 0
+        self.dropped = 0
+
+    @property
+    def pending(self) -> int:
+        return sum(len(docs) for docs in self._inserts.values()) + len(self._touches)
+
+    def _ensure_timer(self):
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _flush_soon(self):
+        task = asyncio.create_task(self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def insert(self, collection: str, document: Dict[str, Any]):
+        """Queue a document for a batched insert"""
+        self._ensure_timer()
+        if self.pending >= self.max_pending:
+            # Backpressure: make the caller wait for the buffer to drain
+            await self.flush()
+        self._inserts[collection].append(document)
+        if len(self._inserts[collection]) >= self.max_batch:
+            self._flush_soon()
+
+    async def touch_user(self, user_id: int, when: datetime):
+        """Queue a debounced ``last_interaction`` update"""
+        self._ensure_timer()
+        if self.pending >= self.max_pending:
+            await self.flush()
+        self._touches[user_id] = when
+
+    async def flush(self):
+        """Write everything buffered so far"""
+        async with self._flush_lock:
+            inserts, self._inserts = self._inserts, defaultdict(list)
+            touches, self._touches = self._touches, {}
+
+            for collection, documents in inserts.items():
+                for start in range(0, len(documents), self.max_batch):
+                    batch = documents[start:start + self.max_batch]
+                    try:
+                        await self.driver.insert_many(collection, batch)
+                        self.documents_written += len(batch)
+                        self.database_ops += 1
+                    except Exception as e:
+                        self.dropped += len(batch)
+                        logger.error(f"Error writing {len(batch)} documents to {collection}: {e}")
+
+            if touches:
+                try:
+                    await self.driver.bulk_update('users', [
+                        ({'user_id': user_id}, {'$set': {'last_interaction': when}})
+                        for user_id, when in touches.items()
+                    ])
+                    self.documents_written += len(touches)
+                    self.database_ops += 1
+                except Exception as e:
+                    self.dropped += len(touches)
+                    logger.error(f"Error updating last_interaction for {len(touches)} users: {e}")
+
+    async def close(self):
+        """Stop the flush timer and write whatever is still buffered"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self.flush()
+        logger.info(f"Write buffer closed ({self.documents_written} documents in {self.database_ops} operations)")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'pending': self.pending,
+            'documents_written': self.documents_written,
+            'database_ops': self.database_ops,
+            'dropped': self.dropped
+        }
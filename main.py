@@ -1,25 +1,31 @@
+import time
+_import_started = time.perf_counter()
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-from pymongo import MongoClient
 from datetime import datetime, UTC
 from dotenv import load_dotenv
 import os
+import json
 import logging
 import sys
-from services.gemini_service import GeminiService
-from database.models import ChatHistory
-from services.web_search import WebSearchService
-from services.file_handler import FileHandler
+from services.gemini_service import FLASH_MODEL, IMAGE_PROMPT_VERSION, is_error_response
+from services.file_handler import PDF_PROMPT_VERSION
+from services.downloads import MemoryBudgetExceeded
+from services.image_preprocessor import select_photo_size
+from services.streaming import StreamingReply
+from services.outbound import PRIORITY_INTERACTIVE, PRIORITY_BULK
+from services.renderer import escape, render_html, render_message
+from services.quiz_bank import normalize_topic
+from services.sessions import SessionTooLarge
+from services.metrics import track_call, track_handler
+from services.admission import Rejected, admission_controlled
+from services.container import ServiceContainer
+from services.update_processor import ChatOrderedUpdateProcessor
+from services.webhook import WebhookApp, register_webhook
 from config.config import Config
-from database.db_operations import DatabaseOperations
-import speech_recognition as sr
-import requests
-import smtplib
 import asyncio
-import httpx
-from motor.motor_asyncio import AsyncIOMotorClient
-from typing import Dict, Optional, Any, List
-import random
+from typing import Optional
 
 # Set up logging
 logging.basicConfig(
@@ -35,89 +41,18 @@ TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 
-if not MONGODB_URI or not TELEGRAM_TOKEN:
+if not TELEGRAM_TOKEN or (Config.DB_DRIVER == 'motor' and not MONGODB_URI):
     logger.error("Missing environment variables!")
     sys.exit(1)
 
-# MongoDB setup
-try:
-    client = MongoClient(Config.MONGODB_URI, serverSelectionTimeoutMS=5000)
-    # Test the connection
-    client.server_info()
-    db = client[Config.DB_NAME]
-    users_collection = db['users']
-    logger.info("MongoDB connection successful!")
-except Exception as e:
-    logger.error(f"MongoDB connection failed: {e}")
-    raise
-
-# Add to your global variables
-gemini_service = GeminiService()
-web_search_service = WebSearchService()
-file_handler = FileHandler()
-db_ops = DatabaseOperations()
-
-class DatabaseManager:
-    """Handles all database operations."""
-    def __init__(self):
-        self.client = AsyncIOMotorClient(Config.MONGODB_URI)
-        self.db = self.client['telegram_bot']
-        self.users = self.db.users
-        self.chat_history = self.db.chat_history
-
-    async def save_user(self, user_data: Dict[str, Any]) -> None:
-        """Save user data to database."""
-        await self.users.update_one(
-            {"user_id": user_data["user_id"]},
-            {"$set": user_data},
-            upsert=True
-        )
+# Clients and services are built on first use, once per process
+container = ServiceContainer()
+import_seconds = time.perf_counter() - _import_started
 
-    async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """Retrieve user data from database."""
-        user_data = await self.users.find_one({"user_id": user_id})
-        return user_data  # Ensure this returns a valid user object or None
-
-    async def save_chat_history(self, user_id: int, message: str, response: str):
-        """Save chat history to the database."""
-        chat_data = {
-            "user_id": user_id,
-            "user_message": message,
-            "bot_response": response,
-            "timestamp": datetime.now(UTC)
-        }
-        await self.chat_history.insert_one(chat_data)
-
-async def format_message(text: str) -> str:
-    """Format message with emojis and better structure"""
-    formatted_text = text
-
-    # Add section breaks for lists if they exist
-    if any(line.strip().startswith(('-', '•', '*', '1.')) for line in text.split('\n')):
-        formatted_text = formatted_text.replace('\n-', '\n• ')
-        formatted_text = formatted_text.replace('\n*', '\n• ')
-
-    # Handle bold headings correctly
-    bold_headings = ['Note:', 'Important:', 'Key point:', 'Remember:', 'Warning:']
-    for phrase in bold_headings:
-        if phrase in formatted_text:
-            formatted_text = formatted_text.replace(phrase, f"\n\n<b>{phrase}</b>\n")
-    
-    # Add section emojis based on content
-    lower_text = formatted_text.lower()
-    if 'example' in lower_text:
-        formatted_text = "💡 " + formatted_text
-    elif any(word in lower_text for word in ['error', 'warning', 'caution']):
-        formatted_text = "⚠️ " + formatted_text
-    elif any(word in lower_text for word in ['success', 'complete', 'done']):
-        formatted_text = "✅ " + formatted_text
-    else:
-        formatted_text = "🤖 " + formatted_text
-
-    # Add line breaks for better readability
-    formatted_text = formatted_text.replace('\n', '\n\n')
-    
-    return formatted_text
+async def reply_rendered(message, text: str, decorated: bool = True, **kwargs):
+    """Render a model reply as Telegram HTML and send it in as many messages as needed."""
+    for chunk in render_message(text, decorated=decorated):
+        await container.outbound.reply_text(message, chunk, parse_mode=ParseMode.HTML, **kwargs)
 
 async def start_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command."""
@@ -125,17 +60,12 @@ async def start_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_data = {
         "user_id": user.id,
         "username": user.username,
-        "first_name": user.first_name,
-        "last_interaction": datetime.now(UTC)
+        "first_name": user.first_name
     }
     
-    # Check if the user is already registered
+    # Register the user, or refresh their details if already registered
     registration_msg = ""
-    existing_user = db['users'].find_one({"user_id": user.id})
-
-    if not existing_user:
-        # Register the user in the database
-        db['users'].insert_one(user_data)
+    if await container.db_ops.register_user(user_data):
         registration_msg = "You have been successfully registered! 🎉"
     
 
@@ -144,7 +74,7 @@ async def start_chat(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = ReplyKeyboardMarkup([[contact_button]], resize_keyboard=True)
     
     welcome_msg = f"{registration_msg}\n\nWelcome {user.first_name}! You are already registered as {user.username} ✨!"
-    await update.message.reply_text(welcome_msg, reply_markup=reply_markup)
+    await container.outbound.reply_text(update.message, welcome_msg, reply_markup=reply_markup)
 
 async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle contact sharing."""
@@ -153,70 +83,139 @@ async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if contact and contact.user_id == user_id:
         # Save the user's phone number in the database
-        users_collection.update_one(
-            {'user_id': user_id},
-            {'$set': {'phone_number': contact.phone_number}}
-        )
-        await update.message.reply_text("Contact information saved successfully!")
+        await container.db_ops.update_user_contact(user_id, contact.phone_number)
+        await container.outbound.reply_text(update.message, "Contact information saved successfully!")
     else:
-        await update.message.reply_text("Please share your own contact information.")
+        await container.outbound.reply_text(update.message, "Please share your own contact information.")
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle user messages."""
-    user_message = update.message.text
-    response = await get_gemini_response(user_message)
-    await update.message.reply_text(response)
+    await answer_text(update, context, update.message.text)
+
+async def answer_text(update: Update, context: ContextTypes.DEFAULT_TYPE, user_message: str):
+    """Answer a text (or transcribed voice) message with conversation context."""
+    user_id = update.effective_user.id
+    # Include the running summary and recent turns of this conversation
+    prompt = await container.conversation_memory.build_prompt(user_id, user_message)
+    # Only context-free questions are shared answers; a prompt carrying one
+    # user's history would never be asked again, so it is not cached
+    use_cache = prompt == user_message
+
+    if Config.STREAM_REPLIES:
+        # Show the reply as it is generated instead of waiting for all of it
+        try:
+            reply = StreamingReply(context.bot, update.effective_chat.id, sender=container.outbound, render=render_html)
+            response = await reply.consume(stream_gemini_response(prompt, user_id, use_cache=use_cache))
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            await container.outbound.reply_text(update.message, "❌ Sorry, I couldn't generate a response. Please try again.")
+            return
+        if not response:
+            response = "No response"
+            await container.outbound.reply_text(update.message, response)
+    else:
+        response = await get_gemini_response(prompt, user_id, use_cache=use_cache)
+        await reply_rendered(update.message, response, decorated=False)
+
+    if is_failed_reply(response):
+        # Errors must not become context for the next prompt
+        return
 
     # Save chat history
-    await db_ops.save_chat_history(update.effective_user.id, user_message, response)
+    timestamp = datetime.now(UTC)
+    container.conversation_memory.record(user_id, user_message, response, timestamp)
+    await container.db_ops.save_chat_history(user_id, user_message, response, timestamp)
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user_id = update.effective_user.id
-        photo = update.message.photo[-1]  # Get the largest photo
+        # Get the smallest size that still covers the resize target
+        photo = select_photo_size(update.message.photo)
         
         # Show processing message
-        processing_msg = await update.message.reply_text(
-            "🔄 Processing your image... Please wait."
+        processing_msg = await container.outbound.reply_text(
+            update.message,
+            "🔄 Processing your image... Please wait.",
+            priority=PRIORITY_INTERACTIVE
         )
         
+        streamed = False
         try:
-            # Download photo
-            file = await context.bot.get_file(photo.file_id)
-            photo_data = await file.download_as_bytearray()
-            
-            # Analyze with Gemini
-            analysis = await gemini_service.analyze_image(photo_data)
-            
-            # Format the analysis
-            formatted_analysis = await format_message(analysis)
+            # Forwarded photos reuse an earlier analysis without downloading
+            content_hash = None
+            analysis = await container.db_ops.find_cached_analysis(
+                IMAGE_PROMPT_VERSION, file_unique_id=photo.file_unique_id
+            )
+            cacheable = analysis is not None
+
+            if analysis is None:
+                # Download photo into memory
+                async with container.downloader.download(context.bot, photo.file_id, photo.file_size) as downloaded:
+                    content_hash = await asyncio.to_thread(downloaded.sha256)
+                    analysis = await container.db_ops.find_cached_analysis(
+                        IMAGE_PROMPT_VERSION, content_hash=content_hash
+                    )
+                    cacheable = analysis is not None
+
+                    if analysis is None:
+                        # Analyze with Gemini
+                        if Config.STREAM_REPLIES:
+                            # Stream the analysis into the processing message
+                            reply = StreamingReply(
+                                context.bot, update.effective_chat.id, processing_msg,
+                                sender=container.outbound, render=render_html
+                            )
+                            analysis = await reply.consume(
+                                container.gemini_service.stream_image_analysis(downloaded.data, user_id)
+                            )
+                            streamed = cacheable = bool(analysis)
+                            if not analysis:
+                                analysis = "Sorry, I couldn't analyze this image properly."
+                        else:
+                            analysis = await container.gemini_service.analyze_image(downloaded.data, user_id)
+                            cacheable = not is_error_response(analysis)
             
             # Save metadata
-            await db_ops.save_file_metadata({
+            metadata = {
                 'user_id': user_id,
                 'file_id': photo.file_id,
                 'file_name': f"photo_{photo.file_id}",
                 'file_type': 'photo',
-                'analysis': formatted_analysis,
+                'analysis': analysis,
                 'timestamp': datetime.now(UTC)
-            })
+            }
+            if cacheable:
+                metadata.update({
+                    'file_unique_id': photo.file_unique_id,
+                    'content_hash': content_hash,
+                    'prompt_version': IMAGE_PROMPT_VERSION
+                })
+            await container.db_ops.save_file_metadata(metadata)
             
-            await update.message.reply_text(
-                formatted_analysis
-            )
+            if not streamed:
+                await reply_rendered(update.message, analysis)
             
+        except MemoryBudgetExceeded as e:
+            logger.warning(f"Rejected image upload: {e}")
+            await container.outbound.reply_text(
+                update.message,
+                "⏳ Too many files are being processed right now. Please try again shortly."
+            )
         except Exception as e:
             logger.error(f"Error processing image: {e}")
-            await update.message.reply_text(
+            await container.outbound.reply_text(
+                update.message,
                 "❌ Sorry, I couldn't analyze this image. Please try again."
             )
         finally:
-            # Clean up processing message
-            await processing_msg.delete()
+            # Clean up processing message unless the reply was streamed into it
+            if not streamed:
+                await container.outbound.delete_message(processing_msg)
             
     except Exception as e:
         logger.error(f"Error in photo handler: {e}")
-        await update.message.reply_text(
+        await container.outbound.reply_text(
+            update.message,
             "❌ Sorry, something went wrong. Please try again later."
         )
 
@@ -227,61 +226,107 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         file_ext = os.path.splitext(document.file_name)[1].lower()
         
         if file_ext not in ['.pdf', '.PDF']:
-            await update.message.reply_text(
+            await container.outbound.reply_text(
+                update.message,
                 "⚠️ Sorry, I can only process PDF files at the moment."
             )
             return
 
         # Show processing message
-        processing_msg = await update.message.reply_text(
-            "🔄 Processing your file... Please wait."
+        processing_msg = await container.outbound.reply_text(
+            update.message,
+            "🔄 Processing your file... Please wait.",
+            priority=PRIORITY_INTERACTIVE
         )
         
+        streamed = False
         try:
-            # Download file
-            file = await context.bot.get_file(document.file_id)
-            file_path = f"downloads/{document.file_name}"
-            await file.download_to_drive(file_path)
-            
-            # Process with file handler
-            analysis = await file_handler.process_file(file_path, file_ext)
-            
-            # Format the analysis
-            formatted_analysis = await format_message(analysis)
+            # Re-shared documents reuse an earlier analysis without downloading
+            content_hash = None
+            analysis = await container.db_ops.find_cached_analysis(
+                PDF_PROMPT_VERSION, file_unique_id=document.file_unique_id
+            )
+            cacheable = analysis is not None
+
+            if analysis is None:
+                # Download file into memory (very large files spill to a temp file)
+                async with container.downloader.download(
+                    context.bot, document.file_id, document.file_size, suffix=file_ext
+                ) as downloaded:
+                    content_hash = await asyncio.to_thread(downloaded.sha256)
+                    analysis = await container.db_ops.find_cached_analysis(
+                        PDF_PROMPT_VERSION, content_hash=content_hash
+                    )
+                    cacheable = analysis is not None
+
+                    if analysis is None:
+                        # Process with file handler
+                        if Config.STREAM_REPLIES:
+                            # Stream the analysis into the processing message
+                            prompt = await container.file_handler.prepare_pdf_prompt(downloaded.source, user_id)
+                            reply = StreamingReply(
+                                context.bot, update.effective_chat.id, processing_msg,
+                                sender=container.outbound, render=render_html
+                            )
+                            analysis = await reply.consume(
+                                container.gemini_service.stream_chat_response(prompt, user_id)
+                            )
+                            streamed = cacheable = bool(analysis)
+                            if not analysis:
+                                analysis = "Sorry, I couldn't process your message properly."
+                        else:
+                            analysis = await container.file_handler.process_pdf(downloaded.source, user_id)
+                            cacheable = not is_error_response(analysis)
             
             # Save metadata
-            await db_ops.save_file_metadata({
+            metadata = {
                 'user_id': user_id,
                 'file_id': document.file_id,
                 'file_name': document.file_name,
                 'file_type': file_ext,
-                'analysis': formatted_analysis,
+                'analysis': analysis,
                 'timestamp': datetime.now(UTC)
-            })
+            }
+            if cacheable:
+                metadata.update({
+                    'file_unique_id': document.file_unique_id,
+                    'content_hash': content_hash,
+                    'prompt_version': PDF_PROMPT_VERSION
+                })
+            await container.db_ops.save_file_metadata(metadata)
             
-            await update.message.reply_text(
-                formatted_analysis
-            )
+            if not streamed:
+                await reply_rendered(update.message, analysis)
             
+        except MemoryBudgetExceeded as e:
+            logger.warning(f"Rejected document upload: {e}")
+            await container.outbound.reply_text(
+                update.message,
+                "⏳ Too many files are being processed right now. Please try again shortly."
+            )
         except Exception as e:
             logger.error(f"Error processing file: {e}")
-            await update.message.reply_text(
+            await container.outbound.reply_text(
+                update.message,
                 "❌ Sorry, I couldn't analyze this file. Please try again."
             )
         finally:
-            # Clean up processing message
-            await processing_msg.delete()
+            # Clean up processing message unless the reply was streamed into it
+            if not streamed:
+                await container.outbound.delete_message(processing_msg)
             
     except Exception as e:
         logger.error(f"Error in document handler: {e}")
-        await update.message.reply_text(
+        await container.outbound.reply_text(
+            update.message,
             "❌ Sorry, something went wrong. Please try again later."
         )
 
 async def handle_websearch(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         if not context.args:
-            await update.message.reply_text(
+            await container.outbound.reply_text(
+                update.message,
                 "ℹ️ Please provide a search query.\nExample: /websearch artificial intelligence"
             )
             return
@@ -291,97 +336,162 @@ async def handle_websearch(update: Update, context: ContextTypes.DEFAULT_TYPE):
         username = update.effective_user.username
         
         # Show searching message
-        search_msg = await update.message.reply_text(
-            "🔍 Searching the web... Please wait."
+        search_msg = await container.outbound.reply_text(
+            update.message,
+            "🔍 Searching the web... Please wait.",
+            priority=PRIORITY_INTERACTIVE
         )
         
         try:
             # Perform web search
-            search_data = await web_search_service.search(query)
+            search_data = await container.web_search_service.search(query, user_id=user_id)
             
             # Format and send summary
-            summary_text = f"Search results for: {query}\n\n"
-            summary_text += await format_message(search_data['summary'])
-            await update.message.reply_text(
-                summary_text
+            await reply_rendered(
+                update.message,
+                f"Search results for: {query}\n\n{search_data['summary']}"
             )
             
-            # Send results
-            if search_data['results']:
-                for i, result in enumerate(search_data['results'], 1):
-                    result_text = f"{i}. {result['title']}\n"
-                    if result['link']:
-                        result_text += f"🔗 {result['link']}\n"
-                    result_text += f"{result['snippet']}\n"
-                    
-                    await update.message.reply_text(
-                        result_text,
-                        disable_web_page_preview=True
-                    )
+            # Queue all results at once so the sender can merge them into fewer messages
+            sends = []
+            for i, result in enumerate(search_data['results'], 1):
+                result_text = f"{i}. <b>{escape(result['title'])}</b>\n"
+                if result['link']:
+                    result_text += f"🔗 {escape(result['link'])}\n"
+                result_text += escape(result['snippet'])
+
+                sends.append(container.outbound.reply_text(
+                    update.message,
+                    result_text,
+                    priority=PRIORITY_BULK,
+                    coalesce=True,
+                    parse_mode=ParseMode.HTML,
+                    disable_web_page_preview=True
+                ))
+            await asyncio.gather(*sends)
             
             # Save to MongoDB
-            db['search_history'].insert_one({
+            await container.db_ops.save_search_history({
                 'user_id': user_id,
                 'username': username,
                 'query': query,
-                'results': search_data,
-                'timestamp': datetime.now(UTC)
+                'results': search_data
             })
             
         except Exception as e:
             logger.error(f"Search processing error: {e}")
-            await update.message.reply_text(
+            await container.outbound.reply_text(
+                update.message,
                 "❌ An error occurred while processing the search results."
             )
             
     except Exception as e:
         logger.error(f"Error in web search: {e}")
-        await update.message.reply_text(
+        await container.outbound.reply_text(
+            update.message,
             "❌ Sorry, I couldn't complete the web search. Please try again later."
         )
 
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    try:
-        user_id = update.effective_user.id
-        voice = update.message.voice
-
-        # Download the voice message
-        file = await context.bot.get_file(voice.file_id)
-        file_path = f"downloads/voice_{user_id}.ogg"
-        await file.download_to_drive(file_path)
+    """Transcribe a voice message and answer it like a text message."""
+    voice = update.message.voice
+    if voice.duration and voice.duration > Config.VOICE_MAX_DURATION:
+        await container.outbound.reply_text(
+            update.message,
+            f"⚠️ Voice messages can be at most {Config.VOICE_MAX_DURATION} seconds long."
+        )
+        return
 
-        # Convert OGG to WAV (if necessary)
-        wav_file_path = f"downloads/voice_{user_id}.wav"
-        os.system(f"ffmpeg -i {file_path} {wav_file_path}")
+    try:
+        # Decoded straight from memory through an ffmpeg pipe
+        async with container.downloader.download(context.bot, voice.file_id, voice.file_size, suffix='.ogg') as downloaded:
+            text = await container.voice_transcriber.transcribe(downloaded.source)
+    except MemoryBudgetExceeded as e:
+        logger.warning(f"Rejected voice message: {e}")
+        await container.outbound.reply_text(
+            update.message,
+            "⏳ Too many files are being processed right now. Please try again shortly."
+        )
+        return
+    except Exception as e:
+        logger.error(f"Error processing voice message: {e}")
+        text = ""
 
-        # Recognize speech using SpeechRecognition
-        recognizer = sr.Recognizer()
-        with sr.AudioFile(wav_file_path) as source:
-            audio = recognizer.record(source)  # Read the entire audio file
+    if not text:
+        await container.outbound.reply_text(update.message, "❌ Sorry, I couldn't understand the voice message.")
+        return
 
-        # Convert speech to text
-        text = recognizer.recognize_google(audio)
-        await update.message.reply_text(f"You said: {text}")
+    await container.outbound.reply_text(update.message, f"🎙 You said: {text}", priority=PRIORITY_INTERACTIVE)
+    await answer_text(update, context, text)
 
-    except Exception as e:
-        logger.error(f"Error processing voice message: {e}")
-        await update.message.reply_text("❌ Sorry, I couldn't understand the voice message.")
+def is_failed_reply(text: str) -> bool:
+    """Fallback and error replies, as opposed to real model output"""
+    return text == "No response" or text.startswith("Error: ") or is_error_response(text)
 
-async def get_gemini_response(user_message):
+async def get_gemini_response(user_message, user_id: Optional[int] = None, use_cache: bool = True):
     """Call the Gemini API to get a response from Gemini 1.5 Flash."""
-    url = "https://generativelanguage.googleapis.com/v1/models/gemini-1.5-flash:generateContent"
+    url = f"{Config.GEMINI_API_BASE}/v1/models/{FLASH_MODEL}:generateContent"
+
+    # Identical questions are answered from the cache without an API call
+    cache_key = container.response_cache.make_key(user_message, FLASH_MODEL) if use_cache else None
+    if cache_key is not None:
+        cached = await container.response_cache.get(cache_key)
+        if cached is not None:
+            return cached
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            url,
-            json={"contents": [{"parts": [{"text": user_message}]}]},
-            params={"key": GEMINI_API_KEY}  # Send API key as a parameter
-        )
-        
-        if response.status_code == 200:
-            return response.json().get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "No response")
-        else:
-            return f"Error: {response.status_code}, {response.text}"
+    async with container.gemini_service.scheduler.slot(FLASH_MODEL, user_id):
+        with track_call('gemini', FLASH_MODEL):
+            response = await container.http_client.post(
+                url,
+                json={"contents": [{"parts": [{"text": user_message}]}]},
+                params={"key": GEMINI_API_KEY}  # Send API key as a parameter
+            )
+    
+    if response.status_code == 200:
+        text = response.json().get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text")
+        if text is None:
+            return "No response"
+        if cache_key is not None:
+            await container.response_cache.set(cache_key, text)
+        return text
+    else:
+        return f"Error: {response.status_code}, {response.text}"
+
+async def stream_gemini_response(user_message, user_id: Optional[int] = None, use_cache: bool = True):
+    """Stream a Gemini 1.5 Flash response, yielding text as it arrives."""
+    url = f"{Config.GEMINI_API_BASE}/v1/models/{FLASH_MODEL}:streamGenerateContent"
+
+    cache_key = container.response_cache.make_key(user_message, FLASH_MODEL) if use_cache else None
+    if cache_key is not None:
+        cached = await container.response_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    async with container.gemini_service.scheduler.slot(FLASH_MODEL, user_id):
+        with track_call('gemini', f"{FLASH_MODEL}:stream"):
+            async with container.http_client.stream(
+                "POST",
+                url,
+                json={"contents": [{"parts": [{"text": user_message}]}]},
+                params={"key": GEMINI_API_KEY, "alt": "sse"}  # Server-sent events
+            ) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    raise RuntimeError(f"Gemini error {response.status_code}: {body[:200]!r}")
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    event = json.loads(line[len("data:"):])
+                    candidate = event.get("candidates", [{}])[0]
+                    text = "".join(p.get("text", "") for p in candidate.get("content", {}).get("parts", []))
+                    if text:
+                        parts.append(text)
+                        yield text
+
+    if parts and cache_key is not None:
+        await container.response_cache.set(cache_key, "".join(parts))
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /help command."""
@@ -392,153 +502,162 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Analyze Image - Send an image for analysis.\n"
         "Analyze PDF - Send a PDF for analysis.\n"
         "/websearch - Perform a web search.\n"
+        "/quiz <topic> - Take a multiple-choice quiz.\n"
         "About - Learn more about this bot.\n"
         "Share Contact - Share your contact information with the bot."
     )
-    await update.message.reply_text(help_text)
-
-async def fetch_quiz_questions(topic: str) -> List[Dict[str, Any]]:
-    """Fetch quiz questions based on the topic from the Gemini API."""
-    url = "https://generativelanguage.googleapis.com/v1/models/gemini-1.5-flash:generateContent"
-    prompt = f"Generate a multiple-choice quiz on {topic}. Provide 5 questions, each with 4 options and the correct answer."
-
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                json={"contents": [{"parts": [{"text": prompt}]}]},
-                params={"key": GEMINI_API_KEY},
-                timeout=10.0
-            )
-
-            # Log the response status and content
-            logger.info(f"API Response Status: {response.status_code}")
-            logger.info(f"API Response Content: {response.text}")
-
-            if response.status_code != 200:
-                logger.error(f"API Error: {response.status_code}, {response.text}")
-                return []
-
-            response_data = response.json()
-            logger.info(f"API Response: {response_data}")
-            questions = parse_quiz_questions(response_data)  # Ensure this function is implemented correctly
-            return questions if questions else []
+    await container.outbound.reply_text(update.message, help_text)
 
-    except Exception as e:
-        logger.error(f"Error fetching questions: {e}")
-        return []
-
-def parse_quiz_questions(response_data) -> List[Dict[str, Any]]:
-    """Parse the API response to extract quiz questions."""
-    questions = []
-    
-    # Check if candidates list is not empty
-    if not response_data.get("candidates"):
-        logger.error("No candidates found in the response.")
-        return questions  # Return an empty list if no candidates
-
-    # Extract the text from the response
-    text_content = response_data['candidates'][0]['content']['parts'][0]['text']
-    
-    # Split the text into individual questions based on the format
-    question_blocks = text_content.split("\n\n")  # Split by double newlines
-
-    for block in question_blocks:
-        if block.strip():  # Ensure the block is not empty
-            # Split the question and options
-            lines = block.split("\n")
-            question = lines[0]  # The first line is the question
-            options = [line for line in lines[1:] if line]  # Remaining lines are options
-            
-            # Extract the correct answer from the last line
-            correct_answer = options[-1].split("**Correct Answer: ")[-1].strip()
-            options = options[:-1]  # Remove the correct answer line from options
-            
-            questions.append({
-                "question": question,
-                "options": options,
-                "answer": correct_answer  # Store the correct answer
-            })
-    
-    return questions
+def quiz_session_key(user_id: int) -> str:
+    return f"quiz:{user_id}"
 
 async def start_quiz(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Start the quiz by asking for a topic."""
+    """Start a quiz on the given topic."""
     if not context.args:
-        await update.message.reply_text("ℹ️ Please provide a topic for the quiz.\nExample: /quiz python")
+        await container.outbound.reply_text(update.message, "ℹ️ Please provide a topic for the quiz.\nExample: /quiz python")
         return
 
     topic = ' '.join(context.args)  # Join the arguments to form the topic
+    user_id = update.effective_user.id
+    if len(topic) > Config.QUIZ_MAX_TOPIC_CHARS:
+        await container.outbound.reply_text(
+            update.message, f"ℹ️ Please use a shorter topic (up to {Config.QUIZ_MAX_TOPIC_CHARS} characters)."
+        )
+        return
 
-    # Send a message indicating that the quiz is being generated
-    await update.message.reply_text("🔄 Generating your quiz... Please wait.")
-
-    questions = await fetch_quiz_questions(topic)
+    # Banked topics start straight away; only brand-new topics wait for Gemini
+    questions = await container.quiz_bank.get_quiz(topic, user_id=user_id)
+    if not questions:
+        await container.outbound.reply_text(update.message, "🔄 Generating your quiz... Please wait.")
+        questions = await container.quiz_bank.get_quiz(topic, generate=True, user_id=user_id)
 
     if questions:
-        context.user_data['quiz_questions'] = questions
-        context.user_data['current_question'] = 0
-        context.user_data['score'] = 0
-        await ask_question(update, context)
+        # Only ids and counters are stored; questions are re-read from the bank
+        try:
+            await container.session_store.put(quiz_session_key(user_id), {
+                't': normalize_topic(topic),
+                'n': topic,
+                'q': [question['qid'] for question in questions],
+                'i': 0,
+                's': 0,
+                'a': []
+            })
+        except SessionTooLarge as e:
+            logger.error(f"Could not start quiz for user {user_id}: {e}")
+            await container.outbound.reply_text(update.message, "❌ Sorry, I couldn't start that quiz. Please try a shorter topic.")
+            return
+        await ask_question(update.message, questions[0])
     else:
-        await update.message.reply_text("Sorry, I couldn't find any questions for that topic. Try another one.")
-
-async def ask_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Ask the current question using inline buttons."""
-    user_data = context.user_data
-    current_question_index = user_data['current_question']
-    questions = user_data['quiz_questions']
-
-    if current_question_index >= len(questions):
-        # Save quiz results to the database
-        await db_ops.save_quiz_results(
-            user_id=update.effective_user.id,
-            topic=' '.join(context.args),  # Assuming you have the topic stored
-            questions=[q['question'] for q in questions],
-            user_answers=user_data.get('user_answers', []),
-            score=user_data['score']
-        )
-        await update.message.reply_text(f"Quiz completed! Your final score: {user_data['score']}/{len(questions)} 🎉")
-        return
-
-    question = questions[current_question_index]
-    question_text = question['question']
-    options = question['options']
-    
-    # Create inline buttons
-    keyboard = [[InlineKeyboardButton(opt, callback_data=opt) for opt in options]]
+        await container.outbound.reply_text(update.message, "Sorry, I couldn't find any questions for that topic. Try another one.")
+
+async def ask_question(message, question: dict):
+    """Ask a question using inline buttons."""
+    # Callback data is limited to 64 bytes, so buttons carry the question id and option index
+    keyboard = [
+        [InlineKeyboardButton(option, callback_data=f"quiz:{question['qid']}:{i}")]
+        for i, option in enumerate(question['options'])
+    ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    await update.message.reply_text(question_text, reply_markup=reply_markup)
+    await container.outbound.reply_text(message, question['question'], reply_markup=reply_markup)
+
+async def finish_quiz(message, user_id: int, state: dict):
+    """Save the results of a finished quiz and report the score."""
+    questions = await container.quiz_bank.get_questions(state['t'], state['q'])
+    await container.db_ops.save_quiz_results(
+        user_id=user_id,
+        topic=state['n'],
+        questions=[q['question'] for q in questions],
+        user_answers=[q['options'][choice] for q, choice in zip(questions, state['a'])],
+        score=state['s']
+    )
+    await container.session_store.delete(quiz_session_key(user_id))
+    await container.outbound.reply_text(message, f"Quiz completed! Your final score: {state['s']}/{len(state['q'])} 🎉")
 
 async def handle_answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle the user's answer to the quiz question."""
-    user_data = context.user_data
-    current_question_index = user_data['current_question']
-    questions = user_data['quiz_questions']
-    question = questions[current_question_index]
-
-    # Store user's answer
-    if 'user_answers' not in user_data:
-        user_data['user_answers'] = []
-    user_data['user_answers'].append(update.callback_query.data)
-
-    if update.callback_query.data == question['answer']:
-        user_data['score'] += 1
-        await update.callback_query.answer("✅ Correct!")
+    query = update.callback_query
+    user_id = update.effective_user.id
+    _, qid, choice = query.data.split(':')
+
+    session = await container.session_store.get(quiz_session_key(user_id))
+    state = session.data if session else None
+    if state is None or state['i'] >= len(state['q']) or state['q'][state['i']] != qid:
+        # Button from an old question, a finished quiz or an expired session
+        await query.answer("This question is no longer active.")
+        return
+
+    questions = await container.quiz_bank.get_questions(state['t'], [qid])
+    if not questions:
+        await query.answer("This question is no longer available.")
+        return
+    question = questions[0]
+    choice = int(choice)
+    correct = choice == question['answer']
+
+    state['a'].append(choice)
+    state['s'] += int(correct)
+    state['i'] += 1
+    if not await container.session_store.update(quiz_session_key(user_id), session.version, state):
+        # Another worker already took an answer for this question
+        await query.answer("This question was already answered.")
+        return
+
+    if correct:
+        await query.answer("✅ Correct!")
     else:
-        await update.callback_query.answer(f"❌ Incorrect! The correct answer was: {question['answer']}")
+        await query.answer(f"❌ Incorrect! The correct answer was: {question['options'][question['answer']]}")
 
-    user_data['current_question'] += 1
-    await ask_question(update.callback_query.message, context)
+    if state['i'] >= len(state['q']):
+        await finish_quiz(query.message, user_id, state)
+        return
+    next_question = await container.quiz_bank.get_questions(state['t'], [state['q'][state['i']]])
+    if next_question:
+        await ask_question(query.message, next_question[0])
 
 class TelegramBot:
     """Main bot class handling all Telegram interactions."""
     def __init__(self):
-        self.db = DatabaseManager()
-        self.app = Application.builder().token(os.getenv("TELEGRAM_TOKEN")).build()
+        self.db = container.db_ops
+        self.admission = container.admission if Config.ADMISSION_CONTROL else None
+        builder = (
+            Application.builder()
+            .token(os.getenv("TELEGRAM_TOKEN"))
+            .base_url(Config.TELEGRAM_BASE_URL)
+            .base_file_url(Config.TELEGRAM_BASE_FILE_URL)
+            .post_init(self.post_init)
+            .post_stop(self.post_stop)
+            .post_shutdown(self.post_shutdown)
+        )
+        if Config.CONCURRENT_UPDATES > 1:
+            # Handle chats in parallel while keeping each chat's updates in order
+            builder = builder.concurrent_updates(
+                ChatOrderedUpdateProcessor(Config.CONCURRENT_UPDATES)
+            )
+        self.app = builder.build()
         self.setup_handlers()
 
+    async def post_init(self, application: Application):
+        """Check the database and its indexes, and start the watchdog and metrics endpoint."""
+        if await self.db.ping():
+            await self.db.ensure_indexes()
+        if Config.LOOP_WATCHDOG:
+            container.loop_watchdog.start()
+            container.metrics_server.add_route('/stalls', container.loop_watchdog.report)
+        if Config.METRICS_PORT:
+            workers = Config.WEBHOOK_WORKERS if Config.BOT_MODE == 'webhook' else 1
+            await container.metrics_server.start(attempts=workers)
+        logger.info(container.report(imported_in=import_seconds))
+
+    async def post_stop(self, application: Application):
+        """Deliver queued replies while the bot can still send them."""
+        if container.built('outbound'):
+            await container.outbound.close()
+
+    async def post_shutdown(self, application: Application):
+        """Flush buffered writes, then release database, HTTP and worker pool resources."""
+        await container.close()
+
     def setup_handlers(self):
         """Set up all message handlers."""
         self.app.add_handler(CommandHandler('start', self.start_chat))
@@ -547,44 +666,105 @@ class TelegramBot:
         self.app.add_handler(CommandHandler('websearch', self.handle_websearch))
         self.app.add_handler(MessageHandler(filters.PHOTO, self.handle_photo))  # Handle image uploads
         self.app.add_handler(MessageHandler(filters.Document.MimeType("application/pdf"), self.handle_document))  # Handle PDF uploads
-        self.app.add_handler(CallbackQueryHandler(self.handle_answer))  # Handle quiz answers
+        self.app.add_handler(MessageHandler(filters.VOICE, self.handle_voice))  # Handle voice messages
+        self.app.add_handler(CommandHandler('quiz', self.start_quiz))
+        self.app.add_handler(CallbackQueryHandler(self.handle_answer, pattern=r'^quiz:'))  # Handle quiz answers
+        self.app.add_error_handler(error_handler)  # Anything unhandled still gets a reply
           
+    async def reject(self, update: Update, rejection: Rejected):
+        """Tell the user a request was shed and when to try again."""
+        if update.callback_query:
+            await update.callback_query.answer(rejection.message)
+        elif update.effective_message:
+            await container.outbound.reply_text(
+                update.effective_message, rejection.message, priority=PRIORITY_INTERACTIVE
+            )
+
+    @track_handler
     async def start_chat(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /start command."""
         await start_chat(update, context)
 
+    @track_handler
+    @admission_controlled('quiz')
     async def start_quiz(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Start the quiz by asking for a topic."""
         await start_quiz(update, context)
 
+    @track_handler
+    @admission_controlled('chat')
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle user messages."""
         await handle_message(update, context)
 
+    @track_handler
+    @admission_controlled('image')
     async def handle_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_photo(update, context)
 
+    @track_handler
+    @admission_controlled('pdf')
     async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_document(update, context)
 
+    @track_handler
+    @admission_controlled('search')
     async def handle_websearch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_websearch(update, context)
 
+    @track_handler
+    @admission_controlled('voice')
     async def handle_voice(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_voice(update, context)
 
+    @track_handler
     async def handle_contact(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_contact(update, context)
 
+    @track_handler
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await help_command(update, context)
 
+    @track_handler
+    @admission_controlled('answer')
     async def handle_answer(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await handle_answer(update, context)
 
     def run(self):
         """Run the bot."""
-        self.app.run_polling(drop_pending_updates=True)
+        if Config.BOT_MODE == 'webhook':
+            self.run_webhook()
+        else:
+            self.app.run_polling(drop_pending_updates=Config.DROP_PENDING_UPDATES)
+
+    def run_webhook(self):
+        """Serve updates over a webhook, sharded across worker processes."""
+        import uvicorn
+
+        async def setup():
+            async with self.app.bot:
+                await register_webhook(self.app)
+
+        asyncio.run(setup())
+        options = dict(
+            host=Config.WEBHOOK_HOST,
+            port=Config.WEBHOOK_PORT,
+            timeout_graceful_shutdown=int(Config.WEBHOOK_DRAIN_TIMEOUT) + 5
+        )
+        if Config.WEBHOOK_WORKERS <= 1:
+            # Serve this bot; an import string would load main a second time
+            # (next to __main__) with a second container
+            uvicorn.run(WebhookApp(self.app, container.db_ops), **options)
+            return
+        # Every worker imports this module and builds its own bot via the
+        # factory; this process only supervises them, so release what it built
+        asyncio.run(container.close())
+        uvicorn.run("main:create_webhook_app", factory=True, workers=Config.WEBHOOK_WORKERS, **options)
+
+def create_webhook_app() -> WebhookApp:
+    """ASGI factory used by each webhook worker process."""
+    bot = TelegramBot()
+    return WebhookApp(bot.app, container.db_ops)
 
 def main():
     """Main function to run the bot."""
@@ -597,7 +777,8 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         if update and update.effective_message:
-            await update.effective_message.reply_text(
+            await container.outbound.reply_text(
+                update.effective_message,
                 "❌ Sorry, something went wrong. Please try again later."
             )
     except Exception as e:
@@ -0,0 +1,312 @@
+"""Admission control: per-user and global rate limits plus a budget for heavy jobs."""
+import asyncio
+import functools
+import logging
+import math
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, UTC
+from typing import Dict, Iterable, List, Optional, Tuple
+from config.config import Config
+from database.drivers import StorageDriver
+from services.cache import TTLCache
+from services.metrics import registry
+from services.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_REJECTED = registry.counter(
+    'bot_admission_rejected_total', 'Requests shed by admission control', ['command_class', 'reason']
+)
+
+# How each command class is named in the reply to a rate-limited user
+LABELS = {
+    'chat': 'message',
+    'quiz': 'quiz',
+    'answer': 'quiz answer',
+    'search': 'web search',
+    'image': 'image',
+    'pdf': 'PDF',
+    'voice': 'voice message',
+}
+
+@dataclass(frozen=True)
+class Limit:
+    """``count`` requests per ``period`` seconds, with bursts of up to ``count``"""
+    count: float
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.count / self.period
+
+def parse_limits(spec: str) -> Dict[str, Limit]:
+    """Parse ``"search=5/60,pdf=3/60"`` into limits per command class"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        try:
+            name, _, value = item.partition('=')
+            count, _, period = value.partition('/')
+            limits[name.strip()] = Limit(float(count), float(period or 1))
+        except ValueError:
+            raise ValueError(f"Invalid limit {item!r}; expected <class>=<count>/<seconds>")
+    return limits
+
+class Rejected(Exception):
+    """Raised when a request is shed; ``reason`` is 'rate' or 'busy'"""
+
+    def __init__(self, command_class: str, reason: str, retry_after: float):
+        super().__init__(f"{command_class} request rejected ({reason}), retry in {retry_after:.1f}s")
+        self.command_class = command_class
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def message(self) -> str:
+        seconds = max(1, math.ceil(self.retry_after))
+        if self.reason == 'busy':
+            return f"⏳ I'm busy right now. Please try again in {seconds}s."
+        label = LABELS.get(self.command_class, self.command_class)
+        return f"⏳ Too many {label} requests. Please try again in {seconds}s."
+
+class LimitStore:
+    """Token buckets keyed by string, shared according to the backend"""
+
+    async def take(self, key: str, limit: Limit) -> float:
+        """Take one token; returns 0 on success, else seconds until one is available"""
+        raise NotImplementedError
+
+    async def refund(self, key: str, limit: Limit):
+        """Give back a token taken for a request that was shed anyway"""
+        raise NotImplementedError
+
+class MemoryLimitStore(LimitStore):
+    """Buckets in this process; idle buckets are dropped once they would be full again"""
+
+    def __init__(self, max_entries: Optional[int] = None):
+        max_entries = max_entries or Config.ADMISSION_MAX_ENTRIES
+        self._buckets = TTLCache(max_entries=max_entries, max_bytes=max_entries, ttl=60)
+
+    async def take(self, key, limit):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(limit.rate, limit.count)
+        wait = bucket.delay()
+        if not wait:
+            bucket.tokens -= 1
+        self._buckets.set(key, bucket, size=1, ttl=limit.period)
+        return wait
+
+    async def refund(self, key, limit):
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.tokens = min(bucket.capacity, bucket.tokens + 1)
+
+class DatabaseLimitStore(LimitStore):
+    """Buckets in the ``rate_limits`` collection, shared by every worker.
+
+    Each take is a read followed by a compare-and-set on the bucket's
+    version, so two workers never spend the same token. A TTL index drops
+    buckets that have been idle long enough to be full again.
+    """
+
+    ATTEMPTS = 3
+
+    def __init__(self, driver: StorageDriver):
+        self.driver = driver
+
+    async def take(self, key, limit):
+        for _ in range(self.ATTEMPTS):
+            entry = await self.driver.find_one('rate_limits', {'key': key})
+            now = time.time()
+            if entry is None:
+                tokens, version = limit.count, 0
+            else:
+                tokens = min(limit.count, entry['tokens'] + (now - entry['updated']) * limit.rate)
+                version = entry['v']
+            if tokens < 1:
+                return (1 - tokens) / limit.rate
+            update = {
+                '$set': {'tokens': tokens - 1, 'updated': now,
+                         'expires_at': datetime.now(UTC) + timedelta(seconds=limit.period)},
+                '$inc': {'v': 1}
+            }
+            if version == 0:
+                # Version 0 means "no bucket yet"; the unique index on key makes racing inserts fail
+                try:
+                    await self.driver.update_one('rate_limits', {'key': key, 'v': 0}, update, upsert=True)
+                    return 0.0
+                except Exception as e:
+                    logger.debug(f"Lost the race to create bucket {key}: {e}")
+                    continue
+            result = await self.driver.update_one('rate_limits', {'key': key, 'v': version}, update)
+            if result.matched_count:
+                return 0.0
+        # Lost every race: the bucket is being drained by other workers right now
+        return 1 / limit.rate
+
+    async def refund(self, key, limit):
+        # take() caps tokens at the limit; bumping the version makes a racing take retry
+        await self.driver.update_one('rate_limits', {'key': key}, {'$inc': {'tokens': 1, 'v': 1}})
+
+def create_limit_store(driver: StorageDriver, name: Optional[str] = None) -> LimitStore:
+    """Build the store selected by ``Config.ADMISSION_BACKEND``"""
+    name = (name or Config.ADMISSION_BACKEND).lower()
+    if name == 'database':
+        return DatabaseLimitStore(driver)
+    if name == 'memory':
+        return MemoryLimitStore()
+    raise ValueError(f"Unknown admission backend: {name}")
+
+class AdmissionController:
+    """Decides whether a request runs now or is shed with a retry hint.
+
+    Every request first takes a token from its user's bucket for its
+    command class, then from the class's global bucket (if one is
+    configured, e.g. to cap SerpApi spend across all users). Heavy classes
+    also need one of ``heavy_concurrency`` slots in this process; a request
+    that cannot get one within ``heavy_wait`` seconds is shed rather than
+    queued behind work it would only time out waiting for. Tokens of a
+    request shed for either reason are given back.
+    """
+
+    def __init__(self, store: LimitStore, user_limits: Optional[Dict[str, Limit]] = None,
+                 global_limits: Optional[Dict[str, Limit]] = None, heavy_classes: Optional[Iterable[str]] = None,
+                 heavy_concurrency: Optional[int] = None, heavy_wait: Optional[float] = None):
+        self.store = store
+        self.user_limits = parse_limits(Config.ADMISSION_USER_LIMITS) if user_limits is None else user_limits
+        self.global_limits = parse_limits(Config.ADMISSION_GLOBAL_LIMITS) if global_limits is None else global_limits
+        if heavy_classes is None:
+            heavy_classes = (name.strip() for name in Config.ADMISSION_HEAVY_CLASSES.split(','))
+        self.heavy_classes = set(filter(None, heavy_classes))
+        self.heavy_concurrency = heavy_concurrency or Config.ADMISSION_HEAVY_CONCURRENCY
+        self.heavy_wait = Config.ADMISSION_HEAVY_WAIT if heavy_wait is None else heavy_wait
+        self._heavy = asyncio.Semaphore(self.heavy_concurrency)
+        self.heavy_in_flight = 0
+        self.heavy_waiting = 0
+        # Moving average of heavy job durations, for the "try again in" hint
+        self._job_seconds = 5.0
+        # Users already told to wait, so spamming does not also spam replies
+        self._notified = TTLCache(max_entries=Config.ADMISSION_MAX_ENTRIES,
+                                  max_bytes=Config.ADMISSION_MAX_ENTRIES, ttl=60)
+        self.admitted = 0
+        self.rate_limited = 0
+        self.busy = 0
+
+    async def _take_tokens(self, command_class: str,
+                           user_id: Optional[int]) -> Tuple[float, List[Tuple[str, Limit]]]:
+        """Take the user's and the global token; returns the wait and the tokens taken.
+
+        When either bucket is empty, nothing stays taken.
+        """
+        buckets = []
+        limit = self.user_limits.get(command_class)
+        if limit is not None and user_id is not None:
+            buckets.append((f"user:{user_id}:{command_class}", limit))
+        limit = self.global_limits.get(command_class)
+        if limit is not None:
+            buckets.append((f"global:{command_class}", limit))
+        taken: List[Tuple[str, Limit]] = []
+        try:
+            for key, limit in buckets:
+                wait = await self.store.take(key, limit)
+                if wait:
+                    await self._refund(taken)
+                    return wait, []
+                taken.append((key, limit))
+        except Exception as e:
+            # A broken limit store must not take the bot down with it
+            logger.error(f"Error checking rate limits: {e}")
+        return 0.0, taken
+
+    async def _refund(self, taken: List[Tuple[str, Limit]]):
+        for key, limit in taken:
+            try:
+                await self.store.refund(key, limit)
+            except Exception as e:
+                logger.error(f"Error refunding rate limit token: {e}")
+
+    def _reject(self, command_class: str, reason: str, retry_after: float) -> Rejected:
+        if reason == 'busy':
+            self.busy += 1
+        else:
+            self.rate_limited += 1
+        ADMISSION_REJECTED.inc(command_class=command_class, reason=reason)
+        return Rejected(command_class, reason, retry_after)
+
+    @asynccontextmanager
+    async def admit(self, command_class: str, user_id: Optional[int]):
+        """Hold admission for the body of the block; raises ``Rejected`` when shedding"""
+        retry_after, taken = await self._take_tokens(command_class, user_id)
+        if retry_after:
+            raise self._reject(command_class, 'rate', retry_after)
+        if command_class not in self.heavy_classes:
+            self.admitted += 1
+            yield
+            return
+
+        self.heavy_waiting += 1
+        try:
+            await asyncio.wait_for(self._heavy.acquire(), self.heavy_wait)
+        except asyncio.TimeoutError:
+            # Shedding for lack of capacity is not the user's fault: give the quota back
+            await self._refund(taken)
+            # Roughly when the jobs ahead of this one (and this one) would have finished
+            retry_after = self._job_seconds * self.heavy_waiting / self.heavy_concurrency
+            raise self._reject(command_class, 'busy', retry_after)
+        finally:
+            self.heavy_waiting -= 1
+        self.admitted += 1
+        self.heavy_in_flight += 1
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.heavy_in_flight -= 1
+            self._heavy.release()
+            self._job_seconds = 0.8 * self._job_seconds + 0.2 * (time.monotonic() - start)
+
+    def should_notify(self, user_id: Optional[int], rejection: Rejected) -> bool:
+        """True for the first rejection of a user's class until its retry time has passed"""
+        key = (user_id, rejection.command_class, rejection.reason)
+        if self._notified.get(key) is not None:
+            return False
+        self._notified.set(key, True, size=1, ttl=rejection.retry_after)
+        return True
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'admitted': self.admitted,
+            'rate_limited': self.rate_limited,
+            'busy': self.busy,
+            'heavy_in_flight': self.heavy_in_flight,
+            'heavy_waiting': self.heavy_waiting,
+            'heavy_job_seconds': self._job_seconds
+        }
+
+def admission_controlled(command_class: str):
+    """Run a ``TelegramBot`` handler only if ``self.admission`` admits it.
+
+    Shed requests are answered through ``self.reject`` so the user knows
+    when to try again (once per wait, however often they retry); with
+    admission control disabled the handler runs as is.
+    """
+    def decorate(handler):
+        @functools.wraps(handler)
+        async def wrapper(self, update, *args, **kwargs):
+            controller = self.admission
+            if controller is None:
+                return await handler(self, update, *args, **kwargs)
+            user = update.effective_user
+            try:
+                async with controller.admit(command_class, user.id if user else None):
+                    return await handler(self, update, *args, **kwargs)
+            except Rejected as rejection:
+                user_id = user.id if user else None
+                logger.info(f"Shed {command_class} request from {user_id}: {rejection}")
+                # Button presses are always answered, or the button keeps spinning
+                if update.callback_query is not None or controller.should_notify(user_id, rejection):
+                    await self.reject(update, rejection)
+        return wrapper
+    return decorate
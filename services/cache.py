@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries expire after a TTL"""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        # key -> (expires_at, value, size)
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Any) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value, size = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Any, value: Any, size: int = 0, ttl: Optional[float] = None):
+        if size > self.max_bytes:
+            return
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value, size)
+        self.bytes += size
+        while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._data)))
+
+    def pop(self, key: Any):
+        if key in self._data:
+            self._remove(key)
+
+    def _remove(self, key: Any):
+        _, _, size = self._data.pop(key)
+        self.bytes -= size
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution"""
+
+    def __init__(self):
+        self._calls: Dict[Any, asyncio.Task] = {}
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._calls
+
+    def start(self, key: Any, fn: Callable[[], Awaitable[Any]]) -> Tuple[asyncio.Task, bool]:
+        """Return the in-flight task for ``key``, starting ``fn`` if there is none"""
+        task = self._calls.get(key)
+        if task is not None:
+            return task, True
+        task = asyncio.create_task(fn())
+        self._calls[key] = task
+        task.add_done_callback(lambda t: self._done(key, t))
+        return task, False
+
+    async def do(self, key: Any, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Run ``fn`` once for all concurrent callers; returns (result, shared)"""
+        task, shared = self.start(key, fn)
+        # A cancelled caller must not cancel the call for everyone else
+        return await asyncio.shield(task), shared
+
+    def _done(self, key: Any, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every caller went away
+            task.exception()
+
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace and case so trivially different prompts share a key"""
+    return _WHITESPACE.sub(' ', prompt).strip().casefold()
+
+class ResponseCache:
+    """Two-tier cache for Gemini text completions.
+
+    The first tier is an in-process ``TTLCache``; the optional second tier
+    lives in the database so every worker process shares hits.
+    """
+
+    def __init__(self, db_ops=None, shared: Optional[bool] = None):
+        self.local = TTLCache(
+            max_entries=Config.RESPONSE_CACHE_MAX_ENTRIES,
+            max_bytes=Config.RESPONSE_CACHE_MAX_BYTES,
+            ttl=Config.RESPONSE_CACHE_TTL
+        )
+        self.shared = Config.RESPONSE_CACHE_SHARED if shared is None else shared
+        self.db_ops = db_ops if self.shared else None
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    @staticmethod
+    def make_key(prompt: str, model: str, generation_config: Optional[Dict[str, Any]] = None) -> str:
+        payload = json.dumps(
+            [normalize_prompt(prompt), model, generation_config or {}],
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        response = self.local.get(key)
+        if response is None and self.db_ops is not None:
+            response = await self.db_ops.get_cached_response(key)
+            if response is not None:
+                self.shared_hits += 1
+                self.local.set(key, response, size=len(response.encode()))
+        if response is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.bytes_saved += len(response.encode())
+        return response
+
+    async def set(self, key: str, response: str):
+        self.local.set(key, response, size=len(response.encode()))
+        if self.db_ops is not None:
+            await self.db_ops.save_cached_response(key, response, Config.RESPONSE_CACHE_TTL)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'bytes_saved': self.bytes_saved,
+            'entries': len(self.local),
+            'bytes': self.local.bytes
+        }
@@ -0,0 +1,193 @@
+"""Process-wide services, each built once on first use."""
+import functools
+import logging
+import time
+from functools import cached_property
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+def service(build):
+    """``cached_property`` that records how long the service took to build.
+
+    Build times exclude dependencies built along the way, so each entry in
+    the startup report is what that service itself cost.
+    """
+    name = build.__name__
+
+    @functools.wraps(build)
+    def timed_build(self):
+        self._building.append(0.0)
+        start = time.perf_counter()
+        try:
+            instance = build(self)
+        finally:
+            elapsed = time.perf_counter() - start
+            dependencies = self._building.pop()
+            if self._building:
+                self._building[-1] += elapsed
+        self.timings[name] = elapsed - dependencies
+        logger.debug(f"Built {name} in {(elapsed - dependencies) * 1000:.1f} ms")
+        return instance
+    return cached_property(timed_build)
+
+class ServiceContainer:
+    """Builds every client and service once per process, lazily.
+
+    Nothing is constructed, and no heavy SDK is imported, until something
+    asks for it, so importing the bot is cheap and a worker only pays for
+    the services its traffic uses. Shared dependencies (the database
+    driver, the HTTP client, the Gemini service) have exactly one instance.
+    """
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self._building: List[float] = []
+
+    def built(self, name: str) -> bool:
+        return name in self.__dict__
+
+    @service
+    def db_ops(self):
+        from database.db_operations import DatabaseOperations
+        from services.metrics import registry
+
+        db_ops = DatabaseOperations()
+        if db_ops.write_buffer is not None:
+            registry.register_stats('write_buffer', db_ops.write_buffer.stats)
+        return db_ops
+
+    @service
+    def http_client(self):
+        from services.http_client import HttpClient
+
+        return HttpClient()
+
+    @service
+    def response_cache(self):
+        from services.cache import ResponseCache
+        from services.metrics import registry
+
+        cache = ResponseCache(self.db_ops)
+        registry.register_stats('response_cache', cache.stats)
+        return cache
+
+    @service
+    def gemini_service(self):
+        from services.gemini_service import GeminiService
+        from services.metrics import registry
+
+        gemini = GeminiService(cache=self.response_cache)
+        registry.register_stats('gemini_scheduler', lambda: {
+            'queue_depth': gemini.scheduler.queue_depth,
+            'in_flight': gemini.scheduler.in_flight
+        })
+        return gemini
+
+    @service
+    def web_search_service(self):
+        from services.metrics import registry
+        from services.web_search import WebSearchService
+
+        search = WebSearchService(self.http_client, self.gemini_service)
+        registry.register_stats('search', search.stats)
+        return search
+
+    @service
+    def file_handler(self):
+        from services.file_handler import FileHandler
+
+        return FileHandler(self.gemini_service)
+
+    @service
+    def downloader(self):
+        from services.downloads import Downloader
+
+        return Downloader()
+
+    @service
+    def conversation_memory(self):
+        from services.conversation_memory import ConversationMemory
+
+        return ConversationMemory(self.db_ops, self.gemini_service)
+
+    @service
+    def outbound(self):
+        from services.metrics import registry
+        from services.outbound import OutboundSender
+
+        sender = OutboundSender()
+        registry.register_stats('outbound', sender.stats)
+        return sender
+
+    @service
+    def voice_transcriber(self):
+        from services.voice import VoiceTranscriber
+
+        return VoiceTranscriber()
+
+    @service
+    def quiz_bank(self):
+        from services.quiz_bank import QuizBank
+
+        return QuizBank(self.db_ops, self.http_client, self.gemini_service)
+
+    @service
+    def session_store(self):
+        from services.sessions import create_session_store
+
+        return create_session_store(self.db_ops.driver)
+
+    @service
+    def admission(self):
+        from services.admission import AdmissionController, create_limit_store
+        from services.metrics import registry
+
+        controller = AdmissionController(create_limit_store(self.db_ops.driver))
+        registry.register_stats('admission', controller.stats)
+        return controller
+
+    @service
+    def metrics_server(self):
+        from services.metrics import MetricsServer
+
+        return MetricsServer()
+
+    @service
+    def loop_watchdog(self):
+        from services.watchdog import LoopWatchdog
+
+        return LoopWatchdog()
+
+    async def close(self):
+        """Release whatever was built, flushing buffered writes first"""
+        if self.built('metrics_server'):
+            await self.metrics_server.close()
+        if self.built('loop_watchdog'):
+            await self.loop_watchdog.stop()
+        if self.built('db_ops'):
+            await self.db_ops.flush()
+        if self.built('http_client'):
+            await self.http_client.aclose()
+        if self.built('file_handler'):
+            self.file_handler.close()
+        if self.built('voice_transcriber'):
+            self.voice_transcriber.close()
+        if self.built('db_ops'):
+            self.db_ops.close()
+
+    def report(self, imported_in: Optional[float] = None) -> str:
+        """Startup timings: module imports, each service built so far, peak memory"""
+        lines = ["Startup timings:"]
+        if imported_in is not None:
+            lines.append(f"  {'imports':<22}{imported_in * 1000:8.1f} ms")
+        for name, seconds in self.timings.items():
+            lines.append(f"  {name:<22}{seconds * 1000:8.1f} ms")
+        try:
+            import resource
+        except ImportError:  # not available on Windows
+            return '\n'.join(lines)
+        # ru_maxrss is in kilobytes on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        lines.append(f"  {'peak RSS':<22}{peak:8.1f} MB")
+        return '\n'.join(lines)
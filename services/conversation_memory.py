@@ -0,0 +1,159 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Deque, Optional
+from config.config import Config
+from services.gemini_service import GeminiService, is_error_response
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and an assistant.
+Keep facts, names, preferences and open questions the assistant may need later.
+Reply with the updated summary only, in at most {max_words} words.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}"""
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+@dataclass
+class Turn:
+    message: str
+    response: str
+    timestamp: datetime
+    tokens: int = 0
+
+    def __post_init__(self):
+        self.tokens = estimate_tokens(self.message) + estimate_tokens(self.response)
+
+@dataclass
+class ConversationWindow:
+    summary: str = ""
+    summary_until: Optional[datetime] = None
+    turns: Deque[Turn] = field(default_factory=deque)
+    tokens: int = 0
+    folding: bool = False
+
+    def append(self, turn: Turn):
+        self.turns.append(turn)
+        self.tokens += turn.tokens
+
+    def popleft(self) -> Turn:
+        turn = self.turns.popleft()
+        self.tokens -= turn.tokens
+        return turn
+
+class ConversationMemory:
+    """Per-user rolling conversation context under a token budget.
+
+    Recent turns are kept verbatim in an in-process LRU of windows, loaded
+    from ``chat_history`` only when a user's window is cold. When a window
+    exceeds the budget, its oldest turns are folded into a running summary
+    in the background, so each message costs one summary plus a bounded
+    number of turns no matter how long the conversation gets.
+    """
+
+    def __init__(self, db_ops, gemini: GeminiService):
+        self.db_ops = db_ops
+        self.gemini = gemini
+        self.max_users = Config.MEMORY_MAX_USERS
+        self.token_budget = Config.MEMORY_TOKEN_BUDGET
+        self._windows: "OrderedDict[int, ConversationWindow]" = OrderedDict()
+        self._tasks = set()
+
+    async def _window(self, user_id: int) -> ConversationWindow:
+        window = self._windows.get(user_id)
+        if window is not None:
+            self._windows.move_to_end(user_id)
+            return window
+
+        # Cold window: rebuild it from the stored summary and recent history
+        window = ConversationWindow()
+        window.summary, window.summary_until = await self.db_ops.get_conversation_summary(user_id)
+        history = await self.db_ops.get_chat_history(
+            user_id, limit=Config.MEMORY_HISTORY_LIMIT, since=window.summary_until
+        )
+        for entry in reversed(history):
+            window.append(Turn(entry['message'], entry['response'], entry['timestamp']))
+        # Anything beyond the budget that was never summarized is dropped
+        while window.tokens > self.token_budget and len(window.turns) > 1:
+            window.popleft()
+
+        # Another coroutine may have loaded the window meanwhile
+        window = self._windows.setdefault(user_id, window)
+        while len(self._windows) > self.max_users:
+            self._windows.popitem(last=False)
+        return window
+
+    async def build_prompt(self, user_id: int, message: str) -> str:
+        """Wrap ``message`` with the user's conversation context"""
+        window = await self._window(user_id)
+        if not window.summary and not window.turns:
+            return message
+
+        sections = []
+        if window.summary:
+            sections.append(f"Summary of the earlier conversation:\n{window.summary}")
+        if window.turns:
+            recent = "\n".join(f"User: {t.message}\nAssistant: {t.response}" for t in window.turns)
+            sections.append(f"Recent conversation:\n{recent}")
+        sections.append(f"User: {message}\nAssistant:")
+        return "\n\n".join(sections)
+
+    def record(self, user_id: int, message: str, response: str, timestamp: datetime):
+        """Add a finished turn to a warm window and fold it if over budget.
+
+        ``timestamp`` must match the one stored in ``chat_history`` so that
+        cold reloads know which turns the summary already covers.
+        """
+        window = self._windows.get(user_id)
+        if window is None:
+            # Cold windows are rebuilt from chat_history on the next message
+            return
+        window.append(Turn(message, response, timestamp))
+        if window.tokens > self.token_budget and not window.folding:
+            window.folding = True
+            task = asyncio.create_task(self._fold(user_id, window))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _fold(self, user_id: int, window: ConversationWindow):
+        """Fold the oldest turns into the running summary"""
+        try:
+            # Fold down to half the budget so this does not run on every message
+            folded, tokens = [], window.tokens
+            for turn in window.turns:
+                if tokens <= self.token_budget // 2 or len(folded) == len(window.turns) - 1:
+                    break
+                folded.append(turn)
+                tokens -= turn.tokens
+            if not folded:
+                return
+
+            prompt = SUMMARY_PROMPT.format(
+                max_words=Config.MEMORY_SUMMARY_WORDS,
+                summary=window.summary or "(none)",
+                turns="\n".join(f"User: {t.message}\nAssistant: {t.response}" for t in folded)
+            )
+            summary = await self.gemini.get_chat_response(prompt, user_id, use_cache=False)
+            # The folded turns leave the window either way, so prompts stay within budget
+            for _ in folded:
+                window.popleft()
+            if is_error_response(summary):
+                logger.warning(f"Could not summarize conversation for user {user_id}; dropped {len(folded)} turns")
+                return
+
+            window.summary = summary.strip()
+            window.summary_until = folded[-1].timestamp
+            await self.db_ops.save_conversation_summary(user_id, window.summary, window.summary_until)
+        except Exception as e:
+            logger.error(f"Error folding conversation for user {user_id}: {e}")
+        finally:
+            window.folding = False
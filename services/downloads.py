@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from typing import Optional, Union
+from config.config import Config
+from services.metrics import DOWNLOAD_BYTES, track_call
+
+logger = logging.getLogger(__name__)
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when a download cannot be buffered within the memory budget"""
+
+class MemoryBudget:
+    """Caps the number of bytes held in memory by in-flight downloads.
+
+    Reservations that do not fit wait for others to finish; if they still do
+    not fit after ``timeout`` seconds (or can never fit) they are rejected.
+    """
+
+    def __init__(self, limit: int, timeout: float):
+        self.limit = limit
+        self.timeout = timeout
+        self.in_use = 0
+        self._released = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, size: int):
+        if size > self.limit:
+            raise MemoryBudgetExceeded(f"{size} bytes exceeds the download memory limit")
+        async with self._released:
+            try:
+                await asyncio.wait_for(
+                    self._released.wait_for(lambda: self.in_use + size <= self.limit),
+                    self.timeout
+                )
+            except asyncio.TimeoutError:
+                raise MemoryBudgetExceeded("Too many downloads in progress") from None
+            self.in_use += size
+        try:
+            yield
+        finally:
+            async with self._released:
+                self.in_use -= size
+                self._released.notify_all()
+
+class DownloadedFile:
+    """A downloaded Telegram file, held in memory or spilled to a temp file.
+
+    ``source`` is what gets handed to consumers: the shared ``bytearray`` for
+    in-memory files (never copied) or the temp file path for spilled ones.
+    """
+
+    def __init__(self, data: Optional[bytearray] = None, path: Optional[str] = None):
+        self.data = data
+        self.path = path
+
+    @property
+    def source(self) -> Union[bytearray, str]:
+        return self.data if self.data is not None else self.path
+
+    @property
+    def size(self) -> int:
+        if self.data is not None:
+            return len(self.data)
+        return os.path.getsize(self.path)
+
+    def sha256(self) -> str:
+        if self.data is not None:
+            return hashlib.sha256(self.data).hexdigest()
+        with open(self.path, 'rb') as f:
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+
+    def close(self):
+        """Drop the buffer or delete the temp file"""
+        self.data = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+            self.path = None
+
+class Downloader:
+    """Downloads Telegram files into memory within a shared memory budget"""
+
+    def __init__(self):
+        self.budget = MemoryBudget(Config.DOWNLOAD_MEMORY_LIMIT, Config.DOWNLOAD_QUEUE_TIMEOUT)
+        self.spill_threshold = Config.DOWNLOAD_SPILL_THRESHOLD
+        os.makedirs("downloads", exist_ok=True)
+
+    @asynccontextmanager
+    async def download(self, bot, file_id: str, file_size: Optional[int] = None, suffix: str = ''):
+        """Download a file and yield a ``DownloadedFile`` that is released on exit.
+
+        Files above the spill threshold go to a uniquely named temp file so
+        concurrent uploads never clobber each other.
+        """
+        with track_call('telegram', 'get_file'):
+            file = await bot.get_file(file_id)
+        size = file_size or file.file_size or self.spill_threshold
+        if size > self.spill_threshold:
+            fd, path = tempfile.mkstemp(dir="downloads", suffix=suffix)
+            os.close(fd)
+            downloaded = DownloadedFile(path=path)
+            try:
+                with track_call('telegram', 'download_to_drive'):
+                    await file.download_to_drive(path)
+                DOWNLOAD_BYTES.inc(downloaded.size, target='disk')
+                yield downloaded
+            finally:
+                await asyncio.to_thread(downloaded.close)
+            return
+
+        async with self.budget.reserve(size):
+            with track_call('telegram', 'download'):
+                data = await file.download_as_bytearray()
+            downloaded = DownloadedFile(data=data)
+            DOWNLOAD_BYTES.inc(downloaded.size, target='memory')
+            try:
+                yield downloaded
+            finally:
+                downloaded.close()
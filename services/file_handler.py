@@ -1,92 +1,248 @@
+import asyncio
+import multiprocessing
 import os
-import fitz  # PyMuPDF for PDF handling
 import logging
-from PIL import Image
-from io import BytesIO
-from services.gemini_service import GeminiService
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, List, Optional, Union
+from services.gemini_service import GeminiService, is_error_response
+from services.metrics import track_call
 from config.config import Config
 
+if TYPE_CHECKING:
+    import fitz
+
 logger = logging.getLogger(__name__)
 
+# Bump when the PDF prompt or the stored analysis format changes so cached
+# analyses are not reused (2: raw markdown, rendered at send time)
+PDF_PROMPT_VERSION = f"2-{Config.PDF_SUMMARY_MODE}"
+
+PDF_ANALYSIS_PROMPT = """Analyze this PDF content and provide:
+            1. Main topic or subject
+            2. Key points and information
+            3. Important details
+            4. Structure and organization
+            5. Summary of content
+
+            Content: {content}"""
+
+PDF_CHUNK_PROMPT = """Summarize this section of a PDF document, keeping key points,
+            important details and any headings:
+
+            {content}"""
+
+PdfSource = Union[str, bytes, bytearray]
+
+def open_pdf(source: PdfSource) -> "fitz.Document":
+    """Open a PDF from a path or straight from an in-memory buffer"""
+    import fitz  # PyMuPDF, imported on first use (also in each pool worker)
+
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+def extract_pdf_text(source: PdfSource, start: int = 0, stop: Optional[int] = None, budget: int = 0) -> str:
+    """Extract text from pages ``[start, stop)``.
+
+    Pages are read lazily and extraction stops once ``budget`` characters
+    have been collected (0 means no limit). Runs in worker threads and
+    processes, so it only takes picklable arguments.
+    """
+    parts = []
+    collected = 0
+    with open_pdf(source) as pdf:
+        stop = pdf.page_count if stop is None else min(stop, pdf.page_count)
+        for number in range(start, stop):
+            text = pdf.load_page(number).get_text()
+            parts.append(text)
+            collected += len(text)
+            if budget and collected >= budget:
+                break
+    text = "".join(parts)
+    return text[:budget] if budget else text
+
+def pdf_page_count(source: PdfSource) -> int:
+    with open_pdf(source) as pdf:
+        return pdf.page_count
+
+def spill_pdf(data: Union[bytes, bytearray]) -> str:
+    """Write an in-memory PDF to a temporary file and return its path"""
+    fd, path = tempfile.mkstemp(suffix='.pdf')
+    with os.fdopen(fd, 'wb') as pdf_file:
+        pdf_file.write(data)
+    return path
+
+def chunk_text(text: str, size: int) -> List[str]:
+    """Split text into chunks of at most ``size`` characters, preferring paragraph breaks"""
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            boundary = text.rfind("\n\n", start + size // 2, end)
+            if boundary != -1:
+                end = boundary + 2
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        start = end
+    return chunks
+
 class FileHandler:
-    def __init__(self):
-        self.gemini = GeminiService()
+    def __init__(self, gemini: Optional[GeminiService] = None):
+        self.gemini = gemini or GeminiService()
+        self._process_pool: Optional[ProcessPoolExecutor] = None
         self.supported_images = {'.jpg', '.jpeg', '.png', '.bmp'}
         self.supported_docs = {'.pdf', '.txt'}
         # Create downloads directory if it doesn't exist
         os.makedirs("downloads", exist_ok=True)
 
-    async def process_file(self, file_path: str, file_type: str) -> str:
+    async def process_file(self, file_path: str, file_type: str, user_id: Optional[int] = None) -> str:
         """Process different types of files and return analysis"""
         try:
             file_ext = os.path.splitext(file_path)[1].lower()
             
             if file_ext in self.supported_images:
-                return await self._process_image(file_path)
+                return await self._process_image(file_path, user_id)
             elif file_ext == '.pdf':
-                return await self.process_pdf(file_path)
+                try:
+                    return await self.process_pdf(file_path, user_id)
+                finally:
+                    self.cleanup(file_path)
             elif file_ext == '.txt':
-                return await self._process_text(file_path)
+                return await self._process_text(file_path, user_id)
             else:
                 raise ValueError(f"Unsupported file type: {file_ext}")
         except Exception as e:
             logger.error(f"Error processing file: {e}")
             raise
 
-    async def _process_image(self, file_path: str) -> str:
+    async def _process_image(self, file_path: str, user_id: Optional[int] = None) -> str:
         """Process image files"""
         try:
             with open(file_path, 'rb') as image_file:
                 image_data = image_file.read()
-            return await self.gemini.analyze_image(image_data)
+            return await self.gemini.analyze_image(image_data, user_id)
         except Exception as e:
             logger.error(f"Error processing image: {e}")
             raise
 
-    async def process_pdf(self, file_path: str) -> str:
-        """Process PDF files"""
-        try:
-            # Extract text from PDF
-            text_content = ""
-            with fitz.open(file_path) as pdf:
-                for page in pdf:
-                    text_content += page.get_text()
-
-            # Prepare prompt for better PDF analysis
-            prompt = f"""Analyze this PDF content and provide:
-            1. Main topic or subject
-            2. Key points and information
-            3. Important details
-            4. Structure and organization
-            5. Summary of content
+    async def process_pdf(self, source: PdfSource, user_id: Optional[int] = None,
+                          mode: Optional[str] = None) -> str:
+        """Process PDF files from a path or an in-memory buffer.
 
-            Content: {text_content[:4000]}"""  # Limit content length
+        The caller owns ``source`` and is responsible for releasing it. In
+        ``truncate`` mode pages are read lazily until the prompt budget is
+        filled. In ``map_reduce`` mode the whole document is chunked, the
+        chunks are summarized concurrently and the summaries are analyzed.
+        """
+        try:
+            prompt = await self.prepare_pdf_prompt(source, user_id, mode)
 
             # Get analysis from Gemini
-            analysis = await self.gemini.get_chat_response(prompt)
+            # Whole documents are cached by content hash, not by prompt
+            analysis = await self.gemini.get_chat_response(prompt, user_id, use_cache=False)
             return analysis
 
         except Exception as e:
             logger.error(f"Error processing PDF: {e}")
             raise
+
+    async def prepare_pdf_prompt(self, source: PdfSource, user_id: Optional[int] = None,
+                                 mode: Optional[str] = None) -> str:
+        """Build the analysis prompt for a PDF, e.g. to stream the response"""
+        mode = mode or Config.PDF_SUMMARY_MODE
+        with track_call('pdf', mode):
+            if mode == 'map_reduce':
+                content = await self._map_reduce_pdf(source, user_id)
+            else:
+                # Stop reading pages as soon as the prompt budget is filled
+                content = await asyncio.to_thread(
+                    extract_pdf_text, source, 0, None, Config.PDF_CHAR_BUDGET
+                )
+        return PDF_ANALYSIS_PROMPT.format(content=content)
+
+    async def _map_reduce_pdf(self, source: PdfSource, user_id: Optional[int] = None) -> str:
+        """Summarize every chunk of a PDF and return the joined summaries"""
+        loop = asyncio.get_running_loop()
+        page_count = await asyncio.to_thread(pdf_page_count, source)
+
+        # Large documents are split into page ranges parsed in parallel
+        # processes. Workers get a path: pickling an in-memory buffer to each
+        # of them would copy the whole document once per page range.
+        executor, workers, spilled = None, 1, None
+        if page_count >= Config.PDF_PROCESS_POOL_MIN_PAGES:
+            executor, workers = self._get_process_pool(), Config.PDF_PROCESS_WORKERS
+            if not isinstance(source, str):
+                source = spilled = await asyncio.to_thread(spill_pdf, source)
+        step = max(1, -(-page_count // workers))
+        extractions = [
+            loop.run_in_executor(executor, extract_pdf_text, source, start, start + step)
+            for start in range(0, page_count, step)
+        ]
+
+        chunks: List[str] = []
+        summaries: List[asyncio.Task] = []
+        try:
+            try:
+                for extraction in extractions:
+                    text = await extraction
+                    for chunk in chunk_text(text, Config.PDF_CHUNK_CHARS):
+                        if len(chunks) == Config.PDF_MAX_CHUNKS:
+                            break
+                        chunks.append(chunk)
+                        # Summaries start while later page ranges are still being parsed
+                        summaries.append(asyncio.create_task(self.gemini.get_chat_response(
+                            PDF_CHUNK_PROMPT.format(content=chunk), user_id, use_cache=False
+                        )))
+                    if len(chunks) == Config.PDF_MAX_CHUNKS:
+                        logger.info(f"PDF truncated to {Config.PDF_MAX_CHUNKS} chunks")
+                        break
+            finally:
+                for extraction in extractions:
+                    extraction.cancel()
+
+            if len(chunks) <= 1:
+                return chunks[0] if chunks else ""
+            results = await asyncio.gather(*summaries)
         finally:
-            # Cleanup temporary file
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            # Summaries whose results will never be used (a failed extraction,
+            # a failed sibling, a single chunk) must not keep spending quota
+            for task in summaries:
+                task.cancel()
+            if spilled is not None:
+                self.cleanup(spilled)
+        return "\n\n".join(r for r in results if not is_error_response(r))
 
-    async def _process_text(self, file_path: str) -> str:
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        if self._process_pool is None:
+            # Forking a process that runs driver and to_thread threads can copy a
+            # lock some thread holds into the child, so workers start fresh
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=Config.PDF_PROCESS_WORKERS, mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._process_pool
+
+    async def _process_text(self, file_path: str, user_id: Optional[int] = None) -> str:
         """Process text files"""
         try:
             with open(file_path, 'r') as text_file:
                 text_content = text_file.read()
             # Prepare prompt for text analysis
             prompt = f"Analyze this text content:\n{text_content[:4000]}"  # Limit content length
-            analysis = await self.gemini.get_chat_response(prompt)
+            analysis = await self.gemini.get_chat_response(prompt, user_id, use_cache=False)
             return analysis
         except Exception as e:
             logger.error(f"Error processing text: {e}")
             raise
 
+    def close(self):
+        """Shut down the PDF extraction process pool"""
+        if self._process_pool is not None:
+            self._process_pool.shutdown(cancel_futures=True)
+            self._process_pool = None
+
     def cleanup(self, file_path: str):
         """Clean up temporary files"""
         try:
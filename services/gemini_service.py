@@ -1,27 +1,29 @@
-import google.generativeai as genai
+import asyncio
 import logging
-from PIL import Image
-import io
+from typing import AsyncIterator, Optional
 from config.config import Config
+from services.scheduler import FairScheduler
+from services.cache import ResponseCache
+from services.image_preprocessor import preprocess_image, detect_mime_type
+from services.metrics import track_call
 
 logger = logging.getLogger(__name__)
 
-class GeminiService:
-    def __init__(self):
-        try:
-            genai.configure(api_key=Config.GEMINI_API_KEY)
-            self.chat_model = genai.GenerativeModel('gemini-pro')
-            self.vision_model = genai.GenerativeModel('gemini-1.5-flash')
-            logger.info("Gemini service initialized successfully")
-        except Exception as e:
-            logger.error(f"Failed to initialize Gemini service: {e}")
-            raise
+CHAT_MODEL = 'gemini-pro'
+FLASH_MODEL = 'gemini-1.5-flash'
+VISION_MODEL = FLASH_MODEL
 
-    async def analyze_image(self, image_data: bytes) -> str:
-        try:
-            image = Image.open(io.BytesIO(image_data))
-            
-            prompt = """Analyze this image in detail and provide:
+# Bump when the image prompt or the stored analysis format changes so cached
+# analyses are not reused (2: raw markdown, rendered at send time)
+IMAGE_PROMPT_VERSION = '2'
+
+_FALLBACK_PREFIXES = (
+    "Error analyzing image:",
+    "Error processing message:",
+    "Sorry, I couldn't"
+)
+
+IMAGE_ANALYSIS_PROMPT = """Analyze this image in detail and provide:
             1. Main subject or focus
             2. Key objects and elements
             3. Colors and visual composition
@@ -29,24 +31,123 @@ class GeminiService:
             5. Context or setting
             6. Notable details or unique features
             7. Overall mood or atmosphere
-            
+
             Please be specific and descriptive."""
-            
-            response = self.vision_model.generate_content([prompt, image])
+
+_genai = None
+
+def load_genai():
+    """Import and configure the Gemini SDK once per process.
+
+    The SDK is slow to import, so it is only loaded when the first
+    ``GeminiService`` is built rather than when this module is imported.
+    """
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+
+        genai.configure(api_key=Config.GEMINI_API_KEY)
+        _genai = genai
+    return _genai
+
+def is_error_response(text: str) -> bool:
+    """Tell apart the fallback messages returned on failure from real output"""
+    return text.startswith(_FALLBACK_PREFIXES)
+
+class GeminiService:
+    def __init__(self, cache: Optional[ResponseCache] = None):
+        try:
+            self.cache = cache
+            genai = load_genai()
+            self.chat_model = genai.GenerativeModel(CHAT_MODEL)
+            self.vision_model = genai.GenerativeModel(VISION_MODEL)
+            # Bounds in-flight Gemini calls globally and per model, queueing
+            # the rest fairly per user
+            self.scheduler = FairScheduler(
+                global_limit=Config.GEMINI_MAX_CONCURRENCY,
+                per_model_limit=Config.GEMINI_MODEL_MAX_CONCURRENCY
+            )
+            logger.info("Gemini service initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize Gemini service: {e}")
+            raise
+
+    async def _prepare_image(self, image_data: bytes) -> dict:
+        # Decoding and resizing are CPU-bound, so keep them off the event loop
+        if Config.IMAGE_PREPROCESS:
+            data, mime_type = await asyncio.to_thread(preprocess_image, image_data)
+        else:
+            data = bytes(image_data)
+            mime_type = await asyncio.to_thread(detect_mime_type, data)
+        return {'mime_type': mime_type, 'data': data}
+
+    async def analyze_image(self, image_data: bytes, user_id: Optional[int] = None) -> str:
+        try:
+            image = await self._prepare_image(image_data)
+
+            async with self.scheduler.slot(VISION_MODEL, user_id):
+                with track_call('gemini', VISION_MODEL):
+                    response = await self.vision_model.generate_content_async([IMAGE_ANALYSIS_PROMPT, image])
             if response.parts:  # Check if response has parts
                 return response.text
             return "Sorry, I couldn't analyze this image properly."
-            
+
         except Exception as e:
             logger.error(f"Error analyzing image: {e}")
             return f"Error analyzing image: {str(e)}"
 
-    async def get_chat_response(self, message: str) -> str:
+    async def get_chat_response(self, message: str, user_id: Optional[int] = None, use_cache: bool = True) -> str:
+        """Answer ``message``; one-off prompts pass ``use_cache=False`` to keep them out of the cache"""
         try:
-            response = self.chat_model.generate_content(message)
+            cache_key = None
+            if use_cache and self.cache is not None:
+                cache_key = self.cache.make_key(message, CHAT_MODEL)
+                cached = await self.cache.get(cache_key)
+                if cached is not None:
+                    return cached
+
+            async with self.scheduler.slot(CHAT_MODEL, user_id):
+                with track_call('gemini', CHAT_MODEL):
+                    response = await self.chat_model.generate_content_async(message)
             if response.parts:  # Check if response has parts
+                if cache_key is not None:
+                    await self.cache.set(cache_key, response.text)
                 return response.text
             return "Sorry, I couldn't process your message properly."
         except Exception as e:
             logger.error(f"Error getting chat response: {e}")
             return f"Error processing message: {str(e)}"
+
+    async def stream_image_analysis(self, image_data: bytes, user_id: Optional[int] = None) -> AsyncIterator[str]:
+        """Yield the image analysis as it is generated. Errors are raised."""
+        image = await self._prepare_image(image_data)
+        async with self.scheduler.slot(VISION_MODEL, user_id):
+            with track_call('gemini', f"{VISION_MODEL}:stream"):
+                response = await self.vision_model.generate_content_async(
+                    [IMAGE_ANALYSIS_PROMPT, image], stream=True
+                )
+                async for chunk in response:
+                    if chunk.parts:
+                        yield chunk.text
+
+    async def stream_chat_response(self, message: str, user_id: Optional[int] = None,
+                                   use_cache: bool = True) -> AsyncIterator[str]:
+        """Yield the chat response as it is generated. Errors are raised."""
+        cache_key = None
+        if use_cache and self.cache is not None:
+            cache_key = self.cache.make_key(message, CHAT_MODEL)
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        parts = []
+        async with self.scheduler.slot(CHAT_MODEL, user_id):
+            with track_call('gemini', f"{CHAT_MODEL}:stream"):
+                response = await self.chat_model.generate_content_async(message, stream=True)
+                async for chunk in response:
+                    if chunk.parts:
+                        parts.append(chunk.text)
+                        yield chunk.text
+        if parts and cache_key is not None:
+            await self.cache.set(cache_key, "".join(parts))
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Optional
+import httpx
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+class HttpClient:
+    """Application-scoped async HTTP client shared by every service.
+
+    Wraps a single ``httpx.AsyncClient`` so connections to Gemini and SerpApi
+    are pooled and kept alive across requests instead of paying a TCP+TLS
+    handshake per message.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        http2 = Config.HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("h2 is not installed; falling back to HTTP/1.1")
+                http2 = False
+
+        limits = httpx.Limits(
+            max_connections=Config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY
+        )
+        self._client = httpx.AsyncClient(
+            http2=http2,
+            limits=limits,
+            timeout=httpx.Timeout(Config.HTTP_TIMEOUT, connect=Config.HTTP_CONNECT_TIMEOUT),
+            transport=transport
+        )
+        self._host_slots = defaultdict(
+            lambda: asyncio.Semaphore(Config.HTTP_MAX_CONNECTIONS_PER_HOST)
+        )
+        self.retries = Config.HTTP_RETRIES
+        self.backoff = Config.HTTP_RETRY_BACKOFF
+        logger.info(f"HTTP client initialized (http2={http2})")
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff * (2 ** attempt)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request, retrying transient failures with exponential backoff"""
+        host = httpx.URL(url).host
+        async with self._host_slots[host]:
+            for attempt in range(self.retries + 1):
+                try:
+                    response = await self._client.request(method, url, **kwargs)
+                except httpx.TransportError as e:
+                    if attempt == self.retries:
+                        raise
+                    delay = self._retry_delay(attempt)
+                    logger.warning(f"{method} {host} failed ({e!r}); retrying in {delay:.1f}s")
+                else:
+                    if response.status_code not in self.RETRY_STATUSES or attempt == self.retries:
+                        return response
+                    delay = self._retry_delay(attempt, response)
+                    logger.warning(f"{method} {host} returned {response.status_code}; retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request('POST', url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs):
+        """Stream a response body. Streams are not retried."""
+        host = httpx.URL(url).host
+        async with self._host_slots[host]:
+            async with self._client.stream(method, url, **kwargs) as response:
+                yield response
+
+    async def aclose(self):
+        """Close all pooled connections"""
+        await self._client.aclose()
+        logger.info("HTTP client closed")
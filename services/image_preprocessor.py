@@ -0,0 +1,51 @@
+import io
+import logging
+from typing import Sequence, Tuple
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+
+def preprocess_image(data: bytes, max_edge: int = None, fmt: str = None,
+                     quality: int = None) -> Tuple[bytes, str]:
+    """Downsize and recompress an image before it is sent to the vision model.
+
+    Applies the EXIF orientation, shrinks the longest edge to ``max_edge``
+    and re-encodes without metadata. Returns the encoded bytes and their MIME
+    type. This is CPU-bound and meant to run in a worker thread.
+    """
+    max_edge = max_edge or Config.IMAGE_MAX_EDGE
+    fmt = (fmt or Config.IMAGE_FORMAT).upper()
+    quality = quality or Config.IMAGE_QUALITY
+
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if fmt == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        out = io.BytesIO()
+        # No exif/icc data is passed to save(), so metadata is stripped
+        image.save(out, format=fmt, quality=quality, optimize=True)
+    return out.getvalue(), MIME_TYPES.get(fmt, f"image/{fmt.lower()}")
+
+def detect_mime_type(data: bytes) -> str:
+    """Read the image header to find its MIME type without decoding pixels"""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        return Image.MIME.get(image.format, 'image/jpeg')
+
+def select_photo_size(photos: Sequence, max_edge: int = None):
+    """Pick the smallest Telegram ``PhotoSize`` that still covers ``max_edge``.
+
+    Telegram sends several resolutions of every photo; downloading a variant
+    close to the size we will resize to anyway saves bandwidth and decoding.
+    """
+    max_edge = max_edge or Config.IMAGE_MAX_EDGE
+    for photo in sorted(photos, key=lambda p: p.width * p.height):
+        if max(photo.width, photo.height) >= max_edge:
+            return photo
+    return max(photos, key=lambda p: p.width * p.height)
@@ -0,0 +1,336 @@
+"""In-process metrics with a Prometheus text endpoint."""
+import asyncio
+import bisect
+import functools
+import logging
+import math
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+LabelKey = Tuple[str, ...]
+
+def log_linear_bounds(lowest: float = 0.0005, highest: float = 600.0, steps: int = 4) -> List[float]:
+    """HDR-style bucket bounds: every power of two is split into ``steps`` equal parts.
+
+    Relative error stays under ``1 / steps`` from sub-millisecond cache hits
+    up to multi-minute PDF summaries, with a fixed number of buckets.
+    """
+    bounds: List[float] = []
+    exponent = math.floor(math.log2(lowest))
+    while True:
+        base = 2.0 ** exponent
+        for step in range(steps):
+            bound = base * (1 + step / steps)
+            if bound >= lowest:
+                bounds.append(bound)
+            if bound >= highest:
+                return bounds
+        exponent += 1
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return f"{value:.6g}"
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelKey, Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> LabelKey:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+    def samples(self) -> Iterator[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{self._labels(key)} {_format_value(value)}"
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+class _HistogramValue:
+    __slots__ = ('counts', 'sum', 'count', 'max')
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * buckets
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+class Histogram(_Metric):
+    """Latency distribution over fixed log-linear buckets.
+
+    Recording is a bisect plus three additions, so it is cheap enough for
+    every database call. Buckets are exported cumulatively as Prometheus
+    expects; ``quantile`` answers locally with the bucket's upper bound.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 bounds: Optional[Sequence[float]] = None):
+        super().__init__(name, help, labelnames)
+        self.bounds = list(bounds or log_linear_bounds())
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = _HistogramValue(len(self.bounds) + 1)
+        entry.counts[bisect.bisect_left(self.bounds, value)] += 1
+        entry.sum += value
+        entry.count += 1
+        if value > entry.max:
+            entry.max = value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return entry.count if entry else 0
+
+    def series(self) -> Iterator[Tuple[Dict[str, str], int, float]]:
+        """Yield ``(labels, count, sum)`` for every recorded label set"""
+        for key, entry in list(self._values.items()):
+            yield dict(zip(self.labelnames, key)), entry.count, entry.sum
+
+    def quantile(self, q: float, **labels) -> float:
+        entry = self._values.get(self._key(labels))
+        if not entry or not entry.count:
+            return 0.0
+        rank = q * entry.count
+        seen = 0
+        for index, count in enumerate(entry.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[index], entry.max) if index < len(self.bounds) else entry.max
+        return entry.max
+
+    def samples(self) -> Iterator[str]:
+        for key, entry in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + [math.inf], entry.counts):
+                cumulative += count
+                labels = self._labels(key, (('le', _format_value(bound)),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{self._labels(key)} {_format_value(entry.sum)}"
+            yield f"{self.name}_count{self._labels(key)} {entry.count}"
+
+class MetricsRegistry:
+    """Holds every metric of the process and renders them for Prometheus.
+
+    Components that already keep counters expose them through a ``stats()``
+    callable registered with ``register_stats``; those are read at scrape
+    time rather than mirrored on every event.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._stats: Dict[str, Callable[[], Dict[str, float]]] = {}
+
+    def _get_or_create(self, cls, name: str, help: str, labelnames: Sequence[str], **kwargs) -> Any:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+        elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+            raise ValueError(f"Metric {name} is already registered with a different type or labels")
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  bounds: Optional[Sequence[float]] = None) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, bounds=bounds)
+
+    def register_stats(self, prefix: str, stats: Callable[[], Dict[str, float]]):
+        """Export ``stats()`` values as ``bot_<prefix>_<key>`` on every scrape"""
+        self._stats[prefix] = stats
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for prefix, stats in self._stats.items():
+            try:
+                values = stats()
+            except Exception as e:
+                logger.error(f"Error collecting {prefix} stats: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = f"bot_{prefix}_{key}"
+                    lines.append(f"# TYPE {name} untyped")
+                    lines.append(f"{name} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+UPDATES_IN_FLIGHT = registry.gauge('bot_updates_in_flight', 'Updates currently being handled')
+HANDLER_SECONDS = registry.histogram('bot_handler_seconds', 'Time spent handling an update', ['handler'])
+HANDLER_ERRORS = registry.counter('bot_handler_errors_total', 'Handlers that raised an exception', ['handler'])
+DEPENDENCY_SECONDS = registry.histogram(
+    'bot_dependency_seconds', 'Latency of calls to external services', ['service', 'operation']
+)
+DEPENDENCY_ERRORS = registry.counter(
+    'bot_dependency_errors_total', 'Calls to external services that raised', ['service', 'operation']
+)
+DOWNLOAD_BYTES = registry.counter('bot_download_bytes_total', 'Bytes downloaded from Telegram', ['target'])
+
+# Task -> (handler, update id) for updates being handled; read by the loop watchdog
+active_handlers: Dict[asyncio.Task, Tuple[str, Optional[int]]] = {}
+
+def track_handler(func):
+    """Record in-flight count, latency and errors of a Telegram handler method"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(self, update, *args, **kwargs):
+        task = asyncio.current_task()
+        if task is not None:
+            active_handlers[task] = (name, getattr(update, 'update_id', None))
+        UPDATES_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            return await func(self, update, *args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            UPDATES_IN_FLIGHT.dec()
+            HANDLER_SECONDS.observe(time.perf_counter() - start, handler=name)
+            if task is not None:
+                active_handlers.pop(task, None)
+    return wrapper
+
+@contextmanager
+def track_call(service: str, operation: str):
+    """Time a block that calls ``service``; exceptions are counted and re-raised"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        DEPENDENCY_ERRORS.inc(service=service, operation=operation)
+        raise
+    finally:
+        DEPENDENCY_SECONDS.observe(time.perf_counter() - start, service=service, operation=operation)
+
+class MetricsServer:
+    """Serves ``GET /metrics`` in the Prometheus text format.
+
+    A tiny HTTP/1.0 responder on the bot's own event loop; scrapes only
+    format counters that are already in memory, so they stay cheap.
+    """
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, metrics: MetricsRegistry = registry, host: Optional[str] = None,
+                 port: Optional[int] = None):
+        self.metrics = metrics
+        self.host = host or Config.METRICS_HOST
+        self.port = Config.METRICS_PORT if port is None else port
+        self.routes: Dict[str, Callable[[], str]] = {'/metrics': self.metrics.render}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def add_route(self, path: str, render: Callable[[], str]):
+        """Serve the text returned by ``render`` at ``path``, e.g. a diagnostics report"""
+        self.routes[path] = render
+
+    async def start(self, attempts: int = 1) -> Optional[int]:
+        """Bind the first free port of ``attempts`` starting at ``port``.
+
+        Webhook workers share one configuration, so each takes the next free
+        port. Returns the bound port, or None if none was free.
+        """
+        for port in range(self.port, self.port + attempts):
+            try:
+                self._server = await asyncio.start_server(self._handle, self.host, port)
+            except OSError:
+                continue
+            self.port = port
+            logger.info(f"Metrics available at http://{self.host}:{port}/metrics")
+            return port
+        logger.error(f"Could not bind a metrics port in {self.port}-{self.port + attempts - 1}")
+        return None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request.decode('latin-1').split()
+            render = self.routes.get(parts[1].split('?')[0]) if len(parts) >= 2 and parts[0] == 'GET' else None
+            if render is not None:
+                status, content_type = '200 OK', self.content_type
+                body = render().encode()
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain', b'not found\n'
+            writer.write(
+                f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"Error serving metrics: {e}")
+        finally:
+            writer.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
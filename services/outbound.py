@@ -0,0 +1,222 @@
+import asyncio
+import itertools
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+from telegram import Chat, Message
+from telegram.error import RetryAfter
+from config.config import Config
+from services.metrics import track_call
+from services.rate_limit import TokenBucket
+from services.streaming import MAX_MESSAGE_LENGTH
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, lower is sent first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+@dataclass
+class _Job:
+    priority: int
+    seq: int
+    bot: Any
+    chat_id: int
+    future: asyncio.Future
+    text: Optional[str] = None
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    call: Optional[Callable[[], Awaitable[Any]]] = None
+    coalesce: bool = False
+
+    def can_merge(self, other: "_Job", length: int) -> bool:
+        return (
+            other.coalesce and other.bot is self.bot and other.priority == self.priority
+            and other.kwargs == self.kwargs and length + 2 + len(other.text) <= MAX_MESSAGE_LENGTH
+        )
+
+@dataclass
+class _ChatLane:
+    bucket: TokenBucket
+    jobs: Deque[_Job] = field(default_factory=deque)
+    busy: bool = False
+
+class OutboundSender:
+    """Central, rate-limit-aware sender for everything the bot posts.
+
+    Each chat has its own token bucket and sends one request at a time, so
+    its messages arrive in order; a global bucket caps the bot as a whole.
+    When several chats are waiting, the one whose next job is in the most
+    urgent priority lane goes first. ``RetryAfter`` responses pause the chat
+    for the requested time and the request is retried. Consecutive small
+    messages queued for the same chat with ``coalesce=True`` are merged into
+    one message while they fit.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(Config.OUTBOUND_GLOBAL_RATE, Config.OUTBOUND_GLOBAL_RATE)
+        self.max_retries = Config.OUTBOUND_MAX_RETRIES
+        self._lanes: Dict[int, _ChatLane] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._tasks = set()
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    def _lane(self, chat_id: int) -> _ChatLane:
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            if chat_id < 0:
+                # Groups and channels get a much lower per-chat allowance
+                bucket = TokenBucket(Config.OUTBOUND_GROUP_RATE, Config.OUTBOUND_CHAT_BURST)
+            else:
+                bucket = TokenBucket(Config.OUTBOUND_CHAT_RATE, Config.OUTBOUND_CHAT_BURST)
+            lane = self._lanes[chat_id] = _ChatLane(bucket)
+        return lane
+
+    def _submit(self, bot, chat_id: int, priority: int, **job_fields) -> asyncio.Future:
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(priority, next(self._seq), bot, chat_id, future, **job_fields)
+        self._lane(chat_id).jobs.append(job)
+        self._wakeup.set()
+        return future
+
+    async def send_message(self, bot, chat_id: int, text: str, priority: int = PRIORITY_NORMAL,
+                           coalesce: bool = False, **kwargs) -> Message:
+        """Queue a text message.
+
+        Only pass ``coalesce=True`` when the returned message is not edited or
+        deleted later, since it may be shared with other queued messages.
+        """
+        coalesce = coalesce and len(text) < MAX_MESSAGE_LENGTH
+        return await self._submit(bot, chat_id, priority, text=text, kwargs=kwargs, coalesce=coalesce)
+
+    async def reply_text(self, message: Message, text: str, priority: int = PRIORITY_NORMAL,
+                         coalesce: bool = False, **kwargs) -> Message:
+        """Queue a reply to ``message``, quoting it in group chats like ``Message.reply_text``"""
+        if message.chat.type != Chat.PRIVATE:
+            kwargs.setdefault('reply_to_message_id', message.message_id)
+        return await self.send_message(message.get_bot(), message.chat_id, text,
+                                       priority=priority, coalesce=coalesce, **kwargs)
+
+    async def edit_message_text(self, message: Message, text: str,
+                                priority: int = PRIORITY_INTERACTIVE, **kwargs) -> Any:
+        return await self._submit(message.get_bot(), message.chat_id, priority,
+                                  call=lambda: message.edit_text(text, **kwargs))
+
+    async def delete_message(self, message: Message, priority: int = PRIORITY_INTERACTIVE) -> bool:
+        return await self._submit(message.get_bot(), message.chat_id, priority, call=message.delete)
+
+    def _take(self, lane: _ChatLane) -> List[_Job]:
+        head = lane.jobs.popleft()
+        jobs = [head]
+        if head.coalesce:
+            length = len(head.text)
+            while lane.jobs and head.can_merge(lane.jobs[0], length):
+                job = lane.jobs.popleft()
+                length += 2 + len(job.text)
+                jobs.append(job)
+            self.coalesced += len(jobs) - 1
+        return jobs
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            ready, wait = None, None
+            for chat_id, lane in list(self._lanes.items()):
+                if lane.busy:
+                    continue
+                while lane.jobs and lane.jobs[0].future.cancelled():
+                    # Nobody is waiting for this message any more
+                    lane.jobs.popleft()
+                if not lane.jobs:
+                    if lane.bucket.full:
+                        del self._lanes[chat_id]
+                    continue
+                delay = lane.bucket.delay()
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                head = lane.jobs[0]
+                if ready is None or (head.priority, head.seq) < (ready.jobs[0].priority, ready.jobs[0].seq):
+                    ready = lane
+
+            if ready is not None:
+                delay = self.global_bucket.delay()
+                if delay == 0:
+                    self.global_bucket.try_acquire()
+                    ready.bucket.try_acquire()
+                    ready.busy = True
+                    task = asyncio.create_task(self._run(ready, self._take(ready)))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                    continue
+                wait = delay if wait is None else min(wait, delay)
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _perform(self, jobs: List[_Job]) -> Any:
+        head = jobs[0]
+        if head.call is not None:
+            with track_call('telegram', 'edit_or_delete'):
+                return await head.call()
+        text = "\n\n".join(job.text for job in jobs)
+        with track_call('telegram', 'send_message'):
+            return await head.bot.send_message(head.chat_id, text, **head.kwargs)
+
+    async def _run(self, lane: _ChatLane, jobs: List[_Job]):
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    result = await self._perform(jobs)
+                    break
+                except RetryAfter as e:
+                    retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                    lane.bucket.block(retry_after)
+                    if attempt == self.max_retries:
+                        raise
+                    self.retried += 1
+                    logger.warning(f"Flood control for chat {jobs[0].chat_id}; retrying in {retry_after}s")
+                    # The lane stays busy so later messages cannot overtake this one
+                    await asyncio.sleep(retry_after)
+                    await self.global_bucket.acquire()
+            self.sent += 1
+            for job in jobs:
+                if not job.future.done():
+                    job.future.set_result(result)
+        except Exception as e:
+            for job in jobs:
+                if not job.future.done():
+                    job.future.set_exception(e)
+        finally:
+            lane.busy = False
+            self._wakeup.set()
+
+    async def close(self, timeout: float = 10.0):
+        """Deliver what is still queued, then stop the dispatcher"""
+        try:
+            pending = [job.future for lane in self._lanes.values() for job in lane.jobs]
+            pending += list(self._tasks)
+            if pending:
+                await asyncio.wait(pending, timeout=timeout)
+        finally:
+            if self._dispatcher is not None:
+                self._dispatcher.cancel()
+                self._dispatcher = None
+            logger.info(f"Outbound sender closed ({self.sent} requests, {self.coalesced} messages coalesced)")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'queued': sum(len(lane.jobs) for lane in self._lanes.values()),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'retried': self.retried
+        }
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import logging
+import random
+import re
+from typing import Any, Dict, List, Optional
+from config.config import Config
+from services.cache import SingleFlight, TTLCache, normalize_prompt
+from services.gemini_service import FLASH_MODEL, GeminiService
+from services.http_client import HttpClient
+from services.metrics import track_call
+
+logger = logging.getLogger(__name__)
+
+QUIZ_PROMPT = """Write {count} multiple-choice quiz questions about "{topic}".
+Each question has exactly 4 distinct options and exactly one correct answer.
+Keep questions under 250 characters and options under 90 characters.
+Reply with a JSON array only, where every item looks like:
+{{"question": "...", "options": ["...", "...", "...", "..."], "answer": <index of the correct option, 0-3>}}"""
+
+AVOID_PROMPT = "\nDo not repeat any of these questions:\n{questions}"
+
+QUESTION_MAX_LENGTH = 300
+OPTION_MAX_LENGTH = 100
+# Topics are user input, so the top-up cooldowns are bounded
+COOLDOWN_MAX_TOPICS = 10000
+
+_FENCE = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$')
+
+def normalize_topic(topic: str) -> str:
+    return normalize_prompt(topic)
+
+def question_id(question: str, options: List[str]) -> str:
+    """Stable id for a question, so regenerated duplicates collapse into one"""
+    payload = json.dumps([normalize_prompt(question), sorted(normalize_prompt(o) for o in options)])
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+def validate_question(raw: Any) -> Optional[Dict[str, Any]]:
+    """Return a clean question dict, or None if ``raw`` is not a usable question"""
+    if not isinstance(raw, dict):
+        return None
+    question = str(raw.get('question') or '').strip()
+    options = raw.get('options')
+    if not question or len(question) > QUESTION_MAX_LENGTH or not isinstance(options, list) or len(options) != 4:
+        return None
+    options = [str(option).strip() for option in options]
+    if any(not option or len(option) > OPTION_MAX_LENGTH for option in options):
+        return None
+    if len({option.casefold() for option in options}) != 4:
+        return None
+
+    answer = raw.get('answer')
+    if isinstance(answer, bool):
+        return None
+    if isinstance(answer, int):
+        index = answer if 0 <= answer < 4 else None
+    else:
+        answer = str(answer or '').strip()
+        letters = {'a': 0, 'b': 1, 'c': 2, 'd': 3}
+        if answer.isdigit():
+            index = int(answer) if int(answer) < 4 else None
+        elif answer.casefold() in letters:
+            index = letters[answer.casefold()]
+        else:
+            matches = [i for i, option in enumerate(options) if option.casefold() == answer.casefold()]
+            index = matches[0] if matches else None
+    if index is None:
+        return None
+    return {
+        'qid': question_id(question, options),
+        'question': question,
+        'options': options,
+        'answer': index
+    }
+
+def parse_quiz_json(text: str) -> List[Dict[str, Any]]:
+    """Parse and validate a model reply; invalid items are dropped"""
+    try:
+        data = json.loads(_FENCE.sub('', text))
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Quiz generation returned invalid JSON: {e}")
+        return []
+    if isinstance(data, dict):
+        data = data.get('questions', [])
+    if not isinstance(data, list):
+        return []
+    questions = {}
+    for item in data:
+        question = validate_question(item)
+        if question is not None:
+            questions.setdefault(question['qid'], question)
+    if len(questions) < len(data):
+        logger.info(f"Dropped {len(data) - len(questions)} invalid or duplicate quiz questions")
+    return list(questions.values())
+
+class QuizBank:
+    """Pre-generated quiz questions per normalized topic.
+
+    Quizzes are served from the ``quiz_questions`` collection in a single
+    read. Only a topic nobody has asked for yet waits for Gemini; topics
+    below ``QUIZ_BANK_TARGET`` questions are topped up in the background as
+    they are requested, so popular topics stay stocked and generation cost
+    is shared by everyone who takes the quiz.
+    """
+
+    def __init__(self, db_ops, http: HttpClient, gemini: GeminiService):
+        self.db_ops = db_ops
+        self.http = http
+        self.gemini = gemini
+        self.url = f"{Config.GEMINI_API_BASE}/v1beta/models/{FLASH_MODEL}:generateContent"
+        self._generating = SingleFlight()
+        # Topics generated recently; entries expire with the cooldown
+        self._cooling_down = TTLCache(
+            max_entries=COOLDOWN_MAX_TOPICS, max_bytes=COOLDOWN_MAX_TOPICS, ttl=Config.QUIZ_TOPUP_COOLDOWN
+        )
+        self._tasks = set()
+
+    async def get_quiz(self, topic: str, count: Optional[int] = None, generate: bool = False,
+                       user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Pick ``count`` questions for ``topic``.
+
+        With ``generate`` set, an empty or short bank is filled before
+        returning; otherwise whatever is banked is returned right away.
+        """
+        count = count or Config.QUIZ_LENGTH
+        key = normalize_topic(topic)
+        banked = await self.db_ops.get_quiz_questions(key, limit=Config.QUIZ_BANK_READ_LIMIT)
+        if len(banked) < count and generate:
+            await self._generating.do(key, lambda: self._generate(key, topic, banked, user_id))
+            banked = await self.db_ops.get_quiz_questions(key, limit=Config.QUIZ_BANK_READ_LIMIT)
+        elif len(banked) < Config.QUIZ_BANK_TARGET:
+            self._top_up(key, topic, banked)
+        return random.sample(banked, min(count, len(banked)))
+
+    async def get_questions(self, topic_key: str, qids: List[str]) -> List[Dict[str, Any]]:
+        """Look up banked questions by id for a normalized topic"""
+        return await self.db_ops.get_quiz_questions_by_id(topic_key, qids)
+
+    def _top_up(self, key: str, topic: str, banked: List[Dict[str, Any]]):
+        if not banked or key in self._generating:
+            return
+        if self._cooling_down.get(key) is not None:
+            return
+        task, _ = self._generating.start(key, lambda: self._generate(key, topic, banked, None))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _generate(self, key: str, topic: str, banked: List[Dict[str, Any]],
+                        user_id: Optional[int]) -> int:
+        self._cooling_down.set(key, True, size=1)
+        prompt = QUIZ_PROMPT.format(count=Config.QUIZ_BATCH_SIZE, topic=topic)
+        if banked:
+            prompt += AVOID_PROMPT.format(questions="\n".join(f"- {q['question']}" for q in banked[:50]))
+        try:
+            async with self.gemini.scheduler.slot(FLASH_MODEL, user_id):
+                with track_call('gemini', f"{FLASH_MODEL}:quiz"):
+                    response = await self.http.post(
+                        self.url,
+                        json={
+                            "contents": [{"parts": [{"text": prompt}]}],
+                            "generationConfig": {"responseMimeType": "application/json", "temperature": 1.0}
+                        },
+                        params={"key": Config.GEMINI_API_KEY}
+                    )
+            if response.status_code != 200:
+                logger.error(f"Quiz generation failed: {response.status_code}, {response.text[:200]}")
+                return 0
+            candidate = response.json().get("candidates", [{}])[0]
+            text = "".join(p.get("text", "") for p in candidate.get("content", {}).get("parts", []))
+            questions = parse_quiz_json(text)
+            added = await self.db_ops.save_quiz_questions(key, questions) if questions else 0
+            logger.info(f"Quiz bank '{key}': {added} new questions ({len(banked) + added} total)")
+            return added
+        except Exception as e:
+            logger.error(f"Error generating quiz questions for '{key}': {e}")
+            return 0
@@ -0,0 +1,195 @@
+"""Render Gemini markdown as Telegram HTML and split it into sendable chunks."""
+import logging
+import re
+from html import escape as _html_escape
+from typing import List, Tuple
+from services.streaming import MAX_MESSAGE_LENGTH
+
+logger = logging.getLogger(__name__)
+
+_FENCE = re.compile(r'^\s*```\s*([\w+-]*)\s*$')
+_HEADING = re.compile(r'^\s{0,3}#{1,6}\s+(.*?)\s*#*\s*$')
+_BULLET = re.compile(r'^(\s*)[-*+]\s+(?=\S)')
+
+# One alternation per inline construct; the first group that matches wins
+_INLINE = re.compile(
+    r'(?P<code>`+)(?P<code_text>.+?)(?P=code)'
+    r'|\*\*(?P<bold>.+?)\*\*'
+    r'|(?<!\w)__(?P<bold2>.+?)__(?!\w)'
+    r'|~~(?P<strike>.+?)~~'
+    r'|(?<![\w*])\*(?![\s*])(?P<italic>.+?)(?<![\s*])\*(?![\w*])'
+    r'|(?<![\w_])_(?![\s_])(?P<italic2>.+?)(?<![\s_])_(?![\w_])'
+    r'|\[(?P<link_text>[^\]]+)\]\((?P<url>https?://[^\s)]+)\)'
+    r'|\b(?P<label>Note|Important|Key point|Remember|Warning):'
+)
+
+# Emoji that prefixes a decorated reply; the first tone with a keyword anywhere in it wins
+_TONES = (
+    (re.compile(r'example', re.IGNORECASE), "💡 "),
+    (re.compile(r'error|warning|caution', re.IGNORECASE), "⚠️ "),
+    (re.compile(r'success|complete|done', re.IGNORECASE), "✅ "),
+)
+_DEFAULT_EMOJI = "🤖 "
+
+_TOKEN = re.compile(r'<(/?)([a-z]+)[^>]*>|&#?\w+;|[^<&]+')
+
+def escape(text: str) -> str:
+    """Escape text for Telegram's HTML parse mode"""
+    return _html_escape(text, quote=False)
+
+def _inline(text: str) -> str:
+    out, pos = [], 0
+    for match in _INLINE.finditer(text):
+        out.append(escape(text[pos:match.start()]))
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == 'code_text':
+            out.append(f"<code>{escape(match.group('code_text'))}</code>")
+        elif kind in ('bold', 'bold2'):
+            out.append(f"<b>{_inline(match.group(kind))}</b>")
+        elif kind == 'strike':
+            out.append(f"<s>{_inline(match.group(kind))}</s>")
+        elif kind in ('italic', 'italic2'):
+            out.append(f"<i>{_inline(match.group(kind))}</i>")
+        elif kind == 'url':
+            url = _html_escape(match.group('url'), quote=True)
+            out.append(f'<a href="{url}">{_inline(match.group("link_text"))}</a>')
+        else:
+            out.append(f"<b>{match.group('label')}:</b>")
+    out.append(escape(text[pos:]))
+    return ''.join(out)
+
+def render_html(text: str) -> str:
+    """Convert markdown to Telegram HTML in a single pass over the lines.
+
+    Unterminated markup is left as literal text and an unterminated code
+    fence is closed at the end, so the output is always well formed. This
+    also makes it safe to render partial text while a reply is streaming.
+    """
+    out: List[str] = []
+    in_code = False
+    for line in text.split('\n'):
+        fence = _FENCE.match(line)
+        if fence:
+            if in_code:
+                out.append('</code></pre>\n')
+            else:
+                language = fence.group(1)
+                attr = f' class="language-{language}"' if language else ''
+                out.append(f'<pre><code{attr}>')
+            in_code = not in_code
+            continue
+        if in_code:
+            out.append(escape(line) + '\n')
+            continue
+
+        heading = _HEADING.match(line)
+        if heading:
+            title = heading.group(1)
+            if len(title) > 4 and title.startswith('**') and title.endswith('**'):
+                title = title[2:-2]
+            out.append(f"<b>{_inline(title)}</b>\n")
+            continue
+        bullet = _BULLET.match(line)
+        if bullet:
+            line = f"{bullet.group(1)}• {line[bullet.end():]}"
+        out.append(_inline(line) + '\n')
+
+    if in_code:
+        out.append('</code></pre>')
+    html = ''.join(out)
+    # Code blocks end with a newline before their closing tag
+    return html.replace('\n</code></pre>', '</code></pre>').rstrip('\n')
+
+def tone_emoji(text: str) -> str:
+    """Emoji matching the tone of a reply: example, then warning, then success"""
+    for pattern, emoji in _TONES:
+        if pattern.search(text):
+            return emoji
+    return _DEFAULT_EMOJI
+
+def _soft_cut(text: str, room: int, low: int) -> int:
+    """Best place to end a chunk inside ``text[:room]``, or 0 if there is none"""
+    for separator in ('\n\n', '\n', ' '):
+        index = text.rfind(separator, max(low, 0), room)
+        if index > 0:
+            return index + len(separator)
+    return 0
+
+def split_html(html: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Split rendered HTML into chunks of at most ``limit`` characters.
+
+    Chunks end at paragraph, line or word boundaries where possible and
+    never inside a tag or entity. Tags still open at a split are closed at
+    the end of the chunk and reopened at the start of the next one.
+    """
+    if len(html) <= limit:
+        return [html] if html.strip() else []
+
+    chunks: List[str] = []
+    stack: List[Tuple[str, str]] = []  # (name, opening tag)
+    parts: List[str] = []
+    length = 0
+    closing = 0  # characters needed to close every open tag
+
+    def flush():
+        nonlocal parts, length
+        chunk = ''.join(parts) + ''.join(f"</{name}>" for name, _ in reversed(stack))
+        if chunk.strip():
+            chunks.append(chunk.strip('\n'))
+        parts = [tag for _, tag in stack]
+        length = sum(len(tag) for tag in parts)
+
+    def has_content() -> bool:
+        return len(parts) > len(stack)
+
+    for match in _TOKEN.finditer(html):
+        token = match.group(0)
+        name = match.group(2)
+        if name:
+            if match.group(1):
+                parts.append(token)
+                length += len(token)
+                stack.pop()
+                closing -= len(name) + 3
+                continue
+            if length + len(token) + closing + len(name) + 3 > limit and has_content():
+                flush()
+            parts.append(token)
+            length += len(token)
+            stack.append((name, token))
+            closing += len(name) + 3
+            continue
+
+        while token:
+            room = limit - length - closing
+            if len(token) <= room:
+                parts.append(token)
+                length += len(token)
+                break
+            if token.startswith('&') and not has_content():
+                parts.append(token)
+                length += len(token)
+                break
+            cut = 0 if token.startswith('&') else _soft_cut(token, room, limit // 2 - length)
+            if cut == 0 and has_content():
+                # Nothing good to cut at here; start the token in a new chunk
+                flush()
+                continue
+            if cut == 0:
+                cut = max(room, 1)
+            parts.append(token[:cut])
+            length += cut
+            token = token[cut:]
+            flush()
+
+    flush()
+    return chunks
+
+def render_message(text: str, decorated: bool = True, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Render a model reply into HTML chunks ready to send with ``parse_mode=HTML``"""
+    html = render_html(text)
+    if decorated:
+        # Added after rendering, so a reply that opens with a heading still renders as one
+        html = tone_emoji(text) + html
+    return split_html(html, limit)
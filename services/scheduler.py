@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+from services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SLOT_WAIT_SECONDS = registry.histogram(
+    'bot_scheduler_wait_seconds', 'Time spent queued for a model concurrency slot', ['model']
+)
+
+class FairScheduler:
+    """Bounded concurrency limiter with per-user round-robin queueing.
+
+    Calls are admitted while both the global limit and the limit of the
+    requested model have free slots. Once they are saturated, waiters are
+    queued per user and released round-robin, so a user firing many requests
+    cannot starve everyone else.
+    """
+
+    def __init__(self, global_limit: int, per_model_limit: int):
+        self.global_limit = global_limit
+        self.per_model_limit = per_model_limit
+        self._active = 0
+        self._active_per_model: Dict[str, int] = defaultdict(int)
+        # user key -> deque of (model, future); insertion order is the round-robin order
+        self._waiters: "OrderedDict[Any, deque]" = OrderedDict()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of calls currently waiting for a slot"""
+        return sum(len(queue) for queue in self._waiters.values())
+
+    @property
+    def in_flight(self) -> int:
+        return self._active
+
+    def _has_capacity(self, model: str) -> bool:
+        return (self._active < self.global_limit
+                and self._active_per_model[model] < self.per_model_limit)
+
+    def _grant(self, model: str):
+        self._active += 1
+        self._active_per_model[model] += 1
+
+    def _dispatch(self):
+        while self._active < self.global_limit:
+            for user in list(self._waiters):
+                queue = self._waiters[user]
+                while queue and queue[0][1].done():
+                    # Cancelled waiters that have not cleaned up yet
+                    queue.popleft()
+                if not queue:
+                    del self._waiters[user]
+                    continue
+                model, future = queue[0]
+                if self._has_capacity(model):
+                    queue.popleft()
+                    if queue:
+                        self._waiters.move_to_end(user)
+                    else:
+                        del self._waiters[user]
+                    self._grant(model)
+                    future.set_result(None)
+                    break
+            else:
+                return
+
+    async def acquire(self, model: str, user: Optional[Any] = None):
+        if not self._waiters and self._has_capacity(model):
+            self._grant(model)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user, deque()).append((model, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just before cancellation; hand it back
+                self.release(model)
+            else:
+                queue = self._waiters.get(user)
+                if queue is not None:
+                    try:
+                        queue.remove((model, future))
+                    except ValueError:
+                        pass
+                    if not queue and self._waiters.get(user) is queue:
+                        del self._waiters[user]
+            raise
+
+    def release(self, model: str):
+        self._active -= 1
+        self._active_per_model[model] -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, model: str, user: Optional[Any] = None):
+        """Hold a concurrency slot for ``model`` on behalf of ``user``"""
+        with SLOT_WAIT_SECONDS.time(model=model):
+            await self.acquire(model, user)
+        try:
+            yield
+        finally:
+            self.release(model)
@@ -0,0 +1,142 @@
+import json
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, UTC
+from typing import Any, Dict, Optional
+from config.config import Config
+from database.drivers import StorageDriver
+from services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Session:
+    data: Dict[str, Any]
+    version: int
+
+class SessionTooLarge(ValueError):
+    """Raised when an encoded session exceeds ``SESSION_MAX_BYTES``"""
+
+def encode_session(data: Dict[str, Any]) -> str:
+    """Compact JSON encoding; keep session payloads to ids and counters"""
+    blob = json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+    if len(blob.encode()) > Config.SESSION_MAX_BYTES:
+        raise SessionTooLarge(f"Session of {len(blob)} characters exceeds SESSION_MAX_BYTES")
+    return blob
+
+def decode_session(blob: str) -> Dict[str, Any]:
+    return json.loads(blob)
+
+class SessionStore:
+    """Per-key state for multi-step flows, shared by every worker.
+
+    Sessions expire ``ttl`` seconds after their last write. ``update`` is a
+    compare-and-set on the session version, so two workers handling the
+    same user can never both apply a step.
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl or Config.SESSION_TTL
+
+    async def get(self, key: str) -> Optional[Session]:
+        raise NotImplementedError
+
+    async def put(self, key: str, data: Dict[str, Any]) -> Session:
+        """Create or replace a session"""
+        raise NotImplementedError
+
+    async def update(self, key: str, version: int, data: Dict[str, Any]) -> bool:
+        """Replace a session only if it is still at ``version``"""
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+class MemorySessionStore(SessionStore):
+    """In-process store for single-process deployments and tests"""
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        super().__init__(ttl)
+        self._cache = TTLCache(
+            max_entries=max_entries or Config.SESSION_MAX_ENTRIES,
+            max_bytes=(max_entries or Config.SESSION_MAX_ENTRIES) * Config.SESSION_MAX_BYTES,
+            ttl=self.ttl
+        )
+
+    async def get(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        version, blob = entry
+        return Session(decode_session(blob), version)
+
+    async def put(self, key, data):
+        # A fresh version, so steps from a replaced session can never apply
+        version = time.time_ns()
+        blob = encode_session(data)
+        self._cache.set(key, (version, blob), size=len(blob))
+        return Session(data, version)
+
+    async def update(self, key, version, data):
+        # No await between the check and the write, so this is atomic
+        entry = self._cache.get(key)
+        if entry is None or entry[0] != version:
+            return False
+        blob = encode_session(data)
+        self._cache.set(key, (version + 1, blob), size=len(blob))
+        return True
+
+    async def delete(self, key):
+        self._cache.pop(key)
+
+class DatabaseSessionStore(SessionStore):
+    """Sessions in the ``sessions`` collection; a TTL index drops abandoned ones"""
+
+    def __init__(self, driver: StorageDriver, ttl: Optional[float] = None):
+        super().__init__(ttl)
+        self.driver = driver
+
+    def _expiry(self) -> datetime:
+        return datetime.now(UTC) + timedelta(seconds=self.ttl)
+
+    async def get(self, key):
+        entry = await self.driver.find_one(
+            'sessions', {'key': key, 'expires_at': {'$gt': datetime.now(UTC)}}
+        )
+        if entry is None:
+            return None
+        return Session(decode_session(entry['data']), entry['v'])
+
+    async def put(self, key, data):
+        # A fresh version, so steps from a replaced session can never apply
+        version = time.time_ns()
+        await self.driver.update_one(
+            'sessions',
+            {'key': key},
+            {'$set': {'data': encode_session(data), 'v': version, 'expires_at': self._expiry()}},
+            upsert=True
+        )
+        return Session(data, version)
+
+    async def update(self, key, version, data):
+        result = await self.driver.update_one(
+            'sessions',
+            {'key': key, 'v': version, 'expires_at': {'$gt': datetime.now(UTC)}},
+            {'$set': {'data': encode_session(data), 'expires_at': self._expiry()}, '$inc': {'v': 1}}
+        )
+        return result.matched_count == 1
+
+    async def delete(self, key):
+        await self.driver.update_one(
+            'sessions', {'key': key}, {'$set': {'expires_at': datetime.now(UTC)}}
+        )
+
+def create_session_store(driver: StorageDriver, name: Optional[str] = None) -> SessionStore:
+    """Build the store selected by ``Config.SESSION_BACKEND``"""
+    name = (name or Config.SESSION_BACKEND).lower()
+    if name == 'database':
+        return DatabaseSessionStore(driver)
+    if name == 'memory':
+        return MemorySessionStore()
+    raise ValueError(f"Unknown session backend: {name}")
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Callable, Optional
+from telegram import Message
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+
+def split_point(text: str, limit: int) -> int:
+    """Find where to cut ``text`` so the head fits in ``limit`` characters"""
+    if len(text) <= limit:
+        return len(text)
+    for separator in ('\n\n', '\n', ' '):
+        index = text.rfind(separator, limit // 2, limit)
+        if index != -1:
+            return index + len(separator)
+    return limit
+
+class StreamingReply:
+    """Delivers streamed model output by progressively editing a message.
+
+    Edits are throttled to one per ``min_interval`` seconds to stay within
+    Telegram's edit rate limits, and once a message reaches 4096 characters
+    the stream rolls over into a new message. When an ``OutboundSender`` is
+    given, sends and edits go through it and share the chat's rate limit.
+    ``render`` turns the text shown so far into HTML; it must produce
+    well-formed output for partial text, like ``renderer.render_html``.
+    """
+
+    def __init__(self, bot, chat_id: int, message: Optional[Message] = None,
+                 min_interval: Optional[float] = None, sender=None,
+                 render: Optional[Callable[[str], str]] = None):
+        self.bot = bot
+        self.sender = sender
+        self.render = render
+        self.chat_id = chat_id
+        self.message = message
+        self.min_interval = Config.STREAM_EDIT_INTERVAL if min_interval is None else min_interval
+        self.messages = [message] if message is not None else []
+        self._text = ""       # text belonging to the current message
+        self._shown = None    # text Telegram currently displays for it
+        self._next_edit = 0.0
+        self._started = time.monotonic()
+        self.time_to_first_token: Optional[float] = None
+        self.time_to_first_visible: Optional[float] = None
+
+    async def consume(self, chunks: AsyncIterator[str]) -> str:
+        """Stream ``chunks`` into Telegram and return the full text"""
+        parts = []
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            if self.time_to_first_token is None:
+                self.time_to_first_token = time.monotonic() - self._started
+            parts.append(chunk)
+            self._text += chunk
+            while len(self._text) > MAX_MESSAGE_LENGTH:
+                cut = split_point(self._text, MAX_MESSAGE_LENGTH)
+                head, self._text = self._text[:cut], self._text[cut:]
+                await self._show(head, force=True)
+                # The next chunk of text goes into a fresh message
+                self.message, self._shown = None, None
+            await self._show(self._text)
+        await self._show(self._text, force=True)
+
+        if self.time_to_first_visible is not None:
+            logger.info(
+                f"Streamed reply: first token after {self.time_to_first_token:.2f}s, "
+                f"first visible after {self.time_to_first_visible:.2f}s"
+            )
+        return "".join(parts)
+
+    async def _show(self, text: str, force: bool = False):
+        text = text.strip()
+        if not text or text == self._shown:
+            return
+        now = time.monotonic()
+        if not force and now < self._next_edit:
+            return
+        try:
+            try:
+                await self._deliver(text, self.render)
+            except BadRequest as e:
+                if self.render is None or "can't parse entities" not in str(e).lower():
+                    raise
+                # Markup Telegram rejects must not lose the reply
+                await self._deliver(text, None)
+            self._shown = text
+            self._next_edit = time.monotonic() + self.min_interval
+            if self.time_to_first_visible is None:
+                self.time_to_first_visible = time.monotonic() - self._started
+        except RetryAfter as e:
+            # Flood control: back off and let a later chunk catch the message up
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            self._next_edit = time.monotonic() + retry_after
+            if force:
+                await self._wait_and_retry(text, retry_after)
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                raise
+
+    async def _deliver(self, text: str, render: Optional[Callable[[str], str]]):
+        kwargs = {}
+        if render is not None:
+            text, kwargs['parse_mode'] = render(text), ParseMode.HTML
+        if self.message is None:
+            self.message = await self._send(text, **kwargs)
+            self.messages.append(self.message)
+        elif self.sender is not None:
+            await self.sender.edit_message_text(self.message, text, **kwargs)
+        else:
+            await self.message.edit_text(text, **kwargs)
+
+    async def _send(self, text: str, **kwargs) -> Message:
+        if self.sender is not None:
+            from services.outbound import PRIORITY_INTERACTIVE
+
+            return await self.sender.send_message(
+                self.bot, self.chat_id, text, priority=PRIORITY_INTERACTIVE, **kwargs
+            )
+        return await self.bot.send_message(self.chat_id, text, **kwargs)
+
+    async def _wait_and_retry(self, text: str, delay: float):
+        await asyncio.sleep(delay)
+        await self._show(text, force=True)
@@ -0,0 +1,174 @@
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Deque, Dict, List, Optional, Set, Tuple
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, lower runs first
+PRIORITY_CALLBACK = 0
+PRIORITY_TEXT = 1
+PRIORITY_HEAVY = 2
+
+def classify_update(update: Any) -> int:
+    """Map an update to a priority class.
+
+    Callback queries (quiz answers) and text are cheap; photos, documents and
+    voice notes trigger downloads and long Gemini calls.
+    """
+    if not isinstance(update, Update):
+        return PRIORITY_TEXT
+    if update.callback_query:
+        return PRIORITY_CALLBACK
+    message = update.effective_message
+    if message and (message.photo or message.document or message.voice):
+        return PRIORITY_HEAVY
+    if message and message.text and message.text.startswith('/websearch'):
+        return PRIORITY_HEAVY
+    return PRIORITY_TEXT
+
+class PriorityGate:
+    """Semaphore that wakes waiters by priority class, FIFO within a class"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    @property
+    def in_flight(self) -> int:
+        return self._active
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int):
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            else:
+                self._waiters = [w for w in self._waiters if w[2] is not future]
+                heapq.heapify(self._waiters)
+            raise
+
+    def release(self):
+        self._active -= 1
+        while self._waiters and self._active < self.limit:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._active += 1
+                future.set_result(None)
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently while keeping each chat in order.
+
+    Updates from the same chat run one after another, so a user's messages
+    and quiz answers are handled in the order they were sent: while a chat
+    has an update running, later ones join its lane and are run by the same
+    task, so a busy chat holds one slot of PTB's semaphore however many
+    updates it sends. That semaphore admits ``max_concurrent_updates``
+    chats plus ``max_waiting_chats`` more; up to ``max_concurrent_updates``
+    handlers run at once, and the rest wait with cheap updates ahead of
+    heavy photo/PDF jobs.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_waiting_chats: Optional[int] = None):
+        waiting = max_concurrent_updates if max_waiting_chats is None else max_waiting_chats
+        super().__init__(max_concurrent_updates + waiting)
+        self._gate = PriorityGate(max_concurrent_updates)
+        self._lanes: Dict[Any, Deque[Tuple[int, Awaitable[Any]]]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self) -> int:
+        return self._gate.in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        return self._gate.queue_depth + sum(len(lane) - 1 for lane in self._lanes.values())
+
+    @staticmethod
+    def _chat_key(update: Any) -> Any:
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return ('user', update.effective_user.id)
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # Remembered so shutdown can cancel whatever is still running
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            await self._process(update, coroutine)
+        finally:
+            self._tasks.discard(task)
+
+    async def _process(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._chat_key(update)
+        priority = classify_update(update)
+        if key is None:
+            async with self._gate_slot(priority):
+                await coroutine
+            return
+
+        lane = self._lanes.get(key)
+        if lane is not None:
+            # The chat's running update runs this one after those before it
+            lane.append((priority, coroutine))
+            return
+
+        self._lanes[key] = lane = deque([(priority, coroutine)])
+        try:
+            while lane:
+                # The head stays in the lane while it runs, so later updates queue behind it
+                priority, coroutine = lane[0]
+                try:
+                    async with self._gate_slot(priority):
+                        await coroutine
+                except Exception as e:
+                    logger.error(f"Error processing update for chat {key}: {e}")
+                lane.popleft()
+        finally:
+            del self._lanes[key]
+            # Cancelled while updates were queued: they will never run
+            for _, pending in lane:
+                if inspect.iscoroutine(pending):
+                    pending.close()
+
+    @asynccontextmanager
+    async def _gate_slot(self, priority: int):
+        await self._gate.acquire(priority)
+        try:
+            yield
+        finally:
+            self._gate.release()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        """Cancel updates still being processed and wait for them to unwind"""
+        tasks = [task for task in self._tasks if not task.done()]
+        if not tasks:
+            return
+        logger.warning(f"Cancelling {len(tasks)} updates still being processed")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
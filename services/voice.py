@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Union
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+AudioSource = Union[bytes, bytearray, memoryview, str]
+
+class TranscriptionError(Exception):
+    """Raised when a voice message cannot be decoded or recognized"""
+
+async def decode_to_pcm(source: AudioSource, sample_rate: int = 16000) -> bytes:
+    """Decode any ffmpeg-readable audio to mono 16-bit little-endian PCM.
+
+    Bytes are piped through ffmpeg's stdin/stdout, so nothing touches the
+    disk; a path (for files the downloader spilled) is read directly. The
+    shared download buffer is written through a ``memoryview``, never copied.
+    """
+    in_memory = not isinstance(source, str)
+    try:
+        process = await asyncio.create_subprocess_exec(
+            Config.FFMPEG_PATH, '-hide_banner', '-loglevel', 'error',
+            '-i', 'pipe:0' if in_memory else source,
+            '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(sample_rate),
+            'pipe:1',
+            stdin=asyncio.subprocess.PIPE if in_memory else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except FileNotFoundError:
+        raise TranscriptionError(f"ffmpeg not found at {Config.FFMPEG_PATH!r}")
+    try:
+        pcm, stderr = await asyncio.wait_for(
+            process.communicate(memoryview(source) if in_memory else None),
+            Config.VOICE_DECODE_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise TranscriptionError("ffmpeg timed out")
+    if process.returncode != 0:
+        raise TranscriptionError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()[:200]}")
+    return pcm
+
+class Recognizer:
+    """Speech-to-text backend working on mono 16-bit PCM"""
+
+    sample_rate = 16000
+
+    async def transcribe(self, pcm: bytes) -> str:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class GoogleRecognizer(Recognizer):
+    """Google Web Speech API via SpeechRecognition, run in a worker thread"""
+
+    def __init__(self, language: Optional[str] = None):
+        import speech_recognition as sr
+
+        self._sr = sr
+        self.language = language or Config.VOICE_LANGUAGE
+
+    def _recognize(self, pcm: bytes) -> str:
+        audio = self._sr.AudioData(pcm, self.sample_rate, 2)
+        try:
+            return self._sr.Recognizer().recognize_google(audio, language=self.language)
+        except self._sr.UnknownValueError:
+            return ""
+        except self._sr.RequestError as e:
+            raise TranscriptionError(f"Speech API request failed: {e}")
+
+    async def transcribe(self, pcm: bytes) -> str:
+        return await asyncio.to_thread(self._recognize, pcm)
+
+# Loaded once per worker process
+_vosk_models: Dict[str, object] = {}
+
+def _vosk_transcribe(model_path: str, pcm: bytes, sample_rate: int) -> str:
+    from vosk import KaldiRecognizer, Model, SetLogLevel
+
+    model = _vosk_models.get(model_path)
+    if model is None:
+        SetLogLevel(-1)
+        model = _vosk_models[model_path] = Model(model_path)
+    recognizer = KaldiRecognizer(model, sample_rate)
+    recognizer.AcceptWaveform(pcm)
+    return json.loads(recognizer.FinalResult()).get('text', '')
+
+class VoskRecognizer(Recognizer):
+    """Offline recognition with Vosk, run in a process pool.
+
+    Decoding is CPU bound, so it runs outside the interpreter that serves
+    the event loop; each worker loads the model once and keeps it.
+    """
+
+    def __init__(self, model_path: Optional[str] = None, workers: Optional[int] = None):
+        try:
+            import vosk  # noqa: F401
+        except ImportError as e:
+            raise RuntimeError("VOICE_BACKEND=vosk requires the 'vosk' package") from e
+        self.model_path = model_path or Config.VOSK_MODEL_PATH
+        if not self.model_path:
+            raise RuntimeError("VOICE_BACKEND=vosk requires VOSK_MODEL_PATH")
+        # Spawned, not forked: forking a multi-threaded process can copy a held lock into the child
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers or Config.VOICE_PROCESS_WORKERS, mp_context=multiprocessing.get_context('spawn')
+        )
+
+    async def transcribe(self, pcm: bytes) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._pool, _vosk_transcribe, self.model_path, pcm, self.sample_rate
+        )
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+def create_recognizer(name: Optional[str] = None) -> Recognizer:
+    """Build the backend selected by ``Config.VOICE_BACKEND``"""
+    name = (name or Config.VOICE_BACKEND).lower()
+    if name == 'google':
+        return GoogleRecognizer()
+    if name == 'vosk':
+        return VoskRecognizer()
+    raise ValueError(f"Unknown voice backend: {name}")
+
+class VoiceTranscriber:
+    """Decodes and transcribes voice messages with bounded concurrency.
+
+    At most ``VOICE_MAX_CONCURRENCY`` voice notes are decoded and recognized
+    at once, so a burst of them cannot take over the CPU or thread pool that
+    text traffic depends on. The backend is created on first use.
+    """
+
+    def __init__(self, recognizer: Optional[Recognizer] = None, max_concurrency: Optional[int] = None):
+        self._recognizer = recognizer
+        self._slots = asyncio.Semaphore(max_concurrency or Config.VOICE_MAX_CONCURRENCY)
+
+    @property
+    def recognizer(self) -> Recognizer:
+        if self._recognizer is None:
+            self._recognizer = create_recognizer()
+            logger.info(f"Voice recognizer ready: {type(self._recognizer).__name__}")
+        return self._recognizer
+
+    async def transcribe(self, source: AudioSource) -> str:
+        """Return the text spoken in ``source`` (empty if nothing was recognized)"""
+        async with self._slots:
+            recognizer = self.recognizer
+            pcm = await decode_to_pcm(source, recognizer.sample_rate)
+            if not pcm:
+                return ""
+            return (await recognizer.transcribe(pcm)).strip()
+
+    def close(self):
+        if self._recognizer is not None:
+            self._recognizer.close()
@@ -0,0 +1,196 @@
+"""Detect event loop stalls and attribute them to the code that caused them."""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from config.config import Config
+from services import metrics
+from services.metrics import active_handlers, registry
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_SECONDS = registry.histogram('bot_event_loop_lag_seconds', 'How late the event loop woke a sleeping task')
+LOOP_STALLS = registry.counter(
+    'bot_event_loop_stalls_total', 'Event loop stalls longer than the watchdog threshold', ['handler']
+)
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Wrappers that appear in every handler's stack but never block themselves
+_INFRASTRUCTURE = {os.path.abspath(__file__), os.path.abspath(metrics.__file__)}
+STACK_DEPTH = 12
+
+@dataclass
+class _Capture:
+    handler: str
+    update_id: Optional[int]
+    site: str
+    stack: List[str]
+
+@dataclass
+class StallSite:
+    """Stalls seen at one call site while running one handler"""
+    handler: str
+    site: str
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    last_update_id: Optional[int] = None
+    stack: List[str] = field(default_factory=list)
+
+def _is_own_code(filename: str) -> bool:
+    return filename.startswith(_ROOT) and 'site-packages' not in filename and filename not in _INFRASTRUCTURE
+
+def blocking_site(frames: traceback.StackSummary) -> str:
+    """Innermost frame in the bot's own code, i.e. where the blocking call was made"""
+    for frame in reversed(frames):
+        if _is_own_code(frame.filename):
+            return f"{os.path.relpath(frame.filename, _ROOT)}:{frame.lineno} in {frame.name}"
+    if frames:
+        return f"{frames[-1].filename}:{frames[-1].lineno} in {frames[-1].name}"
+    return 'unknown'
+
+class LoopWatchdog:
+    """Measures event loop lag and captures the stack of whatever blocks it.
+
+    A heartbeat task sleeps for ``interval`` and records how late it wakes
+    up. A monitor thread watches the heartbeat; once it is more than
+    ``threshold`` overdue, the thread grabs the loop thread's current stack
+    with ``sys._current_frames`` (so the stack shows the blocking call
+    itself, not where the loop resumed) and notes the handler and update
+    running in the current task. When the loop recovers the stall is
+    recorded with its duration, aggregated per handler and call site.
+    """
+
+    def __init__(self, threshold: Optional[float] = None, interval: Optional[float] = None,
+                 report_interval: Optional[float] = None):
+        self.threshold = threshold or Config.LOOP_WATCHDOG_THRESHOLD
+        self.interval = interval or Config.LOOP_WATCHDOG_INTERVAL
+        self.report_interval = Config.LOOP_WATCHDOG_REPORT_INTERVAL if report_interval is None else report_interval
+        self.stalls = 0
+        self._sites: Dict[Tuple[str, str], StallSite] = {}
+        self._pending: Optional[_Capture] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._beat = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start watching the running loop; call from a coroutine"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = self._loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._monitor, name='loop-watchdog', daemon=True)
+        self._thread.start()
+        logger.info(f"Event loop watchdog started (threshold {self.threshold * 1000:.0f} ms)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await asyncio.to_thread(self._thread.join, 1.0)
+        if self._sites:
+            logger.warning(self.report())
+
+    async def _heartbeat(self):
+        last_report, reported = time.monotonic(), 0
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - self._beat - self.interval)
+            LOOP_LAG_SECONDS.observe(lag)
+            with self._lock:
+                capture, self._pending = self._pending, None
+            if capture is not None and lag >= self.threshold:
+                self._record(capture, lag)
+            if self.report_interval and now - last_report >= self.report_interval:
+                last_report = now
+                if self.stalls > reported:
+                    reported = self.stalls
+                    logger.warning(self.report())
+
+    def _monitor(self):
+        poll = max(self.threshold / 2, 0.005)
+        captured = None
+        while not self._stop.wait(poll):
+            beat = self._beat
+            if beat == captured or time.monotonic() - beat < self.interval + self.threshold:
+                continue
+            captured = beat
+            capture = self._capture(beat)
+            if capture is not None:
+                with self._lock:
+                    self._pending = capture
+
+    def _capture(self, beat: float) -> Optional[_Capture]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None
+        frames = traceback.extract_stack(frame)
+        del frame
+        if self._beat != beat:
+            # The loop recovered while the stack was being taken
+            return None
+
+        task = asyncio.current_task(self._loop)
+        handler, update_id = active_handlers.get(task, (None, None)) if task is not None else (None, None)
+        if handler is None:
+            # Outside a handler: name the coroutine, never the task (names are unique per task)
+            handler = f"task:{task.get_coro().__qualname__}" if task is not None else 'callback'
+        # Start the stack at the callback the loop was running, not the loop itself
+        start = 0
+        for index, f in enumerate(frames):
+            if f.name == '_run' and f.filename.endswith(os.path.join('asyncio', 'events.py')):
+                start = index + 1
+        stack = []
+        for f in frames[start:][-STACK_DEPTH:]:
+            filename = os.path.relpath(f.filename, _ROOT) if f.filename.startswith(_ROOT) else f.filename
+            stack.append(f"{filename}:{f.lineno} in {f.name}" + (f": {f.line}" if f.line else ""))
+        return _Capture(handler, update_id, blocking_site(frames), stack)
+
+    def _record(self, capture: _Capture, duration: float):
+        self.stalls += 1
+        key = (capture.handler, capture.site)
+        site = self._sites.get(key)
+        if site is None:
+            site = self._sites[key] = StallSite(capture.handler, capture.site)
+        site.count += 1
+        site.total += duration
+        site.max = max(site.max, duration)
+        site.last_update_id = capture.update_id
+        site.stack = capture.stack
+        LOOP_STALLS.inc(handler=capture.handler)
+        update = f" (update {capture.update_id})" if capture.update_id is not None else ""
+        logger.warning(
+            f"Event loop blocked for {duration * 1000:.0f} ms in {capture.handler}{update} at {capture.site}"
+        )
+
+    def top_offenders(self, limit: int = 10) -> List[StallSite]:
+        return sorted(self._sites.values(), key=lambda site: site.total, reverse=True)[:limit]
+
+    def report(self, limit: int = 10) -> str:
+        """Top blocking call sites by total time blocked, with a sample stack each"""
+        lines = [f"Event loop stalls over {self.threshold * 1000:.0f} ms: {self.stalls}"]
+        for rank, site in enumerate(self.top_offenders(limit), 1):
+            lines.append(
+                f"{rank:2}. {site.count}x, {site.total:.2f}s total, {site.max * 1000:.0f} ms max"
+                f"  {site.handler}  {site.site}"
+            )
+            lines.extend(f"      {frame}" for frame in site.stack)
+        return '\n'.join(lines)
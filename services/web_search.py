@@ -1,72 +1,161 @@
-import requests
+import json
 import logging
-from services.gemini_service import GeminiService
+import time
+from typing import Dict, Optional, Tuple
+from services.cache import SingleFlight, TTLCache, normalize_prompt
+from services.gemini_service import GeminiService, is_error_response
+from services.http_client import HttpClient
+from services.metrics import track_call
 from config.config import Config
 
 logger = logging.getLogger(__name__)
 
 class WebSearchService:
-    def __init__(self):
-        self.gemini = GeminiService()
-        self.search_url = "https://serpapi.com/search"
+    """SerpApi search with a Gemini summary of the results.
+
+    Results are cached per normalized query, ``num``, ``gl`` and ``hl``.
+    Entries are fresh for ``SEARCH_CACHE_TTL`` seconds and are then served
+    stale for up to ``SEARCH_CACHE_STALE_TTL`` more while a background
+    refresh runs. Concurrent identical searches share one SerpApi call and
+    one summarization.
+    """
+
+    def __init__(self, http: HttpClient, gemini: Optional[GeminiService] = None):
+        self.http = http
+        self.gemini = gemini or GeminiService()
+        self.search_url = Config.SERPAPI_URL
         self.api_key = Config.SERPAPI_KEY
+        self.fresh_ttl = Config.SEARCH_CACHE_TTL
+        self.cache = TTLCache(
+            max_entries=Config.SEARCH_CACHE_MAX_ENTRIES,
+            max_bytes=Config.SEARCH_CACHE_MAX_BYTES,
+            ttl=Config.SEARCH_CACHE_TTL + Config.SEARCH_CACHE_STALE_TTL
+        )
+        self._inflight = SingleFlight()
+        self._refreshes = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.api_calls = 0
+
+    @staticmethod
+    def make_key(query: str, num_results: int, gl: str, hl: str) -> Tuple[str, int, str, str]:
+        return (normalize_prompt(query), num_results, gl, hl)
+
+    async def search(self, query: str, num_results: int = 5, user_id: Optional[int] = None,
+                     gl: Optional[str] = None, hl: Optional[str] = None) -> dict:
+        gl = gl or Config.SEARCH_GL
+        hl = hl or Config.SEARCH_HL
+        key = self.make_key(query, num_results, gl, hl)
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            fetched_at, result = entry
+            self.hits += 1
+            if time.monotonic() - fetched_at > self.fresh_ttl:
+                self.stale_hits += 1
+                self._revalidate(key, query, num_results, gl, hl, user_id)
+            return result
 
-    async def search(self, query: str, num_results: int = 5) -> dict:
+        self.misses += 1
+        result, shared = await self._inflight.do(
+            key, lambda: self._fetch_and_store(key, query, num_results, gl, hl, user_id)
+        )
+        if shared:
+            self.coalesced += 1
+        return result
+
+    def _revalidate(self, key, query, num_results, gl, hl, user_id):
+        if key in self._inflight:
+            return
+        task, _ = self._inflight.start(
+            key, lambda: self._fetch_and_store(key, query, num_results, gl, hl, user_id)
+        )
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+
+    async def _fetch_and_store(self, key, query, num_results, gl, hl, user_id) -> dict:
+        result = await self._fetch(query, num_results, gl, hl, user_id)
+        # Never pin a failed summary in the cache
+        if not is_error_response(result['summary']):
+            size = len(json.dumps(result).encode())
+            self.cache.set(key, (time.monotonic(), result), size=size)
+        return result
+
+    async def _fetch(self, query: str, num_results: int, gl: str, hl: str,
+                     user_id: Optional[int]) -> dict:
         try:
             logger.info(f"Starting SerpApi search for: {query}")
-            
+            self.api_calls += 1
+
             # Parameters for Google search via SerpApi
             params = {
                 'q': query,
                 'api_key': self.api_key,
                 'engine': 'google',
                 'num': num_results,
-                'gl': 'us',  # Google country
-                'hl': 'en'   # Language
+                'gl': gl,  # Google country
+                'hl': hl   # Language
             }
-            
-            response = requests.get(
-                self.search_url,
-                params=params,
-                timeout=30
-            )
-            response.raise_for_status()
+
+            with track_call('serpapi', 'search'):
+                response = await self.http.get(
+                    self.search_url,
+                    params=params
+                )
+                response.raise_for_status()
             data = response.json()
-            
+
             # Extract organic search results
             organic_results = data.get('organic_results', [])
             results = []
-            
+
             for result in organic_results[:num_results]:
                 results.append({
                     'title': result.get('title', 'No title'),
                     'link': result.get('link', ''),
                     'snippet': result.get('snippet', 'No description available')
                 })
-            
+
             logger.info(f"Found {len(results)} results")
-            
+
             if not results:
                 return {
                     'results': [],
                     'summary': "No search results found."
                 }
-            
+
             # Format results for summary
             results_text = "\n\n".join([
                 f"Title: {r['title']}\nURL: {r['link']}\nDescription: {r['snippet']}"
                 for r in results
             ])
-            
+
             # Get AI summary of results
             summary_prompt = f"Summarize these search results for '{query}':\n\n{results_text}"
-            ai_summary = await self.gemini.get_chat_response(summary_prompt)
-            
+            # Results are cached per query already; the prompt itself is one-off
+            ai_summary = await self.gemini.get_chat_response(summary_prompt, user_id, use_cache=False)
+
             return {
                 'results': results,
                 'summary': ai_summary
             }
-            
+
         except Exception as e:
             logger.error(f"Search error: {e}")
-            raise 
\ No newline at end of file
+            raise
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'api_calls': self.api_calls,
+            # Each avoided search saves one SerpApi call and one summarization
+            'saved_searches': max(lookups - self.api_calls, 0),
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.cache)
+        }
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from typing import Optional
+from telegram import Update
+from telegram.ext import Application
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+class UpdateDeduplicator:
+    """Drops Telegram updates that were already accepted.
+
+    Telegram re-delivers an update when a webhook response is lost or slow,
+    and with several workers the retry may land on a different process. A
+    small in-process LRU catches local repeats cheaply; the shared store
+    (``DatabaseOperations.claim_update``) catches repeats across workers.
+    """
+
+    def __init__(self, db_ops=None, capacity: int = 10000):
+        self.db_ops = db_ops
+        self.capacity = capacity
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+
+    async def is_new(self, update_id: int) -> bool:
+        if update_id in self._seen:
+            return False
+        self._seen[update_id] = None
+        if len(self._seen) > self.capacity:
+            self._seen.popitem(last=False)
+        if self.db_ops is not None:
+            return await self.db_ops.claim_update(update_id)
+        return True
+
+class WebhookApp:
+    """Minimal ASGI app that feeds webhook updates into a PTB Application.
+
+    Each worker process owns one Application. Incoming updates are put on the
+    application's update queue and acknowledged right away; processing
+    happens in the background through the configured update processor. On
+    shutdown the worker stops accepting updates (Telegram retries them
+    elsewhere) and drains whatever it already accepted; handlers still
+    running after ``WEBHOOK_DRAIN_TIMEOUT`` are cancelled.
+    """
+
+    def __init__(self, application: Application, db_ops=None):
+        self.application = application
+        self.dedup = UpdateDeduplicator(db_ops)
+        self.path = Config.WEBHOOK_PATH
+        self.secret = Config.WEBHOOK_SECRET
+        self.draining = False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    logger.error(f"Webhook worker failed to start: {e}")
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        await self.application.initialize()
+        if self.application.post_init:
+            await self.application.post_init(self.application)
+        await self.application.start()
+        logger.info("Webhook worker started")
+
+    async def shutdown(self):
+        """Stop accepting updates and finish the ones already queued"""
+        self.draining = True
+        logger.info("Webhook worker draining pending updates")
+        try:
+            # Application.stop waits for queued updates and running handlers
+            await asyncio.wait_for(self.application.stop(), Config.WEBHOOK_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Drain timed out; cancelling the updates still being processed")
+            # Handlers must be gone before post_stop and post_shutdown close what they use
+            await self.application.update_processor.shutdown()
+        if self.application.post_stop:
+            await self.application.post_stop(self.application)
+        await self.application.shutdown()
+        if self.application.post_shutdown:
+            await self.application.post_shutdown(self.application)
+        logger.info("Webhook worker stopped")
+
+    async def _respond(self, send, status: int, body: bytes = b''):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'text/plain'), (b'content-length', str(len(body)).encode())]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _read_body(self, receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    def _header(self, scope, name: bytes) -> Optional[str]:
+        for key, value in scope.get('headers', []):
+            if key.lower() == name:
+                return value.decode()
+        return None
+
+    async def _http(self, scope, receive, send):
+        if scope['path'] == '/healthz':
+            await self._respond(send, 503 if self.draining else 200, b'draining' if self.draining else b'ok')
+            return
+        if scope['path'] != self.path or scope['method'] != 'POST':
+            await self._respond(send, 404)
+            return
+        if self.secret and self._header(scope, b'x-telegram-bot-api-secret-token') != self.secret:
+            await self._respond(send, 403)
+            return
+        if self.draining:
+            # A non-2xx status makes Telegram redeliver the update later
+            await self._respond(send, 503)
+            return
+
+        try:
+            data = json.loads(await self._read_body(receive))
+            update = Update.de_json(data, self.application.bot)
+        except Exception as e:
+            logger.error(f"Invalid webhook payload: {e}")
+            update = None
+        if update is None:
+            await self._respond(send, 400)
+            return
+
+        if await self.dedup.is_new(update.update_id):
+            await self.application.update_queue.put(update)
+        else:
+            logger.info(f"Skipping duplicate update {update.update_id}")
+        await self._respond(send, 200)
+
+async def register_webhook(application: Application):
+    """Point Telegram at our webhook without dropping pending updates"""
+    await application.bot.set_webhook(
+        url=Config.WEBHOOK_URL.rstrip('/') + Config.WEBHOOK_PATH,
+        secret_token=Config.WEBHOOK_SECRET or None,
+        max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=Update.ALL_TYPES,
+        drop_pending_updates=Config.DROP_PENDING_UPDATES
+    )
+    logger.info(f"Webhook registered at {Config.WEBHOOK_URL}")
@@ -0,0 +1,8 @@
+"""Shared test setup: the project root on the path and an offline configuration."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Applies the benchmarks' offline settings before any project module reads its config
+import benchmarks.run  # noqa: E402,F401
@@ -0,0 +1,114 @@
+"""Admission control: rate limits, refunds and shedding of heavy jobs."""
+import asyncio
+import pytest
+from database.drivers import MemoryDriver
+from services.admission import AdmissionController, DatabaseLimitStore, Limit, MemoryLimitStore, Rejected
+
+def controller(**overrides):
+    options = dict(store=MemoryLimitStore(max_entries=100), user_limits={}, global_limits={},
+                   heavy_classes=(), heavy_concurrency=1, heavy_wait=0.05)
+    options.update(overrides)
+    return AdmissionController(**options)
+
+async def admit(admission, command_class, user_id):
+    async with admission.admit(command_class, user_id):
+        pass
+
+async def takes_left(store, key, limit):
+    """Drain a bucket, counting the tokens it still had"""
+    count = 0
+    while not await store.take(key, limit):
+        count += 1
+    return count
+
+def test_user_limit_rejects_with_a_retry_hint():
+    admission = controller(user_limits={'search': Limit(2, 60)})
+
+    async def scenario():
+        await admit(admission, 'search', 1)
+        await admit(admission, 'search', 1)
+        with pytest.raises(Rejected) as rejected:
+            await admit(admission, 'search', 1)
+        # Other users and other classes have buckets of their own
+        await admit(admission, 'search', 2)
+        await admit(admission, 'chat', 1)
+        return rejected.value
+
+    rejection = asyncio.run(scenario())
+    assert rejection.reason == 'rate'
+    assert 25 < rejection.retry_after <= 30
+    assert "web search" in rejection.message
+    assert admission.stats()['admitted'] == 4
+    assert admission.stats()['rate_limited'] == 1
+
+def test_empty_global_bucket_refunds_the_user_token():
+    store = MemoryLimitStore(max_entries=100)
+    user_limit = Limit(3, 60)
+    admission = controller(store=store, user_limits={'search': user_limit}, global_limits={'search': Limit(1, 60)})
+
+    async def scenario():
+        await admit(admission, 'search', 1)
+        with pytest.raises(Rejected):
+            await admit(admission, 'search', 2)
+        return await takes_left(store, 'user:2:search', user_limit)
+
+    assert asyncio.run(scenario()) == 3
+
+def test_heavy_jobs_over_capacity_are_shed_and_refunded():
+    store = MemoryLimitStore(max_entries=100)
+    user_limit = Limit(3, 60)
+    admission = controller(store=store, user_limits={'pdf': user_limit}, heavy_classes={'pdf'})
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def running_job():
+            async with admission.admit('pdf', 1):
+                await release.wait()
+
+        job = asyncio.create_task(running_job())
+        while not admission.heavy_in_flight:
+            await asyncio.sleep(0)
+        with pytest.raises(Rejected) as rejected:
+            await admit(admission, 'pdf', 2)
+        release.set()
+        await job
+        # The slot is free again once the running job is done
+        await admit(admission, 'pdf', 2)
+        return rejected.value, await takes_left(store, 'user:2:pdf', user_limit)
+
+    rejection, left = asyncio.run(scenario())
+    assert rejection.reason == 'busy'
+    assert rejection.retry_after > 0
+    # Only the admitted request kept its token
+    assert left == 2
+    stats = admission.stats()
+    assert (stats['admitted'], stats['busy'], stats['heavy_in_flight'], stats['heavy_waiting']) == (2, 1, 0, 0)
+
+def test_users_are_notified_once_per_wait():
+    admission = controller()
+    rejection = Rejected('search', 'rate', retry_after=60)
+    assert admission.should_notify(1, rejection)
+    assert not admission.should_notify(1, rejection)
+    assert admission.should_notify(2, rejection)
+    assert admission.should_notify(1, Rejected('search', 'busy', retry_after=60))
+
+def test_database_store_never_spends_a_token_twice():
+    driver = MemoryDriver(latency=0.001)
+    limit = Limit(3, 60)
+    # Two workers sharing one collection
+    stores = [DatabaseLimitStore(driver), DatabaseLimitStore(driver)]
+
+    async def scenario():
+        assert await stores[0].take('user:1:search', limit) == 0
+        waits = await asyncio.gather(*(stores[i % 2].take('user:1:search', limit) for i in range(6)))
+        await stores[1].refund('user:1:search', limit)
+        return waits, await takes_left(stores[0], 'user:1:search', limit)
+
+    waits, left = asyncio.run(scenario())
+    assert all(wait > 0 for wait in waits if wait)
+    # Two tokens were left for six racing takes
+    assert waits.count(0) <= 2
+    # The refund comes back, along with anything the racing takes failed to spend
+    assert left == 1 + 2 - waits.count(0)
+    assert len(driver.collections['rate_limits']) == 1
@@ -0,0 +1,49 @@
+"""The event loop stays responsive while handlers wait on a slow database."""
+import asyncio
+import time
+from benchmarks.fakes import Latency
+from benchmarks.macro import LoopLagProbe, MacroOptions, run_macro
+from database.db_operations import DatabaseOperations
+from database.drivers import MemoryDriver
+
+DB_LATENCY = 0.3
+
+class BlockingDriver(MemoryDriver):
+    """A driver that sleeps on the loop, like a synchronous client would"""
+
+    async def _delay(self):
+        time.sleep(self.latency)
+
+def test_handlers_keep_loop_lag_flat_with_slow_database(monkeypatch):
+    import main
+    from config.config import Config
+
+    # run_macro points the bot at its fake servers and swaps the container; undo that afterwards
+    for name in ('TELEGRAM_BASE_URL', 'TELEGRAM_BASE_FILE_URL', 'GEMINI_API_BASE', 'SERPAPI_URL'):
+        monkeypatch.setattr(Config, name, getattr(Config, name))
+    monkeypatch.setattr(main, 'container', main.container)
+
+    options = MacroOptions(
+        users=20, messages=3, db_latency=DB_LATENCY,
+        latency=Latency(bot_api=0.001, gemini=0.01, serpapi=0.01),
+        # Write-through sends every write to the slow database while the user waits
+        scenarios=['text_write_through', 'websearch']
+    )
+    results = asyncio.run(run_macro(options))
+
+    for name, result in results.items():
+        assert result['updates'] == options.users * options.messages, name
+        # Users wait on the database side by side, not one after another
+        assert result['duration_s'] < options.messages * 10 * DB_LATENCY, name
+        # A single blocking round trip would show up as a lag of DB_LATENCY
+        assert result['loop_lag_max_ms'] < DB_LATENCY * 1000 / 2, name
+
+def test_probe_detects_a_blocking_driver():
+    db = DatabaseOperations(BlockingDriver(latency=DB_LATENCY), write_behind=False)
+
+    async def scenario():
+        async with LoopLagProbe() as probe:
+            await db.get_chat_history(1, limit=5)
+        return probe.summary()
+
+    assert asyncio.run(scenario())['loop_lag_max_ms'] >= DB_LATENCY * 1000 * 0.8
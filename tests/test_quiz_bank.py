@@ -0,0 +1,64 @@
+"""Validation of generated quiz questions."""
+import json
+import pytest
+from services.quiz_bank import parse_quiz_json, question_id, validate_question
+
+OPTIONS = ["Lists", "Tuples", "Sets", "Dicts"]
+
+def item(**overrides):
+    raw = {'question': "Which type is immutable?", 'options': list(OPTIONS), 'answer': 1}
+    raw.update(overrides)
+    return raw
+
+@pytest.mark.parametrize('answer', [1, "1", "b", "B", " Tuples ", "tuples"])
+def test_answer_forms_resolve_to_an_index(answer):
+    assert validate_question(item(answer=answer))['answer'] == 1
+
+@pytest.mark.parametrize('raw', [
+    "not a dict",
+    item(question="  "),
+    item(question="x" * 301),
+    item(options=OPTIONS[:3]),
+    item(options=OPTIONS + ["Bytes"]),
+    item(options="Lists, Tuples, Sets, Dicts"),
+    item(options=["Lists", "lists", "Sets", "Dicts"]),
+    item(options=["Lists", "", "Sets", "Dicts"]),
+    item(options=["Lists", "x" * 101, "Sets", "Dicts"]),
+    item(answer=4),
+    item(answer=-1),
+    item(answer="7"),
+    item(answer="e"),
+    item(answer="Strings"),
+    item(answer=True),
+    item(answer=None),
+])
+def test_unusable_questions_are_rejected(raw):
+    assert validate_question(raw) is None
+
+def test_clean_question_is_normalized():
+    question = validate_question(item(question=" Which type is immutable? ", options=[" Lists", *OPTIONS[1:]]))
+    assert question == {
+        'qid': question_id("Which type is immutable?", OPTIONS),
+        'question': "Which type is immutable?",
+        'options': OPTIONS,
+        'answer': 1
+    }
+
+def test_question_id_ignores_case_spacing_and_option_order():
+    assert question_id("Which  type is IMMUTABLE?", list(reversed(OPTIONS))) == question_id(
+        "which type is immutable?", OPTIONS
+    )
+
+def test_parse_drops_invalid_and_duplicate_items():
+    items = [item(), item(answer=9), item(question="WHICH type is immutable?"), item(question="Another?", answer="a")]
+    reply = f"```json\n{json.dumps(items)}\n```"
+    questions = parse_quiz_json(reply)
+    assert [q['question'] for q in questions] == ["Which type is immutable?", "Another?"]
+    assert [q['answer'] for q in questions] == [1, 0]
+
+def test_parse_accepts_a_questions_object():
+    assert len(parse_quiz_json(json.dumps({'questions': [item()]}))) == 1
+
+@pytest.mark.parametrize('reply', ["", "not json", "```json\n[{\"question\": ```", "42", json.dumps({'items': []})])
+def test_parse_returns_nothing_for_unusable_replies(reply):
+    assert parse_quiz_json(reply) == []
@@ -0,0 +1,96 @@
+"""Markdown rendering to Telegram HTML and splitting into sendable chunks."""
+import re
+from html import unescape
+from html.parser import HTMLParser
+from services.renderer import render_html, render_message, split_html
+
+BROKEN_ENTITY = re.compile(r'&(?!(?:amp|lt|gt|quot|#\d+);)')
+
+class TagChecker(HTMLParser):
+    """Fails on unbalanced tags; collects the visible text"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []
+        self.text = []
+
+    def handle_starttag(self, tag, attrs):
+        self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        assert self.stack and self.stack[-1] == tag, f"</{tag}> closes {self.stack}"
+        self.stack.pop()
+
+    def handle_data(self, data):
+        self.text.append(data)
+
+def visible_text(html: str) -> str:
+    checker = TagChecker()
+    checker.feed(html)
+    checker.close()
+    assert not checker.stack, f"unclosed tags {checker.stack}"
+    return ''.join(checker.text)
+
+def squeeze(text: str) -> str:
+    return re.sub(r'\s+', '', text)
+
+def test_inline_markup_and_escaping():
+    html = render_html("**bold** *it* `a<b>` ~~gone~~ [docs](https://example.com/?a=1&b=2) 1 < 2 & 3")
+    assert html == (
+        '<b>bold</b> <i>it</i> <code>a&lt;b&gt;</code> <s>gone</s> '
+        '<a href="https://example.com/?a=1&amp;b=2">docs</a> 1 &lt; 2 &amp; 3'
+    )
+
+def test_headings_bullets_and_labels():
+    assert render_html("## **Overview**\n- one\n* two\nNote: careful") == (
+        "<b>Overview</b>\n• one\n• two\n<b>Note:</b> careful"
+    )
+
+def test_code_blocks_are_escaped_verbatim_and_always_closed():
+    assert render_html("```python\nx = **1** < 2\n```") == (
+        '<pre><code class="language-python">x = **1** &lt; 2</code></pre>'
+    )
+    # A reply cut off mid-stream still renders well-formed HTML
+    assert render_html("```\nstill streaming") == "<pre><code>still streaming</code></pre>"
+
+def test_unterminated_markup_stays_literal():
+    assert render_html("**not bold and *not italic") == "**not bold and *not italic"
+
+def test_decoration_keeps_an_opening_heading():
+    assert render_message("# Title\nBody") == ["🤖 <b>Title</b>\nBody"]
+
+def test_decoration_follows_tone_priority():
+    # An example wins over a warning, whichever comes first
+    assert render_message("Error handling, for example")[0].startswith("💡 ")
+    assert render_message("Done, but one error remains")[0].startswith("⚠️ ")
+    assert render_message("Done!")[0].startswith("✅ ")
+    assert render_message("Done!", decorated=False) == ["Done!"]
+
+def test_short_html_is_one_chunk():
+    assert split_html("<b>hi</b>", limit=100) == ["<b>hi</b>"]
+    assert split_html("  \n", limit=100) == []
+
+def test_split_respects_limit_tags_and_entities():
+    markdown = ("Some **bold text & more** with <angles> and `code & stuff`.\n\n" * 40
+                + "```\n" + "x = a & b < c\n" * 60 + "```\n" + "Tail " * 200)
+    html = render_html(markdown)
+    for limit in (64, 200, 1000):
+        chunks = split_html(html, limit=limit)
+        assert len(chunks) > 1
+        for chunk in chunks:
+            assert len(chunk) <= limit
+            assert not BROKEN_ENTITY.search(chunk), chunk
+            visible_text(chunk)  # balanced on its own
+        # Nothing is lost or duplicated, apart from whitespace at the cuts
+        assert squeeze(''.join(unescape(visible_text(chunk)) for chunk in chunks)) == squeeze(unescape(visible_text(html)))
+
+def test_split_reopens_tags_across_chunks():
+    html = render_html("```\n" + "line of code\n" * 50 + "```")
+    chunks = split_html(html, limit=120)
+    assert len(chunks) > 1
+    assert all(chunk.startswith("<pre><code>") and chunk.endswith("</code></pre>") for chunk in chunks)
+
+def test_split_prefers_paragraph_boundaries():
+    html = render_html("\n\n".join(f"Paragraph {i} " + "word " * 10 for i in range(10)))
+    for chunk in split_html(html, limit=200):
+        assert chunk.startswith("Paragraph")
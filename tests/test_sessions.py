@@ -0,0 +1,83 @@
+"""Session stores: compare-and-set steps, replacement and size limits."""
+import asyncio
+import pytest
+from database.drivers import MemoryDriver
+from services.sessions import DatabaseSessionStore, MemorySessionStore, SessionTooLarge
+
+STORES = {
+    'memory': lambda: MemorySessionStore(ttl=60, max_entries=10),
+    'database': lambda: DatabaseSessionStore(MemoryDriver(), ttl=60)
+}
+
+@pytest.fixture(params=list(STORES))
+def store(request):
+    return STORES[request.param]()
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_update_applies_once_per_version(store):
+    async def scenario():
+        session = await store.put('quiz:1', {'step': 0})
+        assert await store.update('quiz:1', session.version, {'step': 1})
+        # A second worker holding the same version loses the race
+        assert not await store.update('quiz:1', session.version, {'step': 99})
+        current = await store.get('quiz:1')
+        assert current.data == {'step': 1}
+        assert await store.update('quiz:1', current.version, {'step': 2})
+        return await store.get('quiz:1')
+
+    assert run(scenario()).data == {'step': 2}
+
+def test_concurrent_steps_apply_exactly_once(store):
+    async def scenario():
+        session = await store.put('quiz:1', {'step': 0})
+        results = await asyncio.gather(*(
+            store.update('quiz:1', session.version, {'step': i}) for i in range(1, 6)
+        ))
+        return results, await store.get('quiz:1')
+
+    results, current = run(scenario())
+    assert results.count(True) == 1
+    assert current.data == {'step': results.index(True) + 1}
+
+def test_put_invalidates_steps_from_the_replaced_session(store):
+    async def scenario():
+        old = await store.put('quiz:1', {'topic': 'old'})
+        assert await store.update('quiz:1', old.version, {'topic': 'old', 'step': 1})
+        new = await store.put('quiz:1', {'topic': 'new'})
+        # old.version + 1 is what the stale worker would see after its own step
+        assert not await store.update('quiz:1', old.version + 1, {'topic': 'old', 'step': 2})
+        return new, await store.get('quiz:1')
+
+    new, current = run(scenario())
+    assert current.data == {'topic': 'new'}
+    assert current.version == new.version
+
+def test_missing_or_deleted_sessions_never_update(store):
+    async def scenario():
+        assert await store.get('quiz:1') is None
+        assert not await store.update('quiz:1', 1, {'step': 1})
+        session = await store.put('quiz:1', {'step': 0})
+        await store.delete('quiz:1')
+        assert await store.get('quiz:1') is None
+        return await store.update('quiz:1', session.version, {'step': 1})
+
+    assert run(scenario()) is False
+
+def test_oversized_sessions_are_refused(store, monkeypatch):
+    from config.config import Config
+
+    monkeypatch.setattr(Config, 'SESSION_MAX_BYTES', 64)
+
+    async def scenario():
+        with pytest.raises(SessionTooLarge):
+            await store.put('quiz:1', {'topic': 'x' * 100})
+        session = await store.put('quiz:1', {'step': 0})
+        with pytest.raises(SessionTooLarge):
+            await store.update('quiz:1', session.version, {'topic': 'x' * 100})
+        # The refused step leaves the session as it was
+        return await store.get('quiz:1')
+
+    current = run(scenario())
+    assert current.data == {'step': 0}
@@ -0,0 +1,72 @@
+"""Updates of one chat run in order; different chats run side by side, cheap ones first."""
+import asyncio
+from collections import defaultdict
+from benchmarks.macro import UpdateFactory
+from services.update_processor import ChatOrderedUpdateProcessor
+
+MAX_CONCURRENT = 8
+FLOOD_CHAT = 1
+FLOOD_UPDATES = 50
+OTHER_CHATS = range(2, 22)
+OTHER_UPDATES = 3
+
+def test_flooded_chat_stays_in_order_without_holding_up_others():
+    factory = UpdateFactory(None)
+    processor = ChatOrderedUpdateProcessor(MAX_CONCURRENT)
+    sent = defaultdict(list)
+    handled = defaultdict(list)
+    finished = []  # chat of every handled update, in completion order
+    active = defaultdict(int)
+    peak = {'chat': 0, 'total': 0}
+
+    async def handle(chat_id, text):
+        active[chat_id] += 1
+        peak['chat'] = max(peak['chat'], active[chat_id])
+        peak['total'] = max(peak['total'], sum(active.values()))
+        await asyncio.sleep(0.005)
+        handled[chat_id].append(text)
+        finished.append(chat_id)
+        active[chat_id] -= 1
+
+    def submit(chat_id, text):
+        sent[chat_id].append(text)
+        update = factory.message(chat_id, text)
+        return processor.process_update(update, handle(chat_id, text))
+
+    async def scenario():
+        # The flood arrives first, then everyone else
+        jobs = [submit(FLOOD_CHAT, f"flood {i}") for i in range(FLOOD_UPDATES)]
+        jobs += [submit(chat_id, f"message {i}") for i in range(OTHER_UPDATES) for chat_id in OTHER_CHATS]
+        await asyncio.gather(*jobs)
+
+    asyncio.run(scenario())
+
+    assert handled == sent
+    assert peak['chat'] == 1
+    assert 1 < peak['total'] <= MAX_CONCURRENT
+    # Everyone else is done while most of the flood is still waiting its turn
+    last_other = max(i for i, chat_id in enumerate(finished) if chat_id != FLOOD_CHAT)
+    assert finished[:last_other].count(FLOOD_CHAT) < FLOOD_UPDATES / 2
+    assert processor.in_flight == 0 and processor.queue_depth == 0
+
+def test_cheap_updates_overtake_heavy_ones_at_the_cap():
+    factory = UpdateFactory(None)
+    processor = ChatOrderedUpdateProcessor(1, max_waiting_chats=4)
+    order = []
+
+    async def handle(name, delay=0.0):
+        await asyncio.sleep(delay)
+        order.append(name)
+
+    async def scenario():
+        busy = asyncio.create_task(processor.process_update(factory.message(1, "hello"), handle('busy', 0.05)))
+        await asyncio.sleep(0.01)
+        # A web search arrives before the text message, but waits behind it
+        await asyncio.gather(
+            busy,
+            processor.process_update(factory.message(2, "/websearch news"), handle('heavy')),
+            processor.process_update(factory.message(3, "hi"), handle('text'))
+        )
+
+    asyncio.run(scenario())
+    assert order == ['busy', 'text', 'heavy']
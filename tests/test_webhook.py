@@ -0,0 +1,46 @@
+"""Webhook shutdown never closes resources under a running handler."""
+import asyncio
+from telegram.ext import ApplicationBuilder, MessageHandler, filters
+from benchmarks.fakes import FakeBackend, Latency
+from benchmarks.macro import UpdateFactory
+from config.config import Config
+from services.update_processor import ChatOrderedUpdateProcessor
+from services.webhook import WebhookApp
+
+def test_shutdown_cancels_handlers_that_outlast_the_drain(monkeypatch):
+    monkeypatch.setattr(Config, 'WEBHOOK_DRAIN_TIMEOUT', 0.1)
+    events = []
+
+    async def slow_handler(update, context):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            events.append('cancelled')
+            raise
+
+    async def post_stop(application):
+        events.append('stopped')
+
+    async def post_shutdown(application):
+        events.append('closed')
+
+    async def scenario():
+        backend = FakeBackend(Latency(bot_api=0))
+        url = await backend.start()
+        try:
+            application = (
+                ApplicationBuilder().token('123456:test').base_url(f"{url}/bot")
+                .concurrent_updates(ChatOrderedUpdateProcessor(4))
+                .post_stop(post_stop).post_shutdown(post_shutdown).build()
+            )
+            application.add_handler(MessageHandler(filters.TEXT, slow_handler))
+            webhook = WebhookApp(application)
+            await webhook.startup()
+            await application.update_queue.put(UpdateFactory(application.bot).message(1, "hello"))
+            await asyncio.sleep(0.05)
+            await webhook.shutdown()
+        finally:
+            await backend.close()
+
+    asyncio.run(scenario())
+    assert events == ['cancelled', 'stopped', 'closed']